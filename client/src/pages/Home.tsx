@@ -12,6 +12,7 @@ interface ChatMessage {
   imageUrl?: string;
   messageClass?: string;
   isLoading?: boolean;
+  isStreaming?: boolean;
   created_at?: string;
   metadata?: any;
 }
@@ -22,6 +23,53 @@ interface HomeProps {
 
 const API_BASE_URL = `${import.meta.env.VITE_SERVER_URL}/api`;
 
+// Reads a streamed chat reply (server-sent events). onText gets the reply so
+// far after every chunk; resolves with the final payload, which has the same
+// shape as the plain JSON reply.
+async function readChatStream(res: Response, onText: (text: string) => void): Promise<any> {
+  if (!res.body || !(res.headers.get("Content-Type") || "").includes("text/event-stream")) {
+    return res.json();
+  }
+
+  const reader = res.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = "";
+  let text = "";
+
+  for (;;) {
+    const { done, value } = await reader.read();
+    if (done) break;
+    buffer += decoder.decode(value, { stream: true });
+
+    let boundary = buffer.indexOf("\n\n");
+    while (boundary !== -1) {
+      const block = buffer.slice(0, boundary);
+      buffer = buffer.slice(boundary + 2);
+      boundary = buffer.indexOf("\n\n");
+
+      let event = "message";
+      let data = "";
+      for (const line of block.split("\n")) {
+        if (line.startsWith("event:")) event = line.slice(6).trim();
+        else if (line.startsWith("data:")) data += line.slice(5).trim();
+      }
+      if (!data) continue;
+
+      const payload = JSON.parse(data);
+      if (event === "delta") {
+        text += payload.content;
+        onText(text);
+      } else if (event === "done") {
+        return payload;
+      } else if (event === "error") {
+        throw new Error(payload.details || payload.error || "Failed to process chat");
+      }
+    }
+  }
+
+  throw new Error("Chat stream ended unexpectedly");
+}
+
 const Home: React.FC<HomeProps> = ({ darkMode }) => {
   const [messages, setMessages] = useState<ChatMessage[]>([]);
   const [input, setInput] = useState("");
@@ -365,11 +413,13 @@ const handleImageUpload = async () => {
         method: "POST",
         headers: {
           "Content-Type": "application/json",
+          Accept: "text/event-stream",
           ...getAuthHeaders()
         },
         body: JSON.stringify({
           message: userMessage,
-          convo_id: conversationId
+          convo_id: conversationId,
+          stream: true
         }),
       });
 
@@ -378,11 +428,20 @@ const handleImageUpload = async () => {
         throw new Error(errorData.error || `HTTP error! status: ${res.status}`);
       }
 
-      const data = await res.json();
+      // Show the reply as it is generated, in place of the loading indicator
+      const data = await readChatStream(res, (partial) => {
+        setMessages((prev) =>
+          prev.map((msg) =>
+            msg.isLoading || msg.isStreaming
+              ? { ...msg, text: partial, isLoading: false, isStreaming: true }
+              : msg
+          )
+        );
+      });
 
       // Remove loading indicator and temp message, add real messages
       setMessages((prev) => {
-        const filtered = prev.filter((msg) => !msg.isLoading);
+        const filtered = prev.filter((msg) => !msg.isLoading && !msg.isStreaming);
         return [
           ...filtered.slice(0, -1), // Remove temp user message
           {
@@ -409,7 +468,7 @@ const handleImageUpload = async () => {
       setError(error.message || "Failed to send message");
       
       setMessages((prev) => {
-        const filtered = prev.filter((msg) => !msg.isLoading);
+        const filtered = prev.filter((msg) => !msg.isLoading && !msg.isStreaming);
         return [
           ...filtered,
           {
@@ -0,0 +1,275 @@
+"""
+Cache of LLM advice texts keyed by diagnosis bucket.
+
+The advice prompt only depends on the status, the predicted class and the
+confidence, so a few pre-generated texts per (status, class, confidence
+bucket) cover almost every request. The LLM is asked to write the
+confidence as a {confidence} placeholder, which is filled in with the
+request's exact percentage; texts that contain any other percentage are
+never cached, so a cached text can't show a wrong number.
+
+On a miss one text is generated while the caller waits, and nothing else,
+so a one-shot run pays for one completion. When a later request finds
+fewer fresh variants than configured (the rest still to generate, or past
+ttl_s), the key is topped up on the cache's refresh thread while the cached
+texts keep being served in rotation. Stale texts are served until then,
+but never past max_age_s. close() waits for a running refresh; interpreter
+exit does too, so completions already paid for are stored.
+respond_async() is the same for callers on an asyncio event loop: its miss
+goes through async_client, so many can be waiting at once, and the cache
+file is written from a thread so the loop keeps serving meanwhile.
+"""
+import os
+import re
+import sys
+import json
+import time
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+PLACEHOLDER = "{confidence}"
+
+# Upper bounds of the confidence buckets and the wording the prompt uses for
+# each. Coarse on purpose: the tone changes between buckets, the number is
+# always the placeholder.
+CONFIDENCE_BUCKETS = [
+    (0.50, "low"),
+    (0.70, "moderate"),
+    (0.90, "high"),
+    (1.01, "very high"),
+]
+
+_PERCENTAGE = re.compile(r"\d+(?:[.,]\d+)?\s*(?:%|percent)", re.IGNORECASE)
+
+TEMPLATE_INSTRUCTION = (
+    f"Wherever you mention the confidence, write exactly {PLACEHOLDER} "
+    "(including the braces) instead of a number. Do not write any other percentages."
+)
+
+
+def confidence_bucket(confidence):
+    """
+    Label of the bucket a confidence in [0, 1] falls into
+    """
+    for upper, label in CONFIDENCE_BUCKETS:
+        if confidence < upper:
+            return label
+    return CONFIDENCE_BUCKETS[-1][1]
+
+
+def is_valid_template(text):
+    """
+    A cached text may contain the placeholder, but never a literal percentage
+    """
+    return bool(text) and not _PERCENTAGE.search(text.replace(PLACEHOLDER, ""))
+
+
+class AdviceCache:
+    """
+    Rotating advice texts per key. client is anything with the OpenAI
+    chat.completions.create interface (see llm_stub.StubClient for tests),
+    async_client the same for AsyncOpenAI (needed by respond_async only).
+    """
+
+    def __init__(self, client, system_prompt, model="gpt-4o-mini", variants=3, ttl_s=7 * 86400, path=None,
+                 async_client=None, max_age_s=30 * 86400):
+        self.client = client
+        self.async_client = async_client
+        self.system_prompt = system_prompt
+        self.model = model
+        self.variants = max(1, variants)
+        self.ttl_s = ttl_s
+        self.max_age_s = max_age_s
+        self.path = path
+        self._entries = {}
+        self._cursor = {}
+        self._refreshing = set()
+        self._lock = threading.Lock()
+        # Writes of the file, one at a time so the newest snapshot lands last
+        self._save_lock = threading.Lock()
+        # One thread, not daemonic: concurrent.futures joins it at exit
+        self._refresher = ThreadPoolExecutor(max_workers=1, thread_name_prefix="advice-refresh")
+        self.counters = {"hits": 0, "misses": 0, "generated": 0, "rejected": 0, "refresh_errors": 0}
+        self._load()
+
+    @staticmethod
+    def key(status, predicted_class, confidence):
+        return f"{status}|{predicted_class}|{confidence_bucket(confidence)}"
+
+    def _messages(self, prompt):
+        return [
+            {"role": "system", "content": self.system_prompt},
+            {"role": "user", "content": prompt}
+        ]
+
+    def _complete(self, prompt):
+        completion = self.client.chat.completions.create(model=self.model, messages=self._messages(prompt))
+        return completion.choices[0].message.content
+
+    async def _complete_async(self, prompt):
+        completion = await self.async_client.chat.completions.create(model=self.model, messages=self._messages(prompt))
+        return completion.choices[0].message.content
+
+    def _generate(self, prompt_template):
+        """
+        One new template, or None if the LLM didn't stick to the placeholder
+        """
+        return self._accept(self._complete(f"{prompt_template}\n\n{TEMPLATE_INSTRUCTION}"))
+
+    async def _generate_async(self, prompt_template):
+        return self._accept(await self._complete_async(f"{prompt_template}\n\n{TEMPLATE_INSTRUCTION}"))
+
+    def _accept(self, text):
+        if not is_valid_template(text):
+            with self._lock:
+                self.counters["rejected"] += 1
+            return None
+        with self._lock:
+            self.counters["generated"] += 1
+        return text
+
+    @staticmethod
+    def _younger(variants, age_s, now):
+        return [v for v in variants if not age_s or now - v["created_at"] <= age_s]
+
+    def _fresh(self, key, now):
+        return self._younger(self._entries.get(key, []), self.ttl_s, now)
+
+    def _store(self, key, text):
+        now = time.time()
+        with self._lock:
+            # Stale variants are replaced as fresh ones arrive
+            variants = self._fresh(key, now) + [{"text": text, "created_at": now}]
+            self._entries[key] = variants[-self.variants:]
+
+    def _add(self, key, text):
+        self._store(key, text)
+        self._save()
+
+    def _refresh(self, key, prompt_template):
+        """
+        Tops the key up to the configured number of fresh variants
+        """
+        try:
+            for _ in range(self.variants * 2):
+                with self._lock:
+                    if len(self._fresh(key, time.time())) >= self.variants:
+                        break
+                text = self._generate(prompt_template)
+                if text is not None:
+                    self._add(key, text)
+        except Exception as e:
+            with self._lock:
+                self.counters["refresh_errors"] += 1
+            print(f"Advice cache refresh failed for {key}: {e}", file=sys.stderr)
+        finally:
+            with self._lock:
+                self._refreshing.discard(key)
+
+    def _schedule_refresh(self, key, prompt_template):
+        with self._lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+        try:
+            self._refresher.submit(self._refresh, key, prompt_template)
+        except RuntimeError:
+            # Closed, or the interpreter is exiting
+            with self._lock:
+                self._refreshing.discard(key)
+
+    def _lookup(self, key, prompt_template):
+        """
+        Next cached template for key in rotation, or None on a miss
+        """
+        now = time.time()
+        with self._lock:
+            # Past max_age_s a text is dropped, whether a refresh came or not
+            variants = self._younger(self._entries.get(key, []), self.max_age_s, now)
+            if variants:
+                self._entries[key] = variants
+            else:
+                self._entries.pop(key, None)
+            fresh = self._fresh(key, now)
+            if variants:
+                cursor = self._cursor.get(key, 0)
+                self._cursor[key] = cursor + 1
+                text = variants[cursor % len(variants)]["text"]
+                self.counters["hits"] += 1
+            else:
+                text = None
+                self.counters["misses"] += 1
+
+        if text is not None and len(fresh) < self.variants:
+            self._schedule_refresh(key, prompt_template)
+        return text
+
+    def respond(self, key, prompt_template, confidence_text):
+        """
+        Advice text for prompt_template (which mentions the confidence as the
+        placeholder) with confidence_text filled in
+        """
+        text = self._lookup(key, prompt_template)
+        if text is None:
+            text = self._generate(prompt_template)
+            if text is None:
+                # Not reusable; answer this request the uncached way
+                return self._complete(prompt_template.replace(PLACEHOLDER, confidence_text))
+            self._add(key, text)
+        return text.replace(PLACEHOLDER, confidence_text)
+
+    async def respond_async(self, key, prompt_template, confidence_text):
+        """
+        respond() for asyncio callers
+        """
+        text = self._lookup(key, prompt_template)
+        if text is None:
+            text = await self._generate_async(prompt_template)
+            if text is None:
+                return await self._complete_async(prompt_template.replace(PLACEHOLDER, confidence_text))
+            self._store(key, text)
+            if self.path:
+                await asyncio.to_thread(self._save)
+        return text.replace(PLACEHOLDER, confidence_text)
+
+    def _load(self):
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path) as f:
+                entries = json.load(f)
+            now = time.time()
+            self._entries = {
+                k: [v for v in self._younger(vs, self.max_age_s, now) if is_valid_template(v.get("text"))]
+                for k, vs in entries.items()
+            }
+        except (OSError, ValueError) as e:
+            print(f"Ignoring unreadable advice cache {self.path}: {e}", file=sys.stderr)
+
+    def _save(self):
+        if not self.path:
+            return
+        with self._save_lock:
+            with self._lock:
+                snapshot = json.dumps(self._entries)
+            tmp = f"{self.path}.{os.getpid()}.tmp"
+            try:
+                with open(tmp, "w") as f:
+                    f.write(snapshot)
+                os.replace(tmp, self.path)
+            except OSError as e:
+                print(f"Could not write advice cache {self.path}: {e}", file=sys.stderr)
+
+    def close(self):
+        """
+        Waits for a refresh in progress and stops taking new ones
+        """
+        self._refresher.shutdown(wait=True)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.counters)
+            stats["keys"] = len(self._entries)
+            stats["variants"] = sum(len(v) for v in self._entries.values())
+        return stats
@@ -0,0 +1,180 @@
+"""
+Inference backends. Each one imports only the runtime it needs, when it is
+loaded, so picking the TFLite backend with ai_edge_litert or tflite_runtime
+installed never imports TensorFlow.
+"""
+import os
+import sys
+import time
+import threading
+
+import numpy as np
+
+import runtime_config
+
+
+def _import_tensorflow():
+    import tensorflow as tf # pyright: ignore[reportMissingModuleSource]
+    runtime_config.configure_tensorflow(tf)
+    return tf
+
+
+def _tflite_interpreter():
+    """
+    The lightest TFLite interpreter class available
+    """
+    try:
+        from ai_edge_litert.interpreter import Interpreter # pyright: ignore[reportMissingImports]
+        return Interpreter
+    except ImportError:
+        pass
+    try:
+        from tflite_runtime.interpreter import Interpreter # pyright: ignore[reportMissingImports]
+        return Interpreter
+    except ImportError:
+        pass
+    return _import_tensorflow().lite.Interpreter
+
+
+class KerasBackend:
+    """
+    Runs the full Keras model.
+
+    model.predict() builds a data adapter and callbacks on every call, which
+    on a 128x128 input costs more than the forward pass. By default calls go
+    through a tf.function traced once at load for (None, H, W, 3) float32
+    input instead, so every batch size reuses the same graph.
+    """
+    name = "keras"
+
+    def __init__(self, model_path, compiled=True):
+        tf = _import_tensorflow()
+        self.model_path = model_path
+        self.model = tf.keras.models.load_model(model_path, compile=False)
+
+        self._infer = None
+        if compiled:
+            keras_model = self.model
+            spec = tf.TensorSpec((None,) + tuple(keras_model.input_shape[1:]), tf.float32, name="image")
+
+            @tf.function(input_signature=[spec])
+            def infer(batch):
+                return keras_model(batch, training=False)
+
+            infer.get_concrete_function()
+            self._infer = infer
+
+    def tracing_count(self):
+        """
+        Times the compiled function was traced; stays at 1 unless something retraced
+        """
+        return self._infer.experimental_get_tracing_count() if self._infer is not None else 0
+
+    def predict(self, batch):
+        if self._infer is None:
+            return self.model.predict(batch, verbose=0)
+        return self._infer(np.asarray(batch, dtype=np.float32)).numpy()
+
+
+class SavedModelBackend:
+    """
+    Runs the inference-only SavedModel written by export_model.py: one traced
+    serving function, no Keras objects or optimizer state to rebuild
+    """
+    name = "savedmodel"
+
+    def __init__(self, model_path):
+        tf = _import_tensorflow()
+        self.model_path = model_path
+        self._loaded = tf.saved_model.load(model_path)
+        self._serve = self._loaded.serve
+
+    def predict(self, batch):
+        return self._serve(np.asarray(batch, dtype=np.float32)).numpy()
+
+
+class TFLiteBackend:
+    """
+    Runs a TensorFlow Lite flatbuffer (see convert_tflite.py) through the
+    TFLite interpreter. Quantized inputs and outputs are handled here, so
+    callers always pass float32 images in [0, 1] and get probabilities back.
+    """
+    name = "tflite"
+
+    def __init__(self, model_path, num_threads=None):
+        self.model_path = model_path
+        self.interpreter = _tflite_interpreter()(model_path=model_path, num_threads=num_threads)
+        self.interpreter.allocate_tensors()
+        self._input = self.interpreter.get_input_details()[0]
+        self._output = self.interpreter.get_output_details()[0]
+        self._batch_size = int(self._input["shape"][0])
+        # The interpreter is not thread-safe
+        self._lock = threading.Lock()
+
+    def _resize(self, batch_size):
+        if batch_size != self._batch_size:
+            shape = [batch_size] + [int(d) for d in self._input["shape"][1:]]
+            self.interpreter.resize_tensor_input(self._input["index"], shape)
+            self.interpreter.allocate_tensors()
+            self._input = self.interpreter.get_input_details()[0]
+            self._output = self.interpreter.get_output_details()[0]
+            self._batch_size = batch_size
+
+    def predict(self, batch):
+        batch = np.asarray(batch, dtype=np.float32)
+
+        with self._lock:
+            self._resize(len(batch))
+
+            scale, zero_point = self._input["quantization"]
+            if self._input["dtype"] != np.float32 and scale:
+                batch = np.round(batch / scale + zero_point)
+            self.interpreter.set_tensor(self._input["index"], batch.astype(self._input["dtype"]))
+            self.interpreter.invoke()
+            preds = self.interpreter.get_tensor(self._output["index"])
+
+            scale, zero_point = self._output["quantization"]
+            if self._output["dtype"] != np.float32 and scale:
+                preds = (preds.astype(np.float32) - zero_point) * scale
+            return np.array(preds, dtype=np.float32)
+
+
+BACKENDS = {
+    "keras": KerasBackend,
+    "savedmodel": SavedModelBackend,
+    "tflite": TFLiteBackend,
+}
+
+
+def load_backend(name, model_path, **options):
+    """
+    Loads the inference backend selected by name ("keras", "savedmodel" or
+    "tflite")
+    """
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown model backend: {name} (expected one of {', '.join(BACKENDS)})")
+
+    if not os.path.exists(model_path):
+        raise FileNotFoundError(f"Model file not found: {model_path}")
+
+    try:
+        backend = BACKENDS[name](model_path, **options)
+    except Exception as e:
+        raise RuntimeError(f"Failed to load {name} model from {model_path}: {e}")
+
+    print(f"Model loaded successfully ({name}: {os.path.basename(model_path)})", file=sys.stderr)
+    return backend
+
+
+def warm_up(backend, input_shape, batch_sizes=(1,)):
+    """
+    Runs one zero batch of every size through the backend so graph tracing
+    and allocation happen before the first real request. Returns the ms
+    spent per batch size
+    """
+    timings = {}
+    for batch_size in batch_sizes:
+        start = time.perf_counter()
+        backend.predict(np.zeros((batch_size,) + tuple(input_shape), dtype=np.float32))
+        timings[batch_size] = round((time.perf_counter() - start) * 1000, 3)
+    return timings
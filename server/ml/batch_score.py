@@ -0,0 +1,273 @@
+"""
+Bulk scoring of survey photos.
+
+Takes directories, glob patterns or manifest files (one path per line, or
+JSONL rows with "image_path"/"path"), scores every image with a process
+pool and appends one JSON line per image to the output file. Each worker
+process loads the model once and micro-batches the forward passes of the
+images it has in flight. Rows are the single-image result of predict.py
+plus "image_path".
+
+Rerunning with the same output file resumes: images that already have a
+row are skipped (add --retry-errors to redo failed ones). The LLM call is
+skipped unless --with-llm is given. A worker that fails to start (or dies)
+stops the run with exit status 1; rows written so far are kept.
+
+With --shared-memory this process decodes every image once into a
+shm_ring.SlotRing and the workers read the model tensor and validation proxy
+straight from shared memory, so no pixels are decoded twice or pickled.
+
+    python3 ml/batch_score.py survey_photos/ --output scores.jsonl --workers 2
+"""
+import os
+import sys
+import glob
+import json
+import time
+import argparse
+import multiprocessing
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+
+from validation_pool import available_cores
+from shm_ring import SlotRing, StaleHandle, PROXY_SIDE
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".webp")
+MANIFEST_EXTENSIONS = (".txt", ".jsonl", ".csv", ".lst")
+
+# Set in each worker process by _init_worker
+_predict = None
+_executor = None
+_use_llm = False
+_ring = None
+
+# READY slots no worker opened in this long are taken back (the task was lost)
+SLOT_STALE_AFTER_S = 300
+
+
+def _manifest_paths(manifest):
+    base = os.path.dirname(os.path.abspath(manifest))
+    with open(manifest, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            if line.startswith("{"):
+                row = json.loads(line)
+                line = row.get("image_path") or row.get("path")
+                if not line:
+                    continue
+            elif "," in line:
+                line = line.split(",", 1)[0].strip()
+            yield line if os.path.isabs(line) else os.path.join(base, line)
+
+
+def collect_images(inputs):
+    """
+    Expands directories, globs and manifests into a sorted, de-duplicated
+    list of absolute image paths
+    """
+    paths = []
+    for item in inputs:
+        if os.path.isdir(item):
+            for root, _, files in os.walk(item):
+                paths.extend(os.path.join(root, f) for f in files if f.lower().endswith(IMAGE_EXTENSIONS))
+        elif os.path.isfile(item) and item.lower().endswith(MANIFEST_EXTENSIONS):
+            paths.extend(_manifest_paths(item))
+        elif os.path.isfile(item):
+            paths.append(item)
+        else:
+            matches = glob.glob(item, recursive=True)
+            if not matches:
+                print(f"No images match {item}", file=sys.stderr)
+            paths.extend(m for m in matches if m.lower().endswith(IMAGE_EXTENSIONS))
+    return sorted({os.path.abspath(p) for p in paths})
+
+
+def completed_paths(output, retry_errors):
+    """
+    Image paths that already have a row in the output file. A partial last
+    line left by an interrupted run is cut off so appending stays valid JSONL
+    """
+    done = set()
+    if not os.path.exists(output):
+        return done
+
+    with open(output, "rb+") as f:
+        data = f.read()
+        end = data.rfind(b"\n") + 1
+        if end < len(data):
+            f.truncate(end)
+
+    for line in data[:end].decode("utf-8", errors="replace").splitlines():
+        try:
+            row = json.loads(line)
+        except ValueError:
+            continue
+        if retry_errors and row.get("status") == "error":
+            continue
+        done.add(row.get("image_path"))
+    return done
+
+
+def _init_worker(batch_size, batch_wait_ms, use_llm, ring_name=None):
+    global _predict, _executor, _use_llm, _ring
+    # Bulk runs don't go through the upload caches
+    os.environ["ML_RESULT_CACHE_SIZE"] = "0"
+    os.environ["ML_RESULT_CACHE_PATH"] = ""
+    os.environ["ML_NEAR_DUP_ENTRIES"] = "0"
+    sys.stdout = sys.stderr
+
+    import model
+    import predict
+    if batch_size > 1:
+        model.enable_batching(batch_size, batch_wait_ms)
+    _predict = predict.run_prediction
+    _executor = ThreadPoolExecutor(max_workers=max(1, batch_size))
+    _use_llm = use_llm
+
+    if ring_name:
+        _ring = SlotRing.attach(ring_name)
+        if _ring.model_size != tuple(model.IMG_SIZE):
+            raise RuntimeError(f"Slot ring holds {_ring.model_size} tensors, the model expects {model.IMG_SIZE}")
+
+
+def _score_one(path, handle):
+    if handle is None:
+        return _predict(path, None, _use_llm)
+    try:
+        slot = _ring.open(handle)
+    except StaleHandle:
+        # Reclaimed before we got to it; score from the file instead
+        return _predict(path, None, _use_llm)
+    with slot:
+        return _predict(slot.image_context(path), None, _use_llm)
+
+
+def _score_chunk(items):
+    """
+    Scores a chunk of (path, slot handle or None) concurrently so the
+    worker's micro-batcher can group the forward passes
+    """
+    futures = [_executor.submit(_score_one, path, handle) for path, handle in items]
+    return [(path, future.result()) for (path, _), future in zip(items, futures)]
+
+
+def _shared_chunks(ring, chunks):
+    """
+    Decodes each chunk into the ring as the pool asks for work; blocks while
+    every slot is in use
+    """
+    for chunk in chunks:
+        items = []
+        for path in chunk:
+            try:
+                handle = ring.put_image(path, stale_after_s=SLOT_STALE_AFTER_S)
+            except Exception:
+                # Unreadable here: the worker reports it with the usual error row
+                handle = None
+            items.append((path, handle))
+        yield items
+
+
+def _run_chunks(pool, tasks, max_pending):
+    """
+    Yields the rows of each chunk as it finishes, with at most max_pending
+    chunks submitted at a time. Raises BrokenProcessPool if a worker fails
+    to start or dies
+    """
+    tasks = iter(tasks)
+    pending = set()
+    while True:
+        for items in tasks:
+            pending.add(pool.submit(_score_chunk, items))
+            if len(pending) >= max_pending:
+                break
+        if not pending:
+            return
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            yield future.result()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Score a directory, glob or manifest of leaf photos")
+    parser.add_argument("inputs", nargs="+", help="Directories, glob patterns or manifest files")
+    parser.add_argument("--output", "-o", required=True, help="JSONL file to append results to")
+    parser.add_argument("--workers", type=int, default=available_cores(),
+                        help="Worker processes, each with its own copy of the model")
+    parser.add_argument("--batch-size", type=int, default=8, help="Images in flight (and per forward pass) per worker")
+    parser.add_argument("--batch-wait-ms", type=float, default=5.0)
+    parser.add_argument("--with-llm", action="store_true", help="Also generate the LLM advice text")
+    parser.add_argument("--shared-memory", action="store_true",
+                        help="Decode here once and hand pixels to the workers through shared memory")
+    parser.add_argument("--proxy-side", type=int, default=PROXY_SIDE,
+                        help="Long side of the validation proxy kept in shared memory (elongated images keep more)")
+    parser.add_argument("--retry-errors", action="store_true", help="Rescore images whose previous row is an error")
+    args = parser.parse_args()
+
+    images = collect_images(args.inputs)
+    done = completed_paths(args.output, args.retry_errors)
+    todo = [p for p in images if p not in done]
+    print(f"{len(images)} images found, {len(images) - len(todo)} already scored, {len(todo)} to go", file=sys.stderr)
+    if not todo:
+        return
+
+    chunks = [todo[i:i + args.batch_size] for i in range(0, len(todo), args.batch_size)]
+    workers = max(1, args.workers)
+
+    ring = None
+    if args.shared_memory:
+        # Enough slots for every worker to have two chunks queued
+        ring = SlotRing.create(slots=workers * args.batch_size * 2, proxy_side=args.proxy_side)
+        tasks = _shared_chunks(ring, chunks)
+    else:
+        tasks = ([(path, None) for path in chunk] for chunk in chunks)
+
+    statuses = Counter()
+    started = time.perf_counter()
+    scored = 0
+
+    # spawn: TensorFlow doesn't survive fork(). Unlike multiprocessing.Pool,
+    # the executor doesn't respawn workers whose initializer fails, it breaks
+    context = multiprocessing.get_context("spawn")
+    try:
+        with open(args.output, "a", encoding="utf-8") as out, ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=context,
+            initializer=_init_worker,
+            initargs=(args.batch_size, args.batch_wait_ms, args.with_llm, ring.name if ring else None)
+        ) as pool:
+            # Two chunks per worker, as many as the ring has slots for
+            for rows in _run_chunks(pool, tasks, max_pending=workers * 2):
+                for path, result in rows:
+                    out.write(json.dumps({"image_path": path, **result}) + "\n")
+                    statuses[result.get("status", "unknown")] += 1
+                out.flush()
+
+                scored += len(rows)
+                elapsed = time.perf_counter() - started
+                print(f"{scored}/{len(todo)} scored, {scored / elapsed:.2f} images/s", file=sys.stderr)
+    except BrokenProcessPool as e:
+        print(f"Scoring stopped after {scored} images, a worker failed to start or died: {e}", file=sys.stderr)
+        if ring is not None:
+            ring.close()
+        sys.exit(1)
+
+    elapsed = time.perf_counter() - started
+    summary = {
+        "scored": scored,
+        "seconds": round(elapsed, 2),
+        "images_per_s": round(scored / elapsed, 3) if elapsed else 0.0,
+        "statuses": dict(statuses),
+        "output": os.path.abspath(args.output),
+    }
+    if ring is not None:
+        summary["shared_memory"] = ring.stats()
+        ring.close()
+    print(json.dumps(summary))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+import sys
+import time
+import queue
+import threading
+from concurrent.futures import Future
+
+import numpy as np
+
+
+class MicroBatcher:
+    """
+    Collects single preprocessed images from concurrent callers and runs
+    them through the model in one forward pass.
+
+    A batch is flushed as soon as it holds max_batch_size images or the
+    oldest queued image has waited max_wait_ms, whichever comes first.
+    """
+
+    def __init__(self, predict_fn, max_batch_size=8, max_wait_ms=5.0):
+        if max_batch_size < 1:
+            raise ValueError("max_batch_size must be at least 1")
+
+        self.predict_fn = predict_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max(0.0, max_wait_ms) / 1000.0
+
+        self._queue = queue.Queue()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="micro-batcher", daemon=True)
+        self._thread.start()
+
+    def submit(self, img):
+        """
+        Queues one image of shape (H, W, C) and returns a Future that
+        resolves to its row of predictions
+        """
+        if self._closed:
+            raise RuntimeError("MicroBatcher is closed")
+
+        future = Future()
+        self._queue.put((img, future))
+        return future
+
+    def predict(self, img):
+        """
+        Blocking helper: submit one image and wait for its predictions
+        """
+        return self.submit(img).result()
+
+    def close(self):
+        self._closed = True
+        self._queue.put(None)
+        self._thread.join()
+
+    def _collect(self):
+        first = self._queue.get()
+        if first is None:
+            return None
+
+        batch = [first]
+        deadline = time.monotonic() + self.max_wait
+
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                # Finish the current batch, then stop
+                self._queue.put(None)
+                break
+            batch.append(item)
+
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            if batch is None:
+                return
+
+            images = [img for img, _ in batch]
+            futures = [future for _, future in batch]
+
+            try:
+                preds = self.predict_fn(np.stack(images))
+            except Exception as e:
+                print(f"Batched prediction failed: {e}", file=sys.stderr)
+                for future in futures:
+                    future.set_exception(e)
+                continue
+
+            for row, future in zip(preds, futures):
+                future.set_result(row)
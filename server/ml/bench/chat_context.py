@@ -0,0 +1,82 @@
+"""
+Token budget of chat.py's ContextManager over a long synthetic conversation.
+
+Replays a diagnosis conversation turn by turn the way the Node route sends
+it (system prompt with the diagnosis, then every message so far), using
+llm_stub.StubClient as the model so it runs offline. Checks that every
+prompt fits the budget, that the system prompt and the latest message are
+always sent, and that the rolling summary is only extended when turns age
+out, then reports the tokens saved.
+
+    python3 ml/bench/chat_context.py --turns 40 --budget 1500
+"""
+import os
+import sys
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("OPENAI_API_KEY", "offline-benchmark")
+
+from chat import ContextManager, message_tokens
+from llm_stub import StubClient
+
+DIAGNOSIS = (
+    "You are an expert coffee plant agronomist. The user just received a diagnosis: rust with "
+    "99.99% confidence. Continue helping the user with follow-up questions about this diagnosis."
+)
+
+QUESTIONS = [
+    "What causes the orange powder under the leaves?",
+    "How fast does it spread between trees in the rainy season?",
+    "Which copper fungicides are approved for smallholders here?",
+    "Should I prune the affected branches or remove the whole tree?",
+    "Can shade trees make the problem worse?",
+    "Are there rust resistant varieties I could plant next season?",
+]
+
+SUMMARY = "The farmer has coffee leaf rust and asked about causes, spread, fungicides, pruning and shade."
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Token-budgeted chat context over a long conversation")
+    parser.add_argument("--turns", type=int, default=40)
+    parser.add_argument("--budget", type=int, default=1500)
+    parser.add_argument("--summary-tokens", type=int, default=200)
+    args = parser.parse_args()
+
+    answer = "Here is some detailed advice about that. " * 12
+    stub = StubClient([SUMMARY])
+    manager = ContextManager(stub, budget_tokens=args.budget, summary_tokens=args.summary_tokens)
+
+    system = {"role": "system", "content": DIAGNOSIS}
+    history = [system]
+    over_budget = 0
+
+    print(f"{'turn':>4s} {'full tokens':>12s} {'sent tokens':>12s} {'messages':>9s} {'summaries':>10s}")
+    for turn in range(args.turns):
+        question = QUESTIONS[turn % len(QUESTIONS)]
+        history.append({"role": "user", "content": f"({turn + 1}) {question}"})
+        messages, context = manager.build(history, conversation_id="bench")
+
+        assert messages[0] == system, "system prompt must always be sent"
+        assert messages[-1] == history[-1], "latest message must always be sent"
+        if sum(message_tokens(m) for m in messages) > args.budget:
+            over_budget += 1
+
+        if turn % 5 == 4 or turn == args.turns - 1:
+            print(f"{turn + 1:4d} {context['tokens_full']:12d} {context['tokens_sent']:12d} "
+                  f"{context['messages_sent']:4d}/{context['messages_full']:<4d} "
+                  f"{manager.counters['summaries_generated']:10d}")
+
+        history.append({"role": "assistant", "content": f"({turn + 1}) {answer}"})
+
+    stats = manager.stats()
+    saved = stats["tokens_saved"] / stats["tokens_full"] if stats["tokens_full"] else 0.0
+    print(f"\nPrompt tokens: {stats['tokens_full']} full, {stats['tokens_sent']} sent ({saved:.0%} saved)")
+    print(f"Summaries generated: {stats['summaries_generated']}, reused: {stats['summary_cache_hits']}, "
+          f"model calls: {len(stub.calls)}")
+    print(f"Turns over budget: {over_budget}")
+
+
+if __name__ == "__main__":
+    main()
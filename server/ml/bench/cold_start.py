@@ -0,0 +1,122 @@
+"""
+Cold start of the prediction pipeline, per model backend.
+
+Every run is a fresh Python process, like a Railway restart or scale-up.
+The child imports predict.py (which loads and warms up the model) and
+scores one image. The report covers:
+
+- imports_ms      model.py's own imports (OpenCV, PIL, helpers)
+- model_load_ms   loading the model, including its runtime (TensorFlow)
+- warmup_ms       the warm-up batches (ML_WARMUP_BATCH_SIZES)
+- import_ms       importing predict.py as a whole
+- first_ms        the first run_prediction after that
+- to_first_ms     process spawn to the first result, measured by the parent
+
+Medians over --runs runs; the LLM is stubbed and the caches are off.
+
+    python3 ml/export_model.py
+    python3 ml/bench/cold_start.py --runs 3
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import statistics
+import subprocess
+
+ML_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ML_DIR)
+
+import corpus
+
+BACKENDS = {
+    "keras": (None, os.path.join(ML_DIR, "coffee_disease_final.keras")),
+    "savedmodel": ("ML_SAVEDMODEL_PATH", os.path.join(ML_DIR, "coffee_disease_final.savedmodel")),
+    "tflite": ("ML_TFLITE_MODEL", os.path.join(ML_DIR, "coffee_disease_final.float16.tflite")),
+}
+
+CHILD = """
+import sys, time, json
+start = time.perf_counter()
+sys.path.insert(0, {ml_dir!r})
+import predict
+imported = time.perf_counter()
+result = predict.run_prediction({image!r})
+first = time.perf_counter()
+predict.run_prediction({image!r})
+second = time.perf_counter()
+print(json.dumps(dict(
+    predict.STARTUP_TIMINGS,
+    import_ms=(imported - start) * 1000,
+    first_ms=(first - imported) * 1000,
+    second_ms=(second - first) * 1000,
+    status=result.get("status"),
+    tensorflow_imported="tensorflow" in sys.modules,
+)))
+"""
+
+
+def run_once(backend, env_var, path, image, warmup):
+    env = dict(
+        os.environ,
+        ML_MODEL_BACKEND=backend,
+        ML_LLM_STUB="1",
+        ML_RESULT_CACHE_SIZE="0",
+        ML_RESULT_CACHE_PATH="",
+        ML_ADVICE_VARIANTS="0",
+        ML_NEAR_DUP_ENTRIES="0",
+        ML_WARMUP_BATCH_SIZES=warmup,
+        TF_CPP_MIN_LOG_LEVEL="2",
+    )
+    if env_var:
+        env[env_var] = path
+    env.setdefault("OPENAI_API_KEY", "offline-benchmark")
+
+    spawned = time.perf_counter()
+    proc = subprocess.run(
+        [sys.executable, "-c", CHILD.format(ml_dir=ML_DIR, image=image)],
+        env=env, capture_output=True, text=True
+    )
+    total_ms = (time.perf_counter() - spawned) * 1000
+    if proc.returncode != 0:
+        raise RuntimeError(f"{backend} run failed:\n{proc.stderr[-2000:]}")
+
+    report = json.loads(proc.stdout.strip().splitlines()[-1])
+    # The child can't see interpreter start-up; the parent measures to exit,
+    # so take off the second prediction that ran after the first result
+    report["to_first_ms"] = total_ms - report["second_ms"]
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cold start time per model backend")
+    parser.add_argument("--backends", nargs="+", choices=list(BACKENDS), default=list(BACKENDS))
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--warmup", default="1", help="ML_WARMUP_BATCH_SIZES for the runs (\"\" for none)")
+    parser.add_argument("--image", help="Image to score (default: a synthetic corpus leaf)")
+    args = parser.parse_args()
+
+    image = args.image
+    if image is None:
+        corpus_dir = os.path.join(tempfile.gettempdir(), "growfrika-bench-corpus")
+        entries = corpus.build_corpus(corpus_dir, per_kind=1, resolutions=["small"])
+        image = next(e["path"] for e in entries if e["kind"] == "leaf")
+
+    columns = ("imports_ms", "model_load_ms", "warmup_ms", "import_ms", "first_ms", "to_first_ms")
+    print(f"{'backend':11s} " + " ".join(f"{c:>14s}" for c in columns) + "  tensorflow")
+    for backend in args.backends:
+        env_var, path = BACKENDS[backend]
+        if not os.path.exists(path):
+            print(f"{backend:11s} skipped: {path} not found (see ml/export_model.py, ml/convert_tflite.py)")
+            continue
+
+        runs = [run_once(backend, env_var, path, image, args.warmup) for _ in range(args.runs)]
+        medians = {c: statistics.median(r[c] for r in runs) for c in columns}
+        print(f"{backend:11s} " + " ".join(f"{medians[c]:14.0f}" for c in columns)
+              + f"  {'yes' if runs[0]['tensorflow_imported'] else 'no'}")
+
+
+if __name__ == "__main__":
+    main()
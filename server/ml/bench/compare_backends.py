@@ -0,0 +1,141 @@
+"""
+Keras vs SavedModel vs TFLite backends: accuracy drift, latency and memory.
+
+Each backend is measured in its own subprocess so load time and resident
+memory aren't polluted by the others. The probabilities are then compared
+against the Keras model (top-1 agreement, probability drift) and run
+through interpret_prediction to check the confidence and entropy thresholds
+give the same status for every image.
+
+    python3 ml/convert_tflite.py
+    python3 ml/bench/compare_backends.py
+"""
+import os
+import io
+import sys
+import json
+import time
+import argparse
+import tempfile
+import resource
+import contextlib
+import subprocess
+
+ML_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ML_DIR)
+os.environ.setdefault("TF_CPP_MIN_LOG_LEVEL", "2")
+os.environ.setdefault("TF_ENABLE_ONEDNN_OPTS", "0")
+
+import numpy as np
+
+import corpus
+
+VARIANTS = {
+    "keras": ("keras", "coffee_disease_final.keras"),
+    "savedmodel": ("savedmodel", "coffee_disease_final.savedmodel"),
+    "float16": ("tflite", "coffee_disease_final.float16.tflite"),
+    "int8": ("tflite", "coffee_disease_final.int8.tflite"),
+}
+
+
+def rss_mib():
+    # ru_maxrss is in KiB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def measure_backend(backend_name, model_path, paths, repeat):
+    """
+    Runs in the child process: loads one backend and predicts every image
+    """
+    from image_context import ImageContext
+
+    tensors = [ImageContext.from_path(p).model_tensor((128, 128)) for p in paths]
+    rss_before = rss_mib()
+
+    start = time.perf_counter()
+    import tensorflow  # noqa: F401  (import time counts towards loading)
+    from backends import load_backend
+    with contextlib.redirect_stderr(io.StringIO()):
+        backend = load_backend(backend_name, model_path)
+    load_ms = (time.perf_counter() - start) * 1000
+
+    probabilities, latencies = [], []
+    for tensor in tensors:
+        backend.predict(tensor)  # warm-up
+        for _ in range(repeat):
+            start = time.perf_counter()
+            pred = backend.predict(tensor)
+            latencies.append((time.perf_counter() - start) * 1000)
+        probabilities.append([float(p) for p in pred[0]])
+
+    return {
+        "load_ms": load_ms,
+        "rss_mib": rss_mib(),
+        "rss_delta_mib": rss_mib() - rss_before,
+        "latency_ms": latencies,
+        "probabilities": probabilities,
+    }
+
+
+def run_child(backend_name, model_path, paths, repeat):
+    cmd = [sys.executable, os.path.abspath(__file__), "--child", backend_name, model_path,
+           "--repeat", str(repeat), "--paths", *paths]
+    out = subprocess.run(cmd, capture_output=True, text=True, check=True).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def statuses(probabilities):
+    from model import interpret_prediction
+    with contextlib.redirect_stderr(io.StringIO()):
+        return [interpret_prediction(np.array(p), {"confidence": 1.0})["status"] for p in probabilities]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the Keras and TFLite inference backends")
+    parser.add_argument("--variants", nargs="+", default=list(VARIANTS), choices=list(VARIANTS))
+    parser.add_argument("--per-kind", type=int, default=4)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--child", nargs=2, metavar=("BACKEND", "MODEL_PATH"), help=argparse.SUPPRESS)
+    parser.add_argument("--paths", nargs="*", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(measure_backend(*args.child, args.paths, args.repeat)))
+        return
+
+    corpus_dir = os.path.join(tempfile.gettempdir(), "growfrika-bench-corpus")
+    entries = corpus.build_corpus(corpus_dir, per_kind=args.per_kind, resolutions=["small"])
+    paths = [e["path"] for e in entries]
+
+    results = {}
+    for variant in args.variants:
+        backend_name, filename = VARIANTS[variant]
+        model_path = os.path.join(ML_DIR, filename)
+        if not os.path.exists(model_path):
+            print(f"Skipping {variant}: {model_path} not found (run ml/convert_tflite.py)")
+            continue
+        results[variant] = run_child(backend_name, model_path, paths, args.repeat)
+
+    if "keras" not in results:
+        print("The Keras model is needed as the reference")
+        return
+
+    reference = np.array(results["keras"]["probabilities"])
+    reference_status = statuses(reference)
+
+    print(f"{len(paths)} images, {args.repeat} timed runs each\n")
+    print(f"{'backend':8s} {'load ms':>8s} {'RSS MiB':>8s} {'+MiB':>6s} {'p50 ms':>7s} {'p95 ms':>7s} "
+          f"{'top-1':>7s} {'mean drift':>11s} {'max drift':>10s} {'status':>7s}")
+    for variant, result in results.items():
+        probs = np.array(result["probabilities"])
+        drift = np.abs(probs - reference)
+        agreement = float(np.mean(probs.argmax(axis=1) == reference.argmax(axis=1)))
+        same_status = sum(a == b for a, b in zip(statuses(probs), reference_status))
+        latency = np.array(result["latency_ms"])
+        print(f"{variant:8s} {result['load_ms']:8.0f} {result['rss_mib']:8.0f} {result['rss_delta_mib']:6.0f} "
+              f"{np.percentile(latency, 50):7.2f} {np.percentile(latency, 95):7.2f} "
+              f"{agreement:7.1%} {drift.mean():11.2e} {drift.max():10.2e} {same_status:3d}/{len(paths)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+"""
+Deterministic synthetic image corpus for the ML benchmarks.
+
+Generates leaf-like and non-leaf JPEGs at several resolutions so the
+benchmarks can run without network access or private field photos.
+"""
+import os
+import sys
+import argparse
+
+import cv2
+import numpy as np
+
+RESOLUTIONS = {
+    "small": (640, 480),
+    "medium": (1600, 1200),
+    "large": (4000, 3000),
+}
+
+
+def _leaf_polygon(cx, cy, length, width, angle):
+    t = np.linspace(0, 2 * np.pi, 200)
+    # Pointed ellipse: narrower towards the tips
+    x = length / 2 * np.cos(t)
+    y = width / 2 * np.sin(t) * (1 - 0.35 * np.abs(np.cos(t)) ** 3)
+    c, s = np.cos(angle), np.sin(angle)
+    pts = np.stack([cx + x * c - y * s, cy + x * s + y * c], axis=1)
+    return pts.astype(np.int32)
+
+
+def make_leaf(width, height, rng, n_leaves=1, disease=None, centers=None):
+    """
+    Green leaf (or a few) on a soil-like background, optionally with lesions.
+    centers places one leaf at each (x, y), given as fractions of the frame
+    """
+    if centers:
+        n_leaves = len(centers)
+    base = rng.integers(60, 110)
+    img = np.empty((height, width, 3), np.uint8)
+    img[:] = (base * 0.55, base * 0.75, base)  # BGR soil
+    noise = rng.normal(0, 12, (height // 8 + 1, width // 8 + 1, 3))
+    noise = cv2.resize(noise, (width, height), interpolation=cv2.INTER_CUBIC)
+    img = np.clip(img + noise, 0, 255).astype(np.uint8)
+
+    scale = min(width, height)
+    for i in range(n_leaves):
+        if centers:
+            cx, cy = width * centers[i][0], height * centers[i][1]
+        else:
+            cx = width * (0.5 if n_leaves == 1 else rng.uniform(0.25, 0.75))
+            cy = height * (0.5 if n_leaves == 1 else rng.uniform(0.25, 0.75))
+        length = scale * rng.uniform(0.55, 0.8) / (1 if n_leaves == 1 else 1.6)
+        pts = _leaf_polygon(cx, cy, length, length * rng.uniform(0.4, 0.55), rng.uniform(0, np.pi))
+        green = (rng.integers(20, 50), rng.integers(110, 170), rng.integers(30, 70))
+        cv2.fillPoly(img, [pts], tuple(int(v) for v in green))
+
+        # Midrib and veins
+        p0, p1 = pts[0], pts[100]
+        thickness = max(1, scale // 300)
+        cv2.line(img, tuple(int(v) for v in p0), tuple(int(v) for v in p1), (80, 190, 120), thickness)
+        for k in range(10, 100, 12):
+            cv2.line(img, tuple(int(v) for v in (p0 + (p1 - p0) * k / 100)),
+                     tuple(int(v) for v in pts[k]), (60, 170, 90), max(1, thickness // 2))
+
+        if disease:
+            color = {"rust": (30, 130, 230), "phoma": (20, 40, 80), "miner": (150, 200, 210)}[disease]
+            for _ in range(int(rng.integers(5, 25))):
+                p = pts[int(rng.integers(0, len(pts)))]
+                q = (int(cx + (p[0] - cx) * rng.uniform(0, 0.8)), int(cy + (p[1] - cy) * rng.uniform(0, 0.8)))
+                cv2.circle(img, q, int(scale * rng.uniform(0.005, 0.025)), color, -1)
+
+    img = cv2.GaussianBlur(img, (0, 0), max(0.6, scale / 1500))
+    sensor = rng.normal(0, 4, img.shape)
+    return np.clip(img + sensor, 0, 255).astype(np.uint8)
+
+
+def make_non_leaf(width, height, rng):
+    """
+    Indoor/object-like scenes: gradients, boxes, circles and text
+    """
+    top = rng.integers(0, 255, 3)
+    bottom = rng.integers(0, 255, 3)
+    ramp = np.linspace(0, 1, height)[:, None, None]
+    img = (top * (1 - ramp) + bottom * ramp).repeat(width, axis=1).astype(np.uint8)
+    scale = min(width, height)
+    for _ in range(int(rng.integers(3, 9))):
+        color = tuple(int(v) for v in rng.integers(0, 255, 3))
+        x, y = int(rng.integers(0, width)), int(rng.integers(0, height))
+        if rng.random() < 0.5:
+            cv2.rectangle(img, (x, y), (x + int(scale * rng.uniform(0.1, 0.4)), y + int(scale * rng.uniform(0.1, 0.4))), color, -1)
+        else:
+            cv2.circle(img, (x, y), int(scale * rng.uniform(0.05, 0.2)), color, -1)
+    cv2.putText(img, "GrowFrika", (width // 10, height // 2), cv2.FONT_HERSHEY_SIMPLEX,
+                scale / 300, (20, 20, 20), max(1, scale // 200))
+    img = cv2.GaussianBlur(img, (0, 0), max(0.6, scale / 1500))
+    sensor = rng.normal(0, 4, img.shape)
+    return np.clip(img + sensor, 0, 255).astype(np.uint8)
+
+
+def build_corpus(out_dir, per_kind=3, resolutions=None, seed=1234):
+    """
+    Writes the corpus to out_dir (skipping files that already exist) and
+    returns a list of dicts with path, kind, label and resolution
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    resolutions = resolutions or list(RESOLUTIONS)
+    rng = np.random.default_rng(seed)
+    entries = []
+
+    kinds = [("leaf", None), ("leaf", "rust"), ("leaf", "phoma"), ("multi_leaf", "miner"), ("non_leaf", None)]
+    for res in resolutions:
+        width, height = RESOLUTIONS[res]
+        for kind, disease in kinds:
+            for i in range(per_kind):
+                name = f"{res}_{kind}_{disease or 'none'}_{i}.jpg"
+                path = os.path.join(out_dir, name)
+                # Draw even when the file exists so the RNG stream stays deterministic
+                if kind == "non_leaf":
+                    img = make_non_leaf(width, height, rng)
+                else:
+                    img = make_leaf(width, height, rng, n_leaves=3 if kind == "multi_leaf" else 1, disease=disease)
+                if not os.path.exists(path):
+                    cv2.imwrite(path, img, [cv2.IMWRITE_JPEG_QUALITY, 90])
+                entries.append({
+                    "path": path,
+                    "kind": kind,
+                    "label": disease or ("nodisease" if kind != "non_leaf" else None),
+                    "resolution": res,
+                })
+    return entries
+
+
+def list_images(directory):
+    exts = (".jpg", ".jpeg", ".png", ".webp", ".bmp")
+    return sorted(
+        os.path.join(directory, f) for f in os.listdir(directory)
+        if f.lower().endswith(exts)
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate the synthetic benchmark corpus")
+    parser.add_argument("out_dir")
+    parser.add_argument("--per-kind", type=int, default=3)
+    parser.add_argument("--resolutions", nargs="+", choices=list(RESOLUTIONS), default=list(RESOLUTIONS))
+    args = parser.parse_args()
+
+    entries = build_corpus(args.out_dir, args.per_kind, args.resolutions)
+    print(f"Wrote {len(entries)} images to {args.out_dir}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+"""
+Tail latency of run_prediction under a deadline, with a slow LLM.
+
+The OpenAI client is replaced by the stub answering after --llm-delay-ms,
+so the LLM alone would blow any budget below that. Every corpus image
+(small to large resolutions) is scored once without a deadline and once
+with --deadline-ms, and the report shows p50/p99 latency of both runs and
+which degradations applied how often. Exits 1 when the p99 under the
+deadline is over --deadline-ms + --slack-ms.
+
+The first run also measures decode and validation milliseconds per
+megapixel on this machine: the ML_DEADLINE_DECODE_MS_PER_MP and
+ML_DEADLINE_VALIDATION_MS_PER_MP estimates predict.py plans with.
+
+    python3 ml/bench/deadline_bench.py --deadline-ms 1500 --llm-delay-ms 3000
+"""
+import os
+import io
+import sys
+import argparse
+import tempfile
+import contextlib
+from collections import Counter
+
+ML_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ML_DIR)
+
+
+def percentile(samples, q):
+    import numpy as np
+    return float(np.percentile(np.array(samples), q))
+
+
+def run(predict, entries, deadline_ms):
+    latencies, degradations, per_mp = [], Counter(), {"decode": [], "validation": []}
+    for entry in entries:
+        with contextlib.redirect_stderr(io.StringIO()):
+            result = predict.run_prediction(entry["path"], include_timings=True, deadline_ms=deadline_ms)
+        timings = result.get("timings", {})
+        latencies.append(timings.get("request", 0.0))
+        degradations.update(result.get("degradations", []))
+
+        width, height = entry["size"]
+        megapixels = width * height / 1e6
+        if "decode" in timings:
+            per_mp["decode"].append(timings["decode"] / megapixels)
+        validation = timings.get("validate_leaf_image", 0) + timings.get("validate_image_content", 0)
+        per_mp["validation"].append(validation / megapixels)
+    return latencies, degradations, per_mp
+
+
+def main():
+    parser = argparse.ArgumentParser(description="run_prediction latency under a deadline with a slow LLM")
+    parser.add_argument("--deadline-ms", type=float, default=1500)
+    parser.add_argument("--llm-delay-ms", type=float, default=3000)
+    parser.add_argument("--slack-ms", type=float, default=100,
+                        help="Allowed overshoot of the p99 (thread hand-offs, result assembly)")
+    parser.add_argument("--per-kind", type=int, default=2)
+    args = parser.parse_args()
+
+    # No network, no caches that would hide the work
+    os.environ.update({
+        "ML_LLM_STUB": "1",
+        "ML_LLM_STUB_DELAY_MS": str(args.llm_delay_ms),
+        "ML_RESULT_CACHE_SIZE": "0",
+        "ML_RESULT_CACHE_PATH": "",
+        "ML_ADVICE_VARIANTS": "0",
+        "ML_NEAR_DUP_ENTRIES": "0",
+        "ML_BATCH_MAX_SIZE": "1",
+    })
+    os.environ.setdefault("OPENAI_API_KEY", "offline-benchmark")
+    os.environ.setdefault("TF_CPP_MIN_LOG_LEVEL", "2")
+
+    import corpus
+    with contextlib.redirect_stderr(io.StringIO()):
+        import predict
+
+    corpus_dir = os.path.join(tempfile.gettempdir(), "growfrika-bench-corpus")
+    entries = corpus.build_corpus(corpus_dir, per_kind=args.per_kind)
+    for entry in entries:
+        entry["size"] = corpus.RESOLUTIONS[entry["resolution"]]
+    print(f"{len(entries)} images, LLM answers after {args.llm_delay_ms:.0f} ms", file=sys.stderr)
+
+    # Warm-up, so model tracing isn't in the first sample
+    run(predict, entries[:1], 0)
+
+    rows = []
+    for label, deadline_ms in (("no deadline", 0), (f"{args.deadline_ms:.0f} ms deadline", args.deadline_ms)):
+        latencies, degradations, per_mp = run(predict, entries, deadline_ms)
+        rows.append((label, latencies, degradations))
+        if not deadline_ms:
+            calibration = {stage: percentile(values, 50) for stage, values in per_mp.items() if values}
+
+    print(f"\n{'run':>20s} {'p50 ms':>9s} {'p99 ms':>9s} {'max ms':>9s}  degradations")
+    for label, latencies, degradations in rows:
+        applied = ", ".join(f"{name} x{count}" for name, count in degradations.most_common()) or "-"
+        print(f"{label:>20s} {percentile(latencies, 50):9.1f} {percentile(latencies, 99):9.1f} "
+              f"{max(latencies):9.1f}  {applied}")
+
+    print("\nMeasured cost per megapixel (median): "
+          + ", ".join(f"{stage} {ms:.1f} ms" for stage, ms in calibration.items()))
+    print(f"Planned with: decode {predict.DEADLINE_DECODE_MS_PER_MP:.1f} ms, "
+          f"validation {predict.DEADLINE_VALIDATION_MS_PER_MP:.1f} ms")
+
+    p99 = percentile(rows[-1][1], 99)
+    if p99 > args.deadline_ms + args.slack_ms:
+        print(f"\np99 {p99:.1f} ms is over the {args.deadline_ms:.0f} ms deadline", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+"""
+Memory and latency of the fused feature extractor against the per-check
+statistics the validators used to compute on their own.
+
+The legacy_* functions below reproduce the old per-pixel work of
+check_green_content, check_color_distribution, check_texture_features and
+validate_leaf_image. Peak memory is the largest traced allocation above the
+decoded image (tracemalloc sees NumPy and OpenCV output buffers).
+
+    python3 ml/bench/features_compare.py
+"""
+import os
+import sys
+import time
+import argparse
+import tempfile
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import cv2
+import numpy as np
+
+import corpus
+from image_context import ImageContext
+from features import extract_color_features, extract_texture_features
+
+
+def legacy_features(rgb):
+    hsv = cv2.cvtColor(rgb, cv2.COLOR_RGB2HSV)
+    mask1 = cv2.inRange(hsv, np.array([30, 30, 30]), np.array([90, 255, 255]))
+    mask2 = cv2.inRange(hsv, np.array([20, 20, 20]), np.array([40, 255, 255]))
+    hsv_green_share = np.sum(cv2.bitwise_or(mask1, mask2) > 0) / (rgb.shape[0] * rgb.shape[1])
+
+    hists = [cv2.calcHist([rgb], [c], None, [256], [0, 256]) for c in range(3)]
+    hists = [h.flatten() / h.sum() for h in hists]
+    stds = [np.std(rgb[:, :, c]) for c in range(3)]
+
+    red, green, blue = rgb[:, :, 0], rgb[:, :, 1], rgb[:, :, 2]
+    green_mask = (green > red) & (green > blue) & (green > 50)
+    dominant = np.sum(green_mask) / (rgb.shape[0] * rgb.shape[1])
+
+    gray = cv2.cvtColor(rgb, cv2.COLOR_RGB2GRAY)
+    laplacian_var = cv2.Laplacian(gray, cv2.CV_64F).var()
+    sobelx = cv2.Sobel(gray, cv2.CV_64F, 1, 0, ksize=3)
+    sobely = cv2.Sobel(gray, cv2.CV_64F, 0, 1, ksize=3)
+    gradient = np.sqrt(sobelx**2 + sobely**2).mean()
+
+    return {
+        "hsv_green_share": float(hsv_green_share),
+        "dominant_green_share": float(dominant),
+        "std": [float(s) for s in stds],
+        "mean": float(np.mean(rgb)),
+        "hist": hists,
+        "laplacian_var": float(laplacian_var),
+        "gradient_magnitude": float(gradient),
+    }
+
+
+def fused_features(rgb):
+    color = extract_color_features(rgb)
+    texture = extract_texture_features(cv2.cvtColor(rgb, cv2.COLOR_RGB2GRAY))
+    return {
+        "hsv_green_share": color["hsv_green_share"],
+        "dominant_green_share": color["dominant_green_share"],
+        "std": color["std"],
+        "mean": float(np.mean(color["mean"])),
+        "hist": color["hist"],
+        **texture,
+    }
+
+
+def measure(fn, rgb, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(rgb)
+        times.append((time.perf_counter() - start) * 1000)
+
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    base, _ = tracemalloc.get_traced_memory()
+    values = fn(rgb)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return values, float(np.median(times)), (peak - base) / 2**20
+
+
+def max_difference(a, b):
+    diffs = {}
+    for key in a:
+        if key == "hist":
+            diffs[key] = max(float(np.max(np.abs(x - y))) for x, y in zip(a[key], b[key]))
+        elif isinstance(a[key], list):
+            diffs[key] = max(abs(x - y) for x, y in zip(a[key], b[key]))
+        else:
+            diffs[key] = abs(a[key] - b[key])
+    return diffs
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fused vs legacy validation feature extraction")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    corpus_dir = os.path.join(tempfile.gettempdir(), "growfrika-bench-corpus")
+    entries = corpus.build_corpus(corpus_dir, per_kind=1)
+
+    print(f"{'image':34s} {'legacy ms':>10s} {'fused ms':>9s} {'legacy MiB':>11s} {'fused MiB':>10s} {'max |diff|':>11s}")
+    worst = {}
+    for entry in entries:
+        rgb = ImageContext.from_path(entry["path"]).rgb
+        old, old_ms, old_mib = measure(legacy_features, rgb, args.repeat)
+        new, new_ms, new_mib = measure(fused_features, rgb, args.repeat)
+        diffs = max_difference(old, new)
+        for key, value in diffs.items():
+            worst[key] = max(worst.get(key, 0.0), value)
+        print(f"{os.path.basename(entry['path']):34s} {old_ms:10.1f} {new_ms:9.1f} {old_mib:11.1f} "
+              f"{new_mib:10.1f} {max(diffs.values()):11.2e}")
+
+    print("\nLargest difference per statistic:")
+    for key, value in worst.items():
+        print(f"  {key:22s} {value:.3e}")
+
+
+if __name__ == "__main__":
+    main()
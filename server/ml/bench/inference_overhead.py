@@ -0,0 +1,75 @@
+"""
+Per-call overhead of model.predict() vs the compiled inference function.
+
+Times, for batch sizes 1 to --max-batch, the Keras model through
+model.predict(), an eager model(x) call, and KerasBackend's tf.function
+traced once for (None, H, W, 3). All three must return the same
+probabilities, and the compiled function must not retrace after the first
+trace, whatever the batch size.
+
+    python3 ml/bench/inference_overhead.py --calls 50
+"""
+import os
+import io
+import sys
+import time
+import argparse
+import contextlib
+
+ML_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ML_DIR)
+os.environ.setdefault("TF_CPP_MIN_LOG_LEVEL", "2")
+
+import numpy as np
+
+MODEL_PATH = os.path.join(ML_DIR, "coffee_disease_final.keras")
+
+
+def time_per_call(fn, batch, calls):
+    fn(batch)  # first call per shape: tracing / adapter setup isn't counted
+    samples = []
+    for _ in range(calls):
+        start = time.perf_counter()
+        fn(batch)
+        samples.append((time.perf_counter() - start) * 1000)
+    return float(np.median(samples))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="model.predict() vs compiled inference overhead")
+    parser.add_argument("--calls", type=int, default=50)
+    parser.add_argument("--max-batch", type=int, default=8)
+    args = parser.parse_args()
+
+    from backends import KerasBackend
+    with contextlib.redirect_stderr(io.StringIO()):
+        backend = KerasBackend(MODEL_PATH)
+    model = backend.model
+    shape = tuple(model.input_shape[1:])
+
+    paths = {
+        "predict()": lambda b: model.predict(b, verbose=0),
+        "eager call": lambda b: model(b, training=False).numpy(),
+        "compiled": backend.predict,
+    }
+
+    rng = np.random.default_rng(0)
+    print(f"{'batch':>5s} " + " ".join(f"{name + ' ms':>14s}" for name in paths) + f" {'speed-up':>9s} {'max drift':>10s}")
+    batch_size = 1
+    while batch_size <= args.max_batch:
+        batch = rng.random((batch_size,) + shape, dtype=np.float32)
+        reference = model.predict(batch, verbose=0)
+        drift = max(float(np.abs(fn(batch) - reference).max()) for fn in paths.values())
+        timings = {name: time_per_call(fn, batch, args.calls) for name, fn in paths.items()}
+        print(f"{batch_size:5d} " + " ".join(f"{timings[name]:14.2f}" for name in paths)
+              + f" {timings['predict()'] / timings['compiled']:8.1f}x {drift:10.1e}")
+        batch_size *= 2
+
+    traces = backend.tracing_count()
+    print(f"\nCompiled function traced {traces} time(s) across all batch sizes")
+    if traces != 1:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,195 @@
+"""
+Hot model swaps in a live prediction worker.
+
+Builds a throwaway registry with three versions of the shipped model:
+v1 (as shipped), v2 (the same weights with a stricter confidence
+threshold, standing in for a retrained model) and broken (a manifest
+listing one class too few). Starts `predict.py --worker` on v1 with the
+LLM stubbed, keeps --concurrency predictions in flight the whole time and,
+meanwhile:
+
+- reload_model v2: every request is answered, and results switch from v1
+  to v2 once the swap lands
+- rollback_model: back to v1, without loading anything
+- reload_model broken: refused after the load, v1 keeps serving
+
+Reports the swap times and the prediction latency around each of them.
+Exits 1 when a request fails or a step doesn't behave as above.
+
+    python3 ml/bench/model_swap.py --concurrency 4
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import threading
+import subprocess
+from collections import Counter
+
+ML_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ML_DIR)
+
+import numpy as np
+
+import corpus
+
+SHIPPED_MANIFEST = os.path.join(ML_DIR, "coffee_disease_final.manifest.json")
+
+
+def build_registry(directory):
+    with open(SHIPPED_MANIFEST) as f:
+        shipped = json.load(f)
+    artifact = os.path.join(ML_DIR, shipped["artifacts"]["keras"])
+    shutil.copy(artifact, os.path.join(directory, "leaf.keras"))
+
+    versions = {
+        "v1": {},
+        "v2": {"thresholds": dict(shipped["thresholds"], confidence=0.6)},
+        "broken": {"class_names": shipped["class_names"][:-1]},
+    }
+    for version, changes in versions.items():
+        manifest = dict(shipped, version=version, artifacts={"keras": "leaf.keras"}, **changes)
+        with open(os.path.join(directory, f"{version}.manifest.json"), "w") as f:
+            json.dump(manifest, f, indent=2)
+
+
+class Worker:
+    """
+    predict.py --worker with one reader thread matching responses to ids
+    """
+
+    def __init__(self, env):
+        self.proc = subprocess.Popen(
+            [sys.executable, os.path.join(ML_DIR, "predict.py"), "--worker"],
+            cwd=ML_DIR, env=env, text=True,
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL
+        )
+        self.ready = json.loads(self.proc.stdout.readline())
+        self.lock = threading.Lock()
+        self.waiting = {}
+        self.next_id = 0
+        threading.Thread(target=self._read, daemon=True).start()
+
+    def _read(self):
+        for line in self.proc.stdout:
+            message = json.loads(line)
+            event = self.waiting.get(message.get("id"))
+            if event is not None:
+                event["response"] = message
+                event["done"].set()
+
+    def call(self, payload, timeout=300):
+        with self.lock:
+            self.next_id += 1
+            request_id = self.next_id
+            event = self.waiting[request_id] = {"done": threading.Event()}
+            self.proc.stdin.write(json.dumps(dict(payload, id=request_id)) + "\n")
+            self.proc.stdin.flush()
+        if not event["done"].wait(timeout):
+            raise TimeoutError(f"No answer to {payload['type']}")
+        return self.waiting.pop(request_id)["response"]
+
+    def close(self):
+        self.proc.stdin.write(json.dumps({"type": "shutdown"}) + "\n")
+        self.proc.stdin.close()
+        self.proc.wait(timeout=60)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Hot model swaps under load")
+    parser.add_argument("--concurrency", type=int, default=4)
+    args = parser.parse_args()
+
+    corpus_dir = os.path.join(tempfile.gettempdir(), "growfrika-bench-corpus")
+    paths = [e["path"] for e in corpus.build_corpus(corpus_dir, per_kind=2, resolutions=["small"])
+             if e["kind"] == "leaf"]
+    registry_dir = tempfile.mkdtemp(prefix="growfrika-registry-")
+    build_registry(registry_dir)
+
+    env = dict(
+        os.environ,
+        ML_MODEL_REGISTRY=registry_dir,
+        ML_MODEL_VERSION="v1",
+        ML_LLM_STUB="1",
+        ML_RESULT_CACHE_SIZE="0",
+        ML_RESULT_CACHE_PATH="",
+        ML_NEAR_DUP_ENTRIES="0",
+        TF_CPP_MIN_LOG_LEVEL="2",
+    )
+    env.setdefault("OPENAI_API_KEY", "offline-benchmark")
+    worker = Worker(env)
+
+    # (sent at, answered at, model_version or None on failure)
+    samples = []
+    stop = threading.Event()
+
+    def load(offset):
+        i = offset
+        while not stop.is_set():
+            sent = time.perf_counter()
+            result = worker.call({"type": "predict", "image_path": paths[i % len(paths)]})["result"]
+            samples.append((sent, time.perf_counter(), result.get("model_version")))
+            i += args.concurrency
+
+    threads = [threading.Thread(target=load, args=(i,)) for i in range(args.concurrency)]
+    for thread in threads:
+        thread.start()
+
+    checks, swaps = [], []
+
+    def check(name, ok, detail):
+        checks.append(ok)
+        print(f"{'ok' if ok else 'FAIL':>4s}  {name}: {detail}")
+
+    def swap(name, payload, expect_ok):
+        time.sleep(2)
+        started = time.perf_counter()
+        response = worker.call(payload)
+        finished = time.perf_counter()
+        swaps.append((name, started, finished))
+        ok = (response["type"] != "error") == expect_ok
+        detail = response.get("error") or f"now serving {response['model']['active']['version']}"
+        check(name, ok, f"{(finished - started) * 1000:.0f} ms, {detail}")
+        return response
+
+    try:
+        swap("reload v2", {"type": "reload_model", "version": "v2"}, True)
+        swap("rollback", {"type": "rollback_model"}, True)
+        swap("reload broken", {"type": "reload_model", "version": "broken"}, False)
+        time.sleep(2)
+        health = worker.call({"type": "health"})
+    finally:
+        stop.set()
+        for thread in threads:
+            thread.join()
+        worker.close()
+        shutil.rmtree(registry_dir, ignore_errors=True)
+
+    failures = sum(1 for _, _, version in samples if version is None)
+    check("requests", failures == 0, f"{len(samples)} answered, {failures} failed")
+    check("health", health["model"]["active"]["version"] == "v1" and health["model"]["previous"] == "v2",
+          f"active {health['model']['active']['version']}, previous {health['model']['previous']}")
+
+    # Which version answered requests sent after each swap returned
+    bounds = [(name, finished) for name, _, finished in swaps] + [("end", float("inf"))]
+    expected = {"reload v2": "v2", "rollback": "v1", "reload broken": "v1"}
+    for (name, since), (_, until) in zip(bounds, bounds[1:]):
+        served = Counter(version for sent, _, version in samples if since <= sent < until)
+        check(f"after {name}", set(served) == {expected[name]}, dict(served))
+
+    print(f"\n{'window':>22s} {'requests':>9s} {'p50 ms':>9s} {'max ms':>9s}")
+    windows = [("steady (before swaps)", 0, swaps[0][1])] + [(f"during {name}", s, f) for name, s, f in swaps]
+    for label, start, end in windows:
+        latencies = [(answered - sent) * 1000 for sent, answered, _ in samples if sent < end and answered > start]
+        if latencies:
+            print(f"{label:>22s} {len(latencies):9d} {np.percentile(latencies, 50):9.1f} {max(latencies):9.1f}")
+
+    if not all(checks):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""
+Cost and yield of multi-leaf mode.
+
+Runs predict_image on the leaf images of the synthetic corpus (plus any
+--real-dir photos) with and without multi-leaf crops and reports, per
+image kind, how many leaves were found, the aggregate verdicts, and the
+p50/max latency of both modes. The crops share the whole frame's forward
+pass, so the extra cost is the crop extraction plus a larger batch.
+
+    python3 ml/bench/multi_leaf.py --per-kind 2
+"""
+import os
+import io
+import sys
+import time
+import argparse
+import tempfile
+import contextlib
+from collections import Counter, defaultdict
+
+ML_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ML_DIR)
+os.environ.setdefault("TF_CPP_MIN_LOG_LEVEL", "2")
+
+import numpy as np
+
+import corpus
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Multi-leaf crops: leaves found and latency")
+    parser.add_argument("--per-kind", type=int, default=2)
+    parser.add_argument("--real-dir", help="Directory of real photos to add")
+    args = parser.parse_args()
+
+    with contextlib.redirect_stderr(io.StringIO()):
+        import model
+    from image_context import ImageContext
+
+    corpus_dir = os.path.join(tempfile.gettempdir(), "growfrika-bench-corpus")
+    entries = [e for e in corpus.build_corpus(corpus_dir, per_kind=args.per_kind, resolutions=["medium", "large"])
+               if e["kind"] != "non_leaf"]
+    if args.real_dir:
+        entries += [{"path": p, "kind": "real"} for p in corpus.list_images(args.real_dir)]
+
+    # First call per batch size pays the tracing
+    with contextlib.redirect_stderr(io.StringIO()):
+        model.predict_image(entries[0]["path"], multi_leaf=True)
+
+    latency = {False: [], True: []}
+    found = defaultdict(list)
+    verdicts = defaultdict(Counter)
+    for entry in entries:
+        for multi_leaf in (False, True):
+            img = ImageContext.from_path(entry["path"])
+            with contextlib.redirect_stderr(io.StringIO()):
+                start = time.perf_counter()
+                result = model.predict_image(img, multi_leaf=multi_leaf)
+                latency[multi_leaf].append((time.perf_counter() - start) * 1000)
+            if multi_leaf and "leaves" in result:
+                found[entry["kind"]].append(len(result["leaves"]))
+                verdicts[entry["kind"]][result["aggregate"]["verdict"]] += 1
+
+    print(f"{'kind':>12s} {'images':>7s} {'leaves':>14s}  verdicts")
+    for kind, counts in found.items():
+        spread = f"{np.mean(counts):.1f} ({min(counts)}-{max(counts)})"
+        print(f"{kind:>12s} {len(counts):7d} {spread:>14s}  {dict(verdicts[kind])}")
+
+    print(f"\n{'mode':>12s} {'p50 ms':>9s} {'max ms':>9s}")
+    for multi_leaf, label in ((False, "whole frame"), (True, "multi-leaf")):
+        samples = latency[multi_leaf]
+        print(f"{label:>12s} {np.percentile(samples, 50):9.1f} {max(samples):9.1f}")
+    print(f"\nAt most {model.MULTI_LEAF_MAX_CROPS} crops per image (ML_MULTI_LEAF_MAX_CROPS)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+"""
+Precision/recall of the perceptual hashes on a labelled duplicate set.
+
+Every corpus image (plus any --real-dir photos) gets near-duplicate
+variants like the ones farmers send in bursts: WhatsApp-style downscale and
+recompression, re-framing, small rotations and exposure changes. Pairs of
+an image and its own variant are duplicates; pairs across different
+originals are not. For each hash and each Hamming threshold the report
+shows recall (duplicates found), pair precision, label precision (a false
+match that still has the same diagnosis label costs nothing) and how many
+distinct pairs of originals the false matches come from. It also checks
+that flat and smooth controls (solid colours, a gradient) are refused by
+phash.is_distinctive, and counts the originals it refuses.
+
+    python3 ml/bench/near_duplicates.py --per-kind 4
+"""
+import os
+import sys
+import argparse
+import tempfile
+import itertools
+
+ML_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ML_DIR)
+
+import cv2
+import numpy as np
+
+import corpus
+from phash import phash, phash_energy, dhash, hamming, is_distinctive
+
+
+def whatsapp(img, rng):
+    scale = 1280 / max(img.shape[:2])
+    if scale < 1:
+        img = cv2.resize(img, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    return recompress(img, 50)
+
+
+def recompress(img, quality):
+    ok, data = cv2.imencode(".jpg", img, [cv2.IMWRITE_JPEG_QUALITY, quality])
+    return cv2.imdecode(data, cv2.IMREAD_COLOR)
+
+
+def reframe(img, rng, fraction=0.06):
+    height, width = img.shape[:2]
+    top, left = (int(rng.uniform(0, fraction) * d) for d in (height, width))
+    bottom, right = (int(rng.uniform(0, fraction) * d) for d in (height, width))
+    return cv2.resize(img[top:height - bottom, left:width - right], (width, height), interpolation=cv2.INTER_AREA)
+
+
+def rotate(img, rng, max_degrees=4):
+    height, width = img.shape[:2]
+    angle = rng.uniform(-max_degrees, max_degrees)
+    matrix = cv2.getRotationMatrix2D((width / 2, height / 2), angle, 1.0)
+    return cv2.warpAffine(img, matrix, (width, height), borderMode=cv2.BORDER_REFLECT)
+
+
+def exposure(img, rng):
+    return cv2.convertScaleAbs(img, alpha=rng.uniform(0.85, 1.15), beta=rng.uniform(-15, 15))
+
+
+VARIANTS = {
+    "whatsapp": whatsapp,
+    "reframe": lambda img, rng: recompress(reframe(img, rng), 75),
+    "rotate": lambda img, rng: recompress(rotate(img, rng), 75),
+    "exposure": lambda img, rng: recompress(exposure(img, rng), 75),
+    "burst": lambda img, rng: whatsapp(rotate(reframe(img, rng, 0.04), rng, 2), rng),
+}
+
+HASHES = {"phash": phash, "dhash": dhash}
+
+
+def controls():
+    """
+    Images whose pHashes coincide although they show nothing alike
+    """
+    gradient = np.tile(np.linspace(0, 255, 640).astype(np.uint8), (480, 1))
+    images = {
+        "solid blue": np.full((480, 640, 3), (255, 0, 0), np.uint8),
+        "solid green": np.full((480, 640, 3), (0, 200, 0), np.uint8),
+        "gradient": cv2.merge([gradient] * 3),
+    }
+    return {name: recompress(img, 75) for name, img in images.items()}
+
+
+def distinctive(bgr):
+    return is_distinctive(*phash_energy(cv2.cvtColor(bgr, cv2.COLOR_BGR2RGB)))
+
+
+def hashes_of(bgr):
+    rgb = cv2.cvtColor(bgr, cv2.COLOR_BGR2RGB)
+    return {name: fn(rgb) for name, fn in HASHES.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Perceptual hash precision on a labelled duplicate set")
+    parser.add_argument("--per-kind", type=int, default=4)
+    parser.add_argument("--real-dir", help="Directory of real photos to add as originals")
+    parser.add_argument("--max-threshold", type=int, default=16)
+    args = parser.parse_args()
+
+    corpus_dir = os.path.join(tempfile.gettempdir(), "growfrika-bench-corpus")
+    entries = corpus.build_corpus(corpus_dir, per_kind=args.per_kind, resolutions=["small", "medium"])
+    if args.real_dir:
+        entries += [{"path": p, "label": "real:" + p} for p in corpus.list_images(args.real_dir)]
+
+    rng = np.random.default_rng(7)
+    originals = []
+    for entry in entries:
+        img = cv2.imread(entry["path"])
+        originals.append({
+            "label": entry["label"],
+            "hashes": hashes_of(img),
+            "variants": {name: hashes_of(fn(img, rng)) for name, fn in VARIANTS.items()},
+        })
+    print(f"{len(originals)} originals x {len(VARIANTS)} variants", file=sys.stderr)
+
+    refused = [name for name, img in controls().items() if distinctive(img)]
+    print(f"controls refused: {'all' if not refused else 'not ' + ', '.join(refused)}")
+    indistinct = sum(not distinctive(cv2.imread(entry["path"])) for entry in entries)
+    print(f"originals refused as indistinct: {indistinct} of {len(entries)}")
+
+    for hash_name in HASHES:
+        positives = {name: [] for name in VARIANTS}
+        for original in originals:
+            for name, variant in original["variants"].items():
+                positives[name].append(hamming(original["hashes"][hash_name], variant[hash_name]))
+
+        # An original against every other original and their variants
+        negatives = []
+        for (i, a), (j, b) in itertools.permutations(enumerate(originals), 2):
+            same_label = a["label"] == b["label"]
+            pair = (min(i, j), max(i, j))
+            negatives.append((hamming(a["hashes"][hash_name], b["hashes"][hash_name]), same_label, pair))
+            for variant in b["variants"].values():
+                negatives.append((hamming(a["hashes"][hash_name], variant[hash_name]), same_label, pair))
+
+        print(f"\n{hash_name}: duplicate distance median "
+              f"{np.median([d for ds in positives.values() for d in ds]):.0f}, "
+              f"closest non-duplicate {min(d for d, _, _ in negatives)}")
+        print(f"{'threshold':>9s} {'recall':>7s} " + " ".join(f"{n:>9s}" for n in VARIANTS)
+              + f" {'precision':>10s} {'label prec':>10s} {'false pairs':>11s}")
+        for threshold in range(args.max_threshold + 1):
+            recall_by = {n: np.mean([d <= threshold for d in ds]) for n, ds in positives.items()}
+            true_matches = sum(d <= threshold for ds in positives.values() for d in ds)
+            false_matches = [same for d, same, _ in negatives if d <= threshold]
+            # Distinct pairs of originals behind the false matches
+            false_pairs = len({pair for d, _, pair in negatives if d <= threshold})
+            matched = true_matches + len(false_matches)
+            precision = true_matches / matched if matched else 1.0
+            label_precision = (true_matches + sum(false_matches)) / matched if matched else 1.0
+            recall = true_matches / sum(len(ds) for ds in positives.values())
+            print(f"{threshold:9d} {recall:7.1%} " + " ".join(f"{recall_by[n]:9.1%}" for n in VARIANTS)
+                  + f" {precision:10.2%} {label_precision:10.2%} {false_pairs:11d}")
+
+
+if __name__ == "__main__":
+    main()
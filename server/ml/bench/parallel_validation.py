@@ -0,0 +1,81 @@
+"""
+Wall-clock gain from running the validation checks on the shared thread pool.
+
+For each corpus resolution it times validate_image_content and
+validate_leaf_image serially and with each requested pool size. Images are
+decoded before timing so only the checks are measured; leaf images are used
+so the cascade runs every check.
+
+    python3 ml/bench/parallel_validation.py --threads 2 4
+"""
+import os
+import io
+import sys
+import time
+import argparse
+import tempfile
+import contextlib
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("OPENAI_API_KEY", "offline-benchmark")
+
+import numpy as np
+
+import corpus
+import validation_pool
+from image_context import ImageContext
+from model import validate_image_content
+from predict import validate_leaf_image
+
+
+def time_validation(paths, repeat):
+    """
+    Median ms per image for both validators
+    """
+    content_ms, leaf_ms = [], []
+    for path in paths:
+        for _ in range(repeat):
+            img = ImageContext.from_path(path)
+            img.rgb
+            with contextlib.redirect_stderr(io.StringIO()):
+                start = time.perf_counter()
+                validate_image_content(img, 0)
+                content_ms.append((time.perf_counter() - start) * 1000)
+
+                start = time.perf_counter()
+                validate_leaf_image(img)
+                leaf_ms.append((time.perf_counter() - start) * 1000)
+    return float(np.median(content_ms)), float(np.median(leaf_ms))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serial vs thread-pool validation benchmark")
+    parser.add_argument("--threads", type=int, nargs="+", default=[2, 4])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--per-kind", type=int, default=2)
+    args = parser.parse_args()
+
+    corpus_dir = os.path.join(tempfile.gettempdir(), "growfrika-bench-corpus")
+    entries = [e for e in corpus.build_corpus(corpus_dir, per_kind=args.per_kind) if e["kind"] == "leaf"]
+
+    print(f"Cores available: {validation_pool.available_cores()}")
+    print(f"{'resolution':12s} {'threads':>8s} {'content ms':>11s} {'speedup':>8s} {'leaf ms':>9s} {'speedup':>8s}")
+
+    for res in corpus.RESOLUTIONS:
+        paths = [e["path"] for e in entries if e["resolution"] == res]
+        validation_pool.configure_pool(0)
+        base_content, base_leaf = time_validation(paths, args.repeat)
+        print(f"{res:12s} {'serial':>8s} {base_content:11.1f} {'1.00x':>8s} {base_leaf:9.1f} {'1.00x':>8s}")
+
+        for threads in args.threads:
+            # Bypass the core cap on purpose so oversubscription shows up too
+            validation_pool.configure_pool(threads)
+            content, leaf = time_validation(paths, args.repeat)
+            print(f"{res:12s} {threads:8d} {content:11.1f} {base_content / content:7.2f}x "
+                  f"{leaf:9.1f} {base_leaf / leaf:7.2f}x")
+
+    validation_pool.configure_pool(0)
+
+
+if __name__ == "__main__":
+    main()
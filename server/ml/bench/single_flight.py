@@ -0,0 +1,185 @@
+"""
+Checks llm_client's single-flight layer against a local fake OpenAI server.
+
+The fake server answers POST /v1/chat/completions after --delay-ms,
+optionally failing its first requests, and records how many requests it
+got and how many were open at once. The real OpenAI and AsyncOpenAI
+clients are pointed at it (base_url), wrapped as predict.py and chat.py
+wrap them, and these scenarios run:
+
+- burst: --burst threads send the same prompt; the server should see one
+  request and the rest be coalesced
+- distinct: --burst different prompts; the server should never see more
+  than --max-concurrency at once
+- retries: the server answers 503 then 429 before succeeding; the call
+  should succeed after two retries
+- async burst: the burst again through AsyncSingleFlightClient
+
+Exits 1 when any scenario doesn't hold.
+
+    python3 ml/bench/single_flight.py --burst 24 --max-concurrency 4
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+ML_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ML_DIR)
+
+from openai import OpenAI, AsyncOpenAI
+
+from llm_client import SingleFlightClient, AsyncSingleFlightClient
+
+
+class FakeOpenAI(ThreadingHTTPServer):
+    """
+    Chat completions endpoint with a fixed delay and scripted failures
+    """
+
+    daemon_threads = True
+
+    def __init__(self, delay_s):
+        super().__init__(("127.0.0.1", 0), FakeHandler)
+        self.delay_s = delay_s
+        self.failures = []  # status codes to answer with, one per request
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.open = 0
+        self.max_open = 0
+
+    def reset(self, failures=()):
+        with self.lock:
+            self.failures = list(failures)
+            self.requests = self.open = self.max_open = 0
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}/v1"
+
+
+class FakeHandler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        server = self.server
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+        with server.lock:
+            server.requests += 1
+            server.open += 1
+            server.max_open = max(server.max_open, server.open)
+            failure = server.failures.pop(0) if server.failures else None
+        try:
+            time.sleep(server.delay_s)
+            if failure is not None:
+                payload = {"error": {"message": f"scripted {failure}", "type": "server_error"}}
+                self._reply(failure, payload, {"Retry-After": "0"})
+                return
+            prompt = body["messages"][-1]["content"]
+            self._reply(200, {
+                "id": "chatcmpl-fake",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": body["model"],
+                "choices": [{
+                    "index": 0,
+                    "finish_reason": "stop",
+                    "message": {"role": "assistant", "content": f"Advice for: {prompt}"},
+                }],
+                "usage": {"prompt_tokens": 1, "completion_tokens": 1, "total_tokens": 2},
+            })
+        finally:
+            with server.lock:
+                server.open -= 1
+
+    def _reply(self, status, payload, headers=None):
+        data = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+
+def ask(client, prompt):
+    completion = client.chat.completions.create(
+        model="gpt-4o-mini",
+        messages=[{"role": "user", "content": prompt}]
+    )
+    return completion.choices[0].message.content
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Single-flight OpenAI layer against a fake server")
+    parser.add_argument("--burst", type=int, default=24)
+    parser.add_argument("--max-concurrency", type=int, default=4)
+    parser.add_argument("--delay-ms", type=float, default=200)
+    args = parser.parse_args()
+
+    server = FakeOpenAI(args.delay_ms / 1000)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    options = dict(max_concurrency=args.max_concurrency, backoff_s=0.05, backoff_max_s=0.2)
+    upstream = OpenAI(api_key="fake", base_url=server.base_url, max_retries=0)
+    checks = []
+
+    def check(name, ok, detail):
+        checks.append(ok)
+        print(f"{'ok' if ok else 'FAIL':>4s}  {name}: {detail}")
+
+    # Burst of one prompt; stray whitespace still counts as the same request
+    client = SingleFlightClient(upstream, **options)
+    server.reset()
+    with ThreadPoolExecutor(args.burst) as pool:
+        prompts = ["Is my leaf healthy?" + " " * (i % 2) for i in range(args.burst)]
+        answers = set(pool.map(lambda p: ask(client, p), prompts))
+    stats = client.stats()
+    check("burst", server.requests == 1 and len(answers) == 1,
+          f"{args.burst} requests -> {server.requests} upstream, {stats['coalesced']} coalesced")
+
+    # Different prompts: all go upstream, never more than max_concurrency at once
+    client = SingleFlightClient(upstream, **options)
+    server.reset()
+    with ThreadPoolExecutor(args.burst) as pool:
+        list(pool.map(lambda i: ask(client, f"Leaf {i}"), range(args.burst)))
+    check("distinct", server.requests == args.burst and server.max_open <= args.max_concurrency,
+          f"{server.requests} upstream, at most {server.max_open} open (limit {args.max_concurrency})")
+
+    # Transient failures are retried
+    client = SingleFlightClient(upstream, **options)
+    server.reset(failures=[503, 429])
+    answer = ask(client, "Retry me")
+    stats = client.stats()
+    check("retries", answer.endswith("Retry me") and stats["retries"] == 2 and stats["failures"] == 0,
+          f"{server.requests} upstream attempts, {stats['retries']} retries")
+
+    # The same burst on an event loop
+    async def async_burst():
+        client = AsyncSingleFlightClient(
+            AsyncOpenAI(api_key="fake", base_url=server.base_url, max_retries=0), **options
+        )
+        completions = await asyncio.gather(*(
+            client.chat.completions.create(model="gpt-4o-mini", messages=[{"role": "user", "content": "Async leaf"}])
+            for _ in range(args.burst)
+        ))
+        return client.stats(), {c.choices[0].message.content for c in completions}
+
+    server.reset()
+    stats, answers = asyncio.run(async_burst())
+    check("async burst", server.requests == 1 and len(answers) == 1,
+          f"{args.burst} requests -> {server.requests} upstream, {stats['coalesced']} coalesced")
+
+    server.shutdown()
+    if not all(checks):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
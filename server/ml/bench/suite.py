@@ -0,0 +1,246 @@
+"""
+Reproducible, offline benchmark suite for the prediction pipeline.
+
+Runs on the synthetic corpus (plus any real photos given with --real-dir)
+with the OpenAI client stubbed and the result/advice caches and near-duplicate reuse off, and times:
+
+- decode, validate_leaf_image, validate_image_content and every check_*
+  per corpus resolution
+- preprocess_image
+- the model's predict at batch sizes 1, 2, 4, ... up to --max-batch
+- run_prediction end to end (what predict.py's main() prints)
+
+Each benchmark records p50/p95/p99/mean latency, throughput and the peak RSS
+of the process so far. --save writes them as the JSON baseline; --check
+compares against it and exits 1 when anything regresses beyond --tolerance.
+
+    python3 ml/bench/suite.py --save
+    python3 ml/bench/suite.py --check --tolerance 0.25
+"""
+import os
+import io
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+import resource
+import contextlib
+
+ML_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ML_DIR)
+
+# No network: canned LLM replies, and no caches that would hide the work
+os.environ["ML_LLM_STUB"] = "1"
+os.environ["ML_RESULT_CACHE_SIZE"] = "0"
+os.environ["ML_RESULT_CACHE_PATH"] = ""
+os.environ["ML_ADVICE_VARIANTS"] = "0"
+os.environ["ML_NEAR_DUP_ENTRIES"] = "0"
+os.environ.setdefault("OPENAI_API_KEY", "offline-benchmark")
+
+import numpy as np
+
+import corpus
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+
+# Lower is better for these; throughput is the only higher-is-better metric
+LATENCY_METRICS = ("p50_ms", "p95_ms", "p99_ms")
+
+
+def peak_rss_mib():
+    # ru_maxrss is in KiB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def summarize(samples_ms, items_per_sample=1):
+    samples = np.array(samples_ms, dtype=np.float64)
+    total_s = samples.sum() / 1000
+    return {
+        "n": int(len(samples)),
+        "p50_ms": round(float(np.percentile(samples, 50)), 3),
+        "p95_ms": round(float(np.percentile(samples, 95)), 3),
+        "p99_ms": round(float(np.percentile(samples, 99)), 3),
+        "mean_ms": round(float(samples.mean()), 3),
+        "throughput_per_s": round(len(samples) * items_per_sample / total_s, 3) if total_s else 0.0,
+        "peak_rss_mib": round(peak_rss_mib(), 1),
+    }
+
+
+def time_calls(fn, args_list, repeat, setup=None):
+    """
+    Times fn(*args) for every args tuple, repeat times each. setup(args),
+    when given, prepares fresh arguments outside the timed region.
+    """
+    samples = []
+    with contextlib.redirect_stderr(io.StringIO()):
+        for args in args_list:
+            for _ in range(repeat):
+                call_args = setup(args) if setup else args
+                start = time.perf_counter()
+                fn(*call_args)
+                samples.append((time.perf_counter() - start) * 1000)
+    return samples
+
+
+def run_suite(entries, repeat, max_batch):
+    from image_context import ImageContext
+    import model as model_module
+    from model import validate_image_content, preprocess_image, VALIDATION_STAGES, IMG_SIZE
+    from predict import validate_leaf_image, run_prediction
+
+    def decoded(args):
+        img = ImageContext.from_path(args[0])
+        img.rgb
+        return (img,)
+
+    results = {}
+    present = {e["resolution"] for e in entries}
+    resolutions = [res for res in list(corpus.RESOLUTIONS) + ["real"] if res in present]
+
+    for res in resolutions:
+        paths = [(e["path"],) for e in entries if e["resolution"] == res]
+
+        results[f"decode[{res}]"] = summarize(time_calls(
+            lambda img: img.rgb, paths, repeat, setup=lambda a: (ImageContext.from_path(a[0]),)
+        ))
+        results[f"validate_leaf_image[{res}]"] = summarize(
+            time_calls(validate_leaf_image, paths, repeat, setup=decoded)
+        )
+        results[f"validate_image_content[{res}]"] = summarize(
+            time_calls(validate_image_content, paths, repeat, setup=decoded)
+        )
+        for _, check, _, _ in VALIDATION_STAGES:
+            results[f"{check.__name__}[{res}]"] = summarize(
+                time_calls(check, paths, repeat, setup=decoded)
+            )
+        results[f"preprocess_image[{res}]"] = summarize(
+            time_calls(preprocess_image, paths, repeat, setup=decoded)
+        )
+        print(f"  {res}: done", file=sys.stderr)
+
+    # Model forward pass on real preprocessed tensors. Each batch shape gets
+    # a warm-up call first, so one-off graph tracing isn't counted
+    tensors = [ImageContext.from_path(e["path"]).model_tensor(IMG_SIZE)[0] for e in entries]
+    backend = model_module.model
+
+    batch_size = 1
+    while batch_size <= max_batch:
+        batches = [
+            (np.stack([tensors[(i + k) % len(tensors)] for k in range(batch_size)]),)
+            for i in range(0, len(tensors), batch_size)
+        ]
+        time_calls(backend.predict, batches[:1], 1)
+        results[f"model.predict[batch={batch_size}]"] = summarize(
+            time_calls(backend.predict, batches, repeat), items_per_sample=batch_size
+        )
+        batch_size *= 2
+    print("  model: done", file=sys.stderr)
+
+    all_paths = [(e["path"],) for e in entries]
+    time_calls(run_prediction, all_paths[:1], 1)
+    results["run_prediction[end_to_end]"] = summarize(time_calls(run_prediction, all_paths, repeat))
+    print("  end to end: done", file=sys.stderr)
+
+    return results
+
+
+def compare(baseline, current, tolerance):
+    """
+    Lines describing every metric that got worse than the baseline by more
+    than tolerance (a fraction)
+    """
+    regressions = []
+    for name, base in baseline.get("results", {}).items():
+        now = current["results"].get(name)
+        if now is None:
+            continue
+        for metric in LATENCY_METRICS + ("peak_rss_mib",):
+            if base[metric] > 0 and now[metric] > base[metric] * (1 + tolerance):
+                regressions.append(f"{name} {metric}: {base[metric]} -> {now[metric]} "
+                                   f"(+{now[metric] / base[metric] - 1:.0%})")
+        if base["throughput_per_s"] > 0 and now["throughput_per_s"] < base["throughput_per_s"] * (1 - tolerance):
+            regressions.append(f"{name} throughput_per_s: {base['throughput_per_s']} -> {now['throughput_per_s']} "
+                               f"({now['throughput_per_s'] / base['throughput_per_s'] - 1:.0%})")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmark suite for the ML pipeline")
+    parser.add_argument("--per-kind", type=int, default=2)
+    parser.add_argument("--resolutions", nargs="+", choices=list(corpus.RESOLUTIONS), default=list(corpus.RESOLUTIONS))
+    parser.add_argument("--real-dir", help="Directory of real photos to add to the corpus")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--max-batch", type=int, default=16)
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--save", action="store_true", help="Write the results as the new baseline")
+    parser.add_argument("--check", action="store_true", help="Exit 1 on regressions against the baseline")
+    parser.add_argument("--tolerance", type=float, default=0.20)
+    parser.add_argument("--output", help="Also write the results JSON here")
+    args = parser.parse_args()
+
+    corpus_dir = os.path.join(tempfile.gettempdir(), "growfrika-bench-corpus")
+    entries = corpus.build_corpus(corpus_dir, per_kind=args.per_kind, resolutions=args.resolutions)
+    if args.real_dir:
+        entries += [
+            {"path": path, "kind": "real", "label": None, "resolution": "real"}
+            for path in corpus.list_images(args.real_dir)
+        ]
+
+    print(f"Benchmarking {len(entries)} images, {args.repeat} runs each", file=sys.stderr)
+    started = time.time()
+    results = run_suite(entries, args.repeat, args.max_batch)
+
+    import tensorflow as tf # pyright: ignore[reportMissingModuleSource]
+    report = {
+        "meta": {
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "duration_s": round(time.time() - started, 1),
+            "python": platform.python_version(),
+            "tensorflow": tf.__version__,
+            "machine": platform.machine(),
+            "cpus": os.cpu_count(),
+            "images": len(entries),
+            "per_kind": args.per_kind,
+            "resolutions": args.resolutions,
+            "repeat": args.repeat,
+            "model_backend": os.getenv("ML_MODEL_BACKEND", "keras"),
+        },
+        "results": results,
+    }
+
+    print(f"\n{'benchmark':42s} {'p50 ms':>9s} {'p95 ms':>9s} {'p99 ms':>9s} {'per s':>9s} {'RSS MiB':>8s}")
+    for name, r in results.items():
+        print(f"{name:42s} {r['p50_ms']:9.2f} {r['p95_ms']:9.2f} {r['p99_ms']:9.2f} "
+              f"{r['throughput_per_s']:9.1f} {r['peak_rss_mib']:8.0f}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+    regressions = []
+    if args.check:
+        if not os.path.exists(args.baseline):
+            print(f"\nNo baseline at {args.baseline}; run with --save first")
+            sys.exit(2)
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(baseline, report, args.tolerance)
+        print(f"\nAgainst {args.baseline} (tolerance {args.tolerance:.0%}):")
+        for line in regressions:
+            print(f"  REGRESSION {line}")
+        if not regressions:
+            print("  no regressions")
+
+    if args.save:
+        with open(args.baseline, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nBaseline written to {args.baseline}")
+
+    if regressions:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
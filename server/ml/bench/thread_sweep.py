@@ -0,0 +1,196 @@
+"""
+Finds the best layout of prediction workers x threads per worker for this
+machine.
+
+For every layout, starts that many `predict.py --worker` processes the way
+the Node pool does (ML_WORKER_INDEX / ML_WORKER_COUNT, CPU affinity "auto"),
+with TensorFlow and OpenCV sized to the given threads, and keeps each one
+busy with --inflight concurrent requests over the synthetic corpus. Reports
+images/s and latency per layout, fastest first, and the settings to use.
+Layouts with more threads than cores are included up to --max-oversubscription
+so the cost of oversubscribing shows up too; --onednn 0 1 measures oneDNN
+both ways.
+
+    python3 ml/bench/thread_sweep.py --images 60
+    python3 ml/bench/thread_sweep.py --workers 1 2 4 --threads 1 2 --onednn 0 1
+"""
+import os
+import sys
+import json
+import time
+import queue
+import argparse
+import tempfile
+import threading
+import subprocess
+
+ML_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ML_DIR)
+
+import numpy as np
+
+import corpus
+from validation_pool import available_cores
+
+
+def powers_of_two(limit):
+    values, value = [], 1
+    while value <= limit:
+        values.append(value)
+        value *= 2
+    if values[-1] != limit:
+        values.append(limit)
+    return values
+
+
+class Worker:
+    """
+    One predict.py worker process driven over its JSON-lines protocol
+    """
+
+    def __init__(self, env):
+        self.proc = subprocess.Popen(
+            [sys.executable, os.path.join(ML_DIR, "predict.py"), "--worker"],
+            cwd=ML_DIR, env=env, text=True,
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL
+        )
+        self.ready = json.loads(self.proc.stdout.readline())
+        if self.ready.get("type") != "ready":
+            raise RuntimeError(f"Worker did not start: {self.ready}")
+
+    def drive(self, images, inflight, latencies):
+        """
+        Sends images from the shared queue, keeping up to inflight outstanding
+        """
+        sent = {}
+        next_id = 0
+        done = False
+        while True:
+            while not done and len(sent) < inflight:
+                try:
+                    path = images.get_nowait()
+                except queue.Empty:
+                    done = True
+                    break
+                next_id += 1
+                sent[next_id] = time.perf_counter()
+                self.proc.stdin.write(json.dumps({"id": next_id, "type": "predict", "image_path": path}) + "\n")
+                self.proc.stdin.flush()
+            if not sent:
+                return
+            response = json.loads(self.proc.stdout.readline())
+            started = sent.pop(response["id"])
+            latencies.append((time.perf_counter() - started) * 1000)
+
+    def stop(self):
+        try:
+            self.proc.stdin.write(json.dumps({"type": "shutdown"}) + "\n")
+            self.proc.stdin.close()
+            self.proc.wait(timeout=30)
+        except Exception:
+            self.proc.kill()
+
+
+def run_layout(workers, threads, onednn, paths, inflight, affinity):
+    base = dict(
+        os.environ,
+        ML_LLM_STUB="1",
+        ML_RESULT_CACHE_SIZE="0",
+        ML_RESULT_CACHE_PATH="",
+        ML_ADVICE_VARIANTS="0",
+        ML_NEAR_DUP_ENTRIES="0",
+        ML_TF_INTRA_THREADS=str(threads),
+        ML_TF_INTER_THREADS="1",
+        ML_CV_THREADS=str(threads),
+        ML_ONEDNN=str(onednn),
+        ML_CPU_AFFINITY=affinity,
+        ML_WORKER_COUNT=str(workers),
+        ML_BATCH_MAX_SIZE=str(inflight),
+        TF_CPP_MIN_LOG_LEVEL="2",
+    )
+    base.setdefault("OPENAI_API_KEY", "offline-benchmark")
+
+    pool = [Worker(dict(base, ML_WORKER_INDEX=str(i))) for i in range(workers)]
+    try:
+        # One pass per worker first, so tracing and first-call costs aren't timed
+        for worker in pool:
+            warm = queue.Queue()
+            warm.put(paths[0])
+            worker.drive(warm, 1, [])
+
+        images = queue.Queue()
+        for path in paths:
+            images.put(path)
+        latencies = []
+        drivers = [threading.Thread(target=w.drive, args=(images, inflight, latencies)) for w in pool]
+        started = time.perf_counter()
+        for driver in drivers:
+            driver.start()
+        for driver in drivers:
+            driver.join()
+        elapsed = time.perf_counter() - started
+    finally:
+        for worker in pool:
+            worker.stop()
+
+    samples = np.array(latencies)
+    return {
+        "workers": workers,
+        "threads": threads,
+        "onednn": onednn,
+        "images_per_s": round(len(samples) / elapsed, 2),
+        "p50_ms": round(float(np.percentile(samples, 50)), 1),
+        "p95_ms": round(float(np.percentile(samples, 95)), 1),
+        "cpus": [w.ready.get("startup", {}).get("runtime", {}).get("cpus") for w in pool],
+    }
+
+
+def main():
+    cores = available_cores()
+    parser = argparse.ArgumentParser(description="Sweep prediction workers x threads per worker")
+    parser.add_argument("--workers", type=int, nargs="+", default=powers_of_two(cores))
+    parser.add_argument("--threads", type=int, nargs="+", default=powers_of_two(cores))
+    parser.add_argument("--onednn", type=int, nargs="+", choices=[0, 1], default=[0])
+    parser.add_argument("--max-oversubscription", type=float, default=2.0,
+                        help="Skip layouts with more than this many threads per core")
+    parser.add_argument("--affinity", default="auto", help="ML_CPU_AFFINITY for the workers (\"\" for none)")
+    parser.add_argument("--images", type=int, default=48)
+    parser.add_argument("--inflight", type=int, default=4, help="Concurrent requests per worker")
+    parser.add_argument("--output", help="Write the results as JSON here")
+    args = parser.parse_args()
+
+    corpus_dir = os.path.join(tempfile.gettempdir(), "growfrika-bench-corpus")
+    entries = corpus.build_corpus(corpus_dir, per_kind=2, resolutions=["small", "medium"])
+    paths = [entries[i % len(entries)]["path"] for i in range(args.images)]
+
+    layouts = [
+        (w, t, d) for d in args.onednn for w in args.workers for t in args.threads
+        if w * t <= cores * args.max_oversubscription
+    ]
+    print(f"{cores} cores, {len(layouts)} layouts, {args.images} images each", file=sys.stderr)
+
+    results = []
+    for workers, threads, onednn in layouts:
+        result = run_layout(workers, threads, onednn, paths, args.inflight, args.affinity)
+        results.append(result)
+        print(f"  {workers} x {threads} threads, oneDNN {onednn}: {result['images_per_s']} images/s", file=sys.stderr)
+
+    results.sort(key=lambda r: -r["images_per_s"])
+    print(f"\n{'workers':>7s} {'threads':>7s} {'oneDNN':>6s} {'images/s':>9s} {'p50 ms':>8s} {'p95 ms':>8s}")
+    for r in results:
+        print(f"{r['workers']:7d} {r['threads']:7d} {r['onednn']:6d} {r['images_per_s']:9.2f} "
+              f"{r['p50_ms']:8.1f} {r['p95_ms']:8.1f}")
+
+    best = results[0]
+    affinity = args.affinity or '""'
+    print(f"\nBest: ML_PREDICT_WORKERS={best['workers']} ML_TF_INTRA_THREADS={best['threads']} "
+          f"ML_CV_THREADS={best['threads']} ML_TF_INTER_THREADS=1 ML_ONEDNN={best['onednn']} "
+          f"ML_CPU_AFFINITY={affinity}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"cores": cores, "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
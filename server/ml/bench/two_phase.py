@@ -0,0 +1,84 @@
+"""
+Time to diagnosis vs time to advice in the prediction worker.
+
+Starts `predict.py --worker` with the LLM stubbed to answer after
+--llm-delay-ms and sends --requests streamed predictions at once. Reports
+when the "prediction" events (diagnosis) and the final responses (with the
+LLM text) arrived, and the wall time of the whole burst: with the LLM
+calls overlapping on the worker's event loop it stays close to one LLM
+delay instead of growing with the number of requests.
+
+    python3 ml/bench/two_phase.py --requests 16 --llm-delay-ms 1500
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import subprocess
+
+ML_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ML_DIR)
+
+import numpy as np
+
+import corpus
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Diagnosis and LLM latency of streamed predictions")
+    parser.add_argument("--requests", type=int, default=16)
+    parser.add_argument("--llm-delay-ms", type=float, default=1500)
+    parser.add_argument("--compute-threads", type=int, default=2, help="ML_WORKER_CONCURRENCY of the worker")
+    args = parser.parse_args()
+
+    corpus_dir = os.path.join(tempfile.gettempdir(), "growfrika-bench-corpus")
+    entries = [e for e in corpus.build_corpus(corpus_dir, per_kind=2, resolutions=["small"]) if e["kind"] == "leaf"]
+
+    env = dict(
+        os.environ,
+        ML_LLM_STUB="1",
+        ML_LLM_STUB_DELAY_MS=str(args.llm_delay_ms),
+        ML_RESULT_CACHE_SIZE="0",
+        ML_RESULT_CACHE_PATH="",
+        ML_ADVICE_VARIANTS="0",
+        ML_NEAR_DUP_ENTRIES="0",
+        ML_WORKER_CONCURRENCY=str(args.compute_threads),
+        TF_CPP_MIN_LOG_LEVEL="2",
+    )
+    env.setdefault("OPENAI_API_KEY", "offline-benchmark")
+    proc = subprocess.Popen(
+        [sys.executable, os.path.join(ML_DIR, "predict.py"), "--worker"],
+        cwd=ML_DIR, env=env, text=True,
+        stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL
+    )
+    json.loads(proc.stdout.readline())
+
+    try:
+        started = time.perf_counter()
+        for i in range(args.requests):
+            path = entries[i % len(entries)]["path"]
+            proc.stdin.write(json.dumps({"id": i, "type": "predict", "image_path": path, "stream": True}) + "\n")
+        proc.stdin.flush()
+
+        diagnosis, advice = {}, {}
+        while len(advice) < args.requests:
+            message = json.loads(proc.stdout.readline())
+            arrived = (time.perf_counter() - started) * 1000
+            (diagnosis if message["type"] == "prediction" else advice)[message["id"]] = arrived
+        wall_ms = (time.perf_counter() - started) * 1000
+    finally:
+        proc.stdin.write(json.dumps({"type": "shutdown"}) + "\n")
+        proc.stdin.close()
+        proc.wait(timeout=30)
+
+    for label, times in (("diagnosis", diagnosis), ("with advice", advice)):
+        samples = np.array(list(times.values()))
+        print(f"{label:>12s}: p50 {np.percentile(samples, 50):8.1f} ms   p99 {np.percentile(samples, 99):8.1f} ms")
+    print(f"{args.requests} requests in {wall_ms:.0f} ms "
+          f"(sequential LLM calls alone would take {args.requests * args.llm_delay_ms:.0f} ms)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,184 @@
+"""
+Compares reduced-size validation against full-resolution validation.
+
+For every image it runs each check_* helper on the full upload and on a
+proxy with a bounded long side (JPEGs decoded in PIL draft mode), then
+reports per-check scores, timings and whether the accept/reject decision
+of validate_image_content changed. The synthetic corpus is joined by long,
+narrow copies of it (900x100 and 2400x260, like a strip cropped from a
+panorama), reported separately: by the long side alone their proxy would
+keep only a few dozen rows.
+
+    python3 ml/bench/validation_report.py --max-side 1024
+    python3 ml/bench/validation_report.py --images ~/field_photos --json report.json
+"""
+import os
+import io
+import sys
+import json
+import time
+import argparse
+import tempfile
+import contextlib
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import cv2
+import numpy as np
+
+import corpus
+from image_context import ImageContext
+import model
+
+ELONGATED_SIZES = [(900, 100), (2400, 260)]
+
+CHECKS = {
+    "green_content": model.check_green_content,
+    "leaf_shape": model.check_leaf_shapes,
+    "texture": model.check_texture_features,
+    "color_distribution": model.check_color_distribution,
+    "size_quality": model.check_image_dimensions,
+}
+
+
+def _timed(fn, *args):
+    start = time.perf_counter()
+    with contextlib.redirect_stderr(io.StringIO()):
+        value = fn(*args)
+    return value, (time.perf_counter() - start) * 1000
+
+
+def _decode(path, max_side):
+    view = ImageContext.from_path(path).validation_view(max_side)
+    view.rgb
+    return view
+
+
+def run_checks(path, max_side):
+    """
+    Runs every check on one image and returns scores and timings in ms.
+    Decoding is timed separately from the checks
+    """
+    view, decode_ms = _timed(_decode, path, max_side)
+
+    scores, timings = {}, {"decode": decode_ms}
+    for name, check in CHECKS.items():
+        scores[name], timings[name] = _timed(check, view)
+
+    decision, _ = _timed(model.validate_image_content, view, 0)
+    return {
+        "scores": scores,
+        "timings_ms": timings,
+        "total_ms": sum(timings.values()),
+        "is_valid": decision["is_valid"],
+        "reason": decision.get("reason"),
+        "validation_score": decision.get("validation_score"),
+    }
+
+
+def elongated(entries, directory):
+    """
+    Long, narrow copies of the corpus images at ELONGATED_SIZES
+    """
+    os.makedirs(directory, exist_ok=True)
+    paths = []
+    for entry in entries:
+        img = cv2.imread(entry["path"])
+        for width, height in ELONGATED_SIZES:
+            path = os.path.join(directory, f"elongated_{width}x{height}_{os.path.basename(entry['path'])}")
+            if not os.path.exists(path):
+                cv2.imwrite(path, cv2.resize(img, (width, height), interpolation=cv2.INTER_AREA))
+            paths.append(path)
+    return paths
+
+
+def _agreement(rows, field):
+    return float(np.mean([r["full"][field] == r["proxy"][field] for r in rows])) if rows else 1.0
+
+
+def build_report(paths, max_side):
+    rows = []
+    for path in paths:
+        full = run_checks(path, 0)
+        proxy = run_checks(path, max_side)
+        rows.append({"path": path, "full": full, "proxy": proxy})
+        print(
+            f"{os.path.basename(path):40s} full {full['total_ms']:8.1f}ms  proxy {proxy['total_ms']:7.1f}ms  "
+            f"decision {'same' if full['is_valid'] == proxy['is_valid'] else 'CHANGED'}",
+            file=sys.stderr
+        )
+
+    summary = {
+        "images": len(rows),
+        "max_side": max_side,
+        "decision_agreement": _agreement(rows, "is_valid"),
+        "reason_agreement": _agreement(rows, "reason"),
+        "speedup": float(sum(r["full"]["total_ms"] for r in rows) / max(1e-9, sum(r["proxy"]["total_ms"] for r in rows))),
+        "checks": {},
+    }
+    for name in list(CHECKS) + ["decode"]:
+        full_ms = [r["full"]["timings_ms"][name] for r in rows]
+        proxy_ms = [r["proxy"]["timings_ms"][name] for r in rows]
+        entry = {
+            "full_ms_mean": float(np.mean(full_ms)),
+            "proxy_ms_mean": float(np.mean(proxy_ms)),
+        }
+        if name in CHECKS:
+            diffs = [abs(r["full"]["scores"][name] - r["proxy"]["scores"][name]) for r in rows]
+            entry["score_abs_diff_mean"] = float(np.mean(diffs))
+            entry["score_abs_diff_max"] = float(np.max(diffs))
+            entry["score_changed"] = int(sum(d > 1e-9 for d in diffs))
+        summary["checks"][name] = entry
+
+    narrow = [r for r in rows if os.path.basename(r["path"]).startswith("elongated_")]
+    summary["elongated"] = {
+        "images": len(narrow),
+        "decision_agreement": _agreement(narrow, "is_valid"),
+        "reason_agreement": _agreement(narrow, "reason"),
+    }
+
+    return {"summary": summary, "images": rows}
+
+
+def print_summary(summary):
+    print(f"\nValidation proxy report: {summary['images']} images, max side {summary['max_side']}px")
+    print(f"Decision agreement: {summary['decision_agreement']:.1%}  "
+          f"reason agreement: {summary['reason_agreement']:.1%}  speedup: {summary['speedup']:.1f}x")
+    narrow = summary["elongated"]
+    if narrow["images"]:
+        print(f"Elongated images ({narrow['images']}): decision agreement {narrow['decision_agreement']:.1%}  "
+              f"reason agreement {narrow['reason_agreement']:.1%}")
+    print()
+    print(f"{'stage':20s} {'full ms':>10s} {'proxy ms':>10s} {'|diff| mean':>12s} {'|diff| max':>11s} {'changed':>8s}")
+    for name, entry in summary["checks"].items():
+        print(
+            f"{name:20s} {entry['full_ms_mean']:10.1f} {entry['proxy_ms_mean']:10.1f} "
+            f"{entry.get('score_abs_diff_mean', 0):12.3f} {entry.get('score_abs_diff_max', 0):11.3f} "
+            f"{entry.get('score_changed', '-'):>8}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare reduced-size and full-resolution validation")
+    parser.add_argument("--images", help="Directory of sample images (default: synthetic corpus)")
+    parser.add_argument("--max-side", type=int, default=1024)
+    parser.add_argument("--json", help="Write the full report to this file")
+    args = parser.parse_args()
+
+    if args.images:
+        paths = corpus.list_images(args.images)
+    else:
+        corpus_dir = os.path.join(tempfile.gettempdir(), "growfrika-bench-corpus")
+        entries = corpus.build_corpus(corpus_dir)
+        paths = [e["path"] for e in entries] + elongated(entries, os.path.join(corpus_dir, "elongated"))
+
+    report = build_report(paths, args.max_side)
+    print_summary(report["summary"])
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
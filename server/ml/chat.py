@@ -1,58 +1,429 @@
 import os
 import sys
 import json
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from openai import OpenAI
+from llm_client import SingleFlightClient, LazyClient
 
-# Setup OpenAI client
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+try:
+    import tiktoken
+    _encoding = tiktoken.get_encoding("o200k_base")
+except Exception:
+    # Optional: without tiktoken, tokens are estimated from the text length
+    _encoding = None
 
-def get_chat_response(conversation_history):
+# Setup OpenAI client. One client per process: in worker mode its HTTP
+# connection pool is reused by every conversation. Retries and the
+# upstream concurrency limit come from llm_client's single-flight layer.
+# It is built on first use, so a missing key fails the message, not startup
+client = SingleFlightClient(LazyClient(lambda: OpenAI(
+    api_key=os.getenv("OPENAI_API_KEY"),
+    timeout=float(os.getenv("ML_CHAT_TIMEOUT_S", "60")),
+    max_retries=0
+)))
+
+# Conversations answered at the same time in worker mode
+CHAT_CONCURRENCY = int(os.getenv("ML_CHAT_CONCURRENCY", "8"))
+
+# Prompt token budget per turn. System messages (instructions and the
+# diagnosis) are always sent; older turns that don't fit are folded into a
+# rolling summary of at most CHAT_SUMMARY_TOKENS. 0 sends everything.
+CHAT_CONTEXT_TOKENS = int(os.getenv("ML_CHAT_CONTEXT_TOKENS", "3000"))
+CHAT_SUMMARY_TOKENS = int(os.getenv("ML_CHAT_SUMMARY_TOKENS", "300"))
+CHAT_SUMMARY_CACHE_SIZE = int(os.getenv("ML_CHAT_SUMMARY_CACHE_SIZE", "1000"))
+
+SUMMARY_PREFIX = "Summary of the earlier conversation with this user:\n"
+
+
+def count_tokens(text):
+    if _encoding is not None:
+        return len(_encoding.encode(text))
+    return (len(text) + 3) // 4
+
+
+def message_tokens(message):
+    # Every chat message carries a few tokens of role/formatting overhead
+    return count_tokens(str(message.get("content") or "")) + 4
+
+
+def message_fingerprint(message):
+    return hashlib.sha1(f"{message.get('role')}\x00{message.get('content')}".encode()).hexdigest()
+
+
+class ContextManager:
+    """
+    Fits conversations into a token budget.
+
+    System messages are pinned. The most recent turns are kept verbatim
+    while they fit, and everything older is replaced by a rolling summary.
+    The summary is cached per conversation and only extended with turns it
+    hasn't seen yet, in batches, so a long conversation costs a small
+    summarisation call every few turns rather than one per message.
+    Conversations without an id get no summary; their oldest turns are
+    dropped instead.
+    """
+
+    def __init__(self, client, budget_tokens=3000, summary_tokens=300, max_conversations=1000):
+        self.client = client
+        self.budget_tokens = budget_tokens
+        self.summary_tokens = summary_tokens
+        self.max_conversations = max_conversations
+        self._summaries = OrderedDict()
+        self._locks = {}
+        self._lock = threading.Lock()
+        self.counters = {
+            "turns": 0,
+            "tokens_full": 0,
+            "tokens_sent": 0,
+            "tokens_saved": 0,
+            "summaries_generated": 0,
+            "summary_cache_hits": 0,
+            "summary_errors": 0,
+        }
+
+    def _conversation_lock(self, conversation_id):
+        with self._lock:
+            return self._locks.setdefault(conversation_id, threading.Lock())
+
+    def _state(self, conversation_id):
+        with self._lock:
+            state = self._summaries.get(conversation_id)
+            if state is None:
+                state = {"summary": "", "folded": []}
+                self._summaries[conversation_id] = state
+                while len(self._summaries) > self.max_conversations:
+                    old_id, _ = self._summaries.popitem(last=False)
+                    self._locks.pop(old_id, None)
+            self._summaries.move_to_end(conversation_id)
+            return state
+
+    def _summarize(self, previous, turns):
+        transcript = "\n".join(f"{m.get('role')}: {m.get('content')}" for m in turns)
+        prompt = (
+            "You maintain a running summary of a conversation between a coffee farmer and an "
+            "agronomy assistant. Update the summary with the new messages below. Keep the facts "
+            "that matter for later questions: symptoms, diagnoses, treatments discussed, the "
+            "farmer's situation and open questions. Be concise.\n\n"
+            f"Current summary:\n{previous or '(none yet)'}\n\n"
+            f"New messages:\n{transcript}\n\n"
+            "Updated summary:"
+        )
+        completion = self.client.chat.completions.create(
+            model="gpt-4o-mini",
+            messages=[{"role": "user", "content": prompt}],
+            temperature=0.3,
+            max_tokens=self.summary_tokens
+        )
+        return completion.choices[0].message.content.strip()
+
+    @staticmethod
+    def _newest_fitting(turns, room):
+        """
+        The longest run of newest turns that fits in room tokens; the latest
+        message is always included, even if it alone doesn't fit
+        """
+        kept = []
+        for message in reversed(turns):
+            cost = message_tokens(message)
+            if kept and cost > room:
+                break
+            kept.insert(0, message)
+            room -= cost
+        return kept
+
+    @staticmethod
+    def _folded_count(folded, turns):
+        """
+        How many of the oldest turns were already folded into the summary.
+        folded is the sequence of folded turns, oldest first; the caller may
+        have dropped the oldest turns since, so the count is the longest
+        start of turns that continues that sequence. Position matters, not
+        content: a later "yes" or "thanks" equal to a folded one is never
+        counted, and neither is the latest message
+        """
+        fingerprints = [message_fingerprint(m) for m in turns]
+        for count in range(min(len(folded), len(turns) - 1), 0, -1):
+            if fingerprints[:count] == folded[-count:]:
+                return count
+        return 0
+
+    def _fit(self, conversation_id, turns, available):
+        """
+        Summary text plus the turns to send verbatim. Turns folded into the
+        summary stay folded; when the rest no longer fits, the oldest are
+        folded until only half the room is used, so the summary is extended
+        every few turns rather than on every one.
+        """
+        with self._conversation_lock(conversation_id):
+            state = self._state(conversation_id)
+            recent = turns[self._folded_count(state["folded"], turns):]
+
+            if sum(message_tokens(m) for m in recent) <= available:
+                if state["folded"]:
+                    with self._lock:
+                        self.counters["summary_cache_hits"] += 1
+                return state["summary"], recent
+
+            kept = self._newest_fitting(recent, available // 2)
+            folded = recent[:len(recent) - len(kept)]
+            try:
+                state["summary"] = self._summarize(state["summary"], folded)
+                state["folded"].extend(message_fingerprint(m) for m in folded)
+                with self._lock:
+                    self.counters["summaries_generated"] += 1
+            except Exception as e:
+                # Answer without the oldest turns rather than fail the message;
+                # they are folded in on a later turn
+                with self._lock:
+                    self.counters["summary_errors"] += 1
+                print(f"Conversation summary failed: {e}", file=sys.stderr)
+                kept = self._newest_fitting(recent, available)
+            return state["summary"], kept
+
+    def build(self, messages, conversation_id=None):
+        """
+        Messages to send for this turn, and how many tokens they take
+        """
+        full_tokens = sum(message_tokens(m) for m in messages)
+        context = messages
+
+        if self.budget_tokens > 0 and full_tokens > self.budget_tokens:
+            pinned = [m for m in messages if m.get("role") == "system"]
+            turns = [m for m in messages if m.get("role") != "system"]
+            available = self.budget_tokens - sum(message_tokens(m) for m in pinned) - self.summary_tokens
+
+            if conversation_id is None:
+                # A summary is only kept for an explicit conversation: keyed
+                # on content, two users' conversations could share one.
+                # Without an id the oldest turns are just left out
+                summary, kept = "", self._newest_fitting(turns, available + self.summary_tokens)
+            else:
+                summary, kept = self._fit(str(conversation_id), turns, available)
+
+            context = list(pinned)
+            if summary:
+                context.append({"role": "system", "content": SUMMARY_PREFIX + summary})
+            context.extend(kept)
+
+        sent_tokens = sum(message_tokens(m) for m in context)
+        with self._lock:
+            self.counters["turns"] += 1
+            self.counters["tokens_full"] += full_tokens
+            self.counters["tokens_sent"] += sent_tokens
+            self.counters["tokens_saved"] += max(0, full_tokens - sent_tokens)
+
+        return context, {
+            "tokens_full": full_tokens,
+            "tokens_sent": sent_tokens,
+            "messages_full": len(messages),
+            "messages_sent": len(context)
+        }
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.counters)
+            stats["conversations"] = len(self._summaries)
+        return stats
+
+
+context_manager = ContextManager(
+    client,
+    budget_tokens=CHAT_CONTEXT_TOKENS,
+    summary_tokens=CHAT_SUMMARY_TOKENS,
+    max_conversations=CHAT_SUMMARY_CACHE_SIZE
+)
+
+def get_chat_response(conversation_history, on_delta=None, conversation_id=None):
+    """
+    Completes the conversation. With on_delta, the completion is streamed and
+    on_delta is called with every chunk of text as it arrives.
+    """
     try:
-        completion = client.chat.completions.create(
+        messages, context = context_manager.build(conversation_history, conversation_id)
+
+        if on_delta is None:
+            completion = client.chat.completions.create(
+                model="gpt-4o-mini",
+                messages=messages,
+                temperature=0.7,
+                max_tokens=500
+            )
+
+            response = completion.choices[0].message.content
+            return {"response": response, "success": True, "context": context}
+
+        started = time.perf_counter()
+        first_token_ms = None
+        parts = []
+
+        stream = client.chat.completions.create(
             model="gpt-4o-mini",
-            messages=conversation_history,
+            messages=messages,
             temperature=0.7,
-            max_tokens=500
+            max_tokens=500,
+            stream=True
         )
-        
-        response = completion.choices[0].message.content
-        return {"response": response, "success": True}
-    
+        for chunk in stream:
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta.content
+            if not delta:
+                continue
+            if first_token_ms is None:
+                first_token_ms = round((time.perf_counter() - started) * 1000, 1)
+            parts.append(delta)
+            on_delta(delta)
+
+        return {
+            "response": "".join(parts),
+            "success": True,
+            "first_token_ms": first_token_ms,
+            "total_ms": round((time.perf_counter() - started) * 1000, 1),
+            "context": context
+        }
+
     except Exception as e:
         return {"error": str(e), "success": False}
 
+
+def handle_worker_message(message, send, stats):
+    """
+    Answers one JSON-lines request from the Node worker pool.
+    Supported types: chat, health, ready
+    """
+    msg_type = message.get("type", "chat")
+    request_id = message.get("id")
+
+    if msg_type == "chat":
+        messages = message.get("messages")
+        if not isinstance(messages, list) or not messages:
+            result = {"error": "No conversation provided", "success": False}
+        elif message.get("stream", True):
+            result = get_chat_response(
+                messages,
+                on_delta=lambda text: send({"id": request_id, "type": "delta", "content": text}),
+                conversation_id=message.get("conversation_id")
+            )
+        else:
+            result = get_chat_response(messages, conversation_id=message.get("conversation_id"))
+        stats["requests_served"] += 1
+        return {"id": request_id, "type": "chat", "result": result}
+
+    if msg_type in ("health", "ready"):
+        return {
+            "id": request_id,
+            "type": msg_type,
+            "status": "ok",
+            "ready": True,
+            "pid": os.getpid(),
+            "uptime_s": round(time.monotonic() - stats["started_at"], 3),
+            "requests_served": stats["requests_served"],
+            "context": context_manager.stats(),
+            "llm": client.stats()
+        }
+
+    return {"id": request_id, "type": "error", "error": f"Unknown message type: {msg_type}"}
+
+
+def serve_worker():
+    """
+    Long-lived chat mode: conversations arrive inline as JSON lines on stdin.
+    Streamed replies are sent as {"type": "delta"} lines followed by one
+    {"type": "chat"} line with the full result, all tagged with the request id.
+    """
+    # Keep stdout for the protocol only, stray prints go to stderr
+    out = sys.stdout
+    sys.stdout = sys.stderr
+    send_lock = threading.Lock()
+
+    def send(payload):
+        line = json.dumps(payload) + "\n"
+        with send_lock:
+            out.write(line)
+            out.flush()
+
+    def respond(message):
+        try:
+            send(handle_worker_message(message, send, stats))
+        except Exception as e:
+            send({
+                "id": message.get("id"),
+                "type": "error",
+                "error": str(e)
+            })
+
+    stats = {"started_at": time.monotonic(), "requests_served": 0}
+    executor = ThreadPoolExecutor(max_workers=CHAT_CONCURRENCY, thread_name_prefix="chat")
+
+    send({"type": "ready", "pid": os.getpid()})
+    print("Chat worker ready", file=sys.stderr)
+
+    for line in sys.stdin:
+        line = line.strip()
+        if not line:
+            continue
+
+        try:
+            message = json.loads(line)
+        except json.JSONDecodeError as e:
+            send({"type": "error", "error": f"Invalid JSON: {e}"})
+            continue
+
+        if message.get("type") == "shutdown":
+            break
+
+        if message.get("type", "chat") == "chat":
+            executor.submit(respond, message)
+        else:
+            respond(message)
+
+    executor.shutdown(wait=True)
+    print("Chat worker shutting down", file=sys.stderr)
+
+
 def main():
     try:
+        if len(sys.argv) >= 2 and sys.argv[1] == "--worker":
+            serve_worker()
+            sys.exit(0)
+
         if len(sys.argv) < 2:
             print(json.dumps({"error": "No file path provided"}))
             return
-        
-        # ✅ Read from FILE, not from command argument
+
+        # ✅ Read from FILE, not from command argument ("-" reads stdin)
         file_path = sys.argv[1]
-        
-        print(f"Reading from file: {file_path}", file=sys.stderr)
-        
-        if not os.path.exists(file_path):
-            print(json.dumps({"error": f"File not found: {file_path}"}))
-            return
-            
-        with open(file_path, 'r', encoding='utf-8') as f:
-            conversation_history = json.load(f)
-        
+
+        if file_path == "-":
+            conversation_history = json.load(sys.stdin)
+        else:
+            print(f"Reading from file: {file_path}", file=sys.stderr)
+
+            if not os.path.exists(file_path):
+                print(json.dumps({"error": f"File not found: {file_path}"}))
+                return
+
+            with open(file_path, 'r', encoding='utf-8') as f:
+                conversation_history = json.load(f)
+
         print(f"Loaded {len(conversation_history)} messages", file=sys.stderr)
-        
+
         # Get response
         result = get_chat_response(conversation_history)
         print(json.dumps(result))
-    
+
     except Exception as e:
         print(json.dumps({
             "error": "Chat failed",
             "details": str(e)
         }))
-    
+
     sys.stdout.flush()
     sys.exit(0)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
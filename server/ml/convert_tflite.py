@@ -0,0 +1,136 @@
+"""
+Offline conversion of coffee_disease_final.keras to TensorFlow Lite.
+
+Writes two flatbuffers next to the Keras model:
+- coffee_disease_final.float16.tflite: weights stored as float16
+- coffee_disease_final.int8.tflite: full integer quantization, calibrated
+  on images run through the same 128x128 preprocessing as predict_image
+
+The int8 model keeps float32 input and output tensors, so it is a drop-in
+replacement for ML_MODEL_BACKEND=tflite. Calibration images come from
+--calibration-dir, or the synthetic benchmark corpus when none is given.
+
+    python3 ml/convert_tflite.py --calibration-dir uploads/
+"""
+import os
+import sys
+import argparse
+import tempfile
+
+os.environ.setdefault("TF_CPP_MIN_LOG_LEVEL", "2")
+os.environ.setdefault("TF_ENABLE_ONEDNN_OPTS", "0")
+
+import tensorflow as tf # pyright: ignore[reportMissingModuleSource]
+
+from image_context import ImageContext
+
+ML_DIR = os.path.dirname(os.path.abspath(__file__))
+MODEL_PATH = os.path.join(ML_DIR, "coffee_disease_final.keras")
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".webp")
+
+
+def calibration_images(calibration_dir, limit):
+    """
+    Image paths used to calibrate the int8 activation ranges
+    """
+    if calibration_dir is None:
+        sys.path.insert(0, os.path.join(ML_DIR, "bench"))
+        import corpus
+        corpus_dir = os.path.join(tempfile.gettempdir(), "growfrika-bench-corpus")
+        # Small images are enough; the model only ever sees 128x128
+        entries = corpus.build_corpus(corpus_dir, per_kind=4, resolutions=["small"])
+        paths = [e["path"] for e in entries]
+    else:
+        paths = sorted(
+            os.path.join(root, name)
+            for root, _, files in os.walk(calibration_dir)
+            for name in files
+            if name.lower().endswith(IMAGE_EXTENSIONS)
+        )
+
+    if not paths:
+        raise ValueError(f"No calibration images found in {calibration_dir}")
+    return paths[:limit]
+
+
+def representative_dataset(paths, size):
+    def generate():
+        for path in paths:
+            yield [ImageContext.from_path(path).model_tensor(size)]
+    return generate
+
+
+def convert(model, configure):
+    """
+    Converts a loaded Keras model with the settings applied by configure.
+    Falls back to a SavedModel export for Keras versions whose models
+    from_keras_model can't trace directly.
+    """
+    try:
+        converter = tf.lite.TFLiteConverter.from_keras_model(model)
+        configure(converter)
+        return converter.convert()
+    except Exception as e:
+        print(f"from_keras_model failed ({e}), converting through a SavedModel", file=sys.stderr)
+
+    export_dir = tempfile.mkdtemp(prefix="growfrika-savedmodel-")
+    model.export(export_dir)
+    converter = tf.lite.TFLiteConverter.from_saved_model(export_dir)
+    configure(converter)
+    return converter.convert()
+
+
+def convert_float16(model):
+    def configure(converter):
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        converter.target_spec.supported_types = [tf.float16]
+    return convert(model, configure)
+
+
+def convert_int8(model, paths):
+    size = tuple(int(d) for d in model.input_shape[1:3])
+
+    def configure(converter):
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        converter.representative_dataset = representative_dataset(paths, size)
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+        # Keep float I/O so callers don't need to know about the quantization
+        converter.inference_input_type = tf.float32
+        converter.inference_output_type = tf.float32
+    return convert(model, configure)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert the Keras model to TFLite (float16 and int8)")
+    parser.add_argument("--model", default=MODEL_PATH)
+    parser.add_argument("--out-dir", default=ML_DIR)
+    parser.add_argument("--calibration-dir", default=None)
+    parser.add_argument("--calibration-images", type=int, default=200)
+    parser.add_argument("--only", choices=["float16", "int8"], default=None)
+    args = parser.parse_args()
+
+    if not os.path.exists(args.model):
+        raise FileNotFoundError(f"Model file not found: {args.model}")
+    model = tf.keras.models.load_model(args.model)
+
+    stem = os.path.splitext(os.path.basename(args.model))[0]
+    outputs = {}
+    if args.only in (None, "float16"):
+        outputs["float16"] = convert_float16(model)
+    if args.only in (None, "int8"):
+        paths = calibration_images(args.calibration_dir, args.calibration_images)
+        print(f"Calibrating int8 model on {len(paths)} images", file=sys.stderr)
+        outputs["int8"] = convert_int8(model, paths)
+
+    os.makedirs(args.out_dir, exist_ok=True)
+    print(f"{'variant':8s} {'size KiB':>9s}  path")
+    print(f"{'keras':8s} {os.path.getsize(args.model) / 1024:9.0f}  {args.model}")
+    for variant, flatbuffer in outputs.items():
+        path = os.path.join(args.out_dir, f"{stem}.{variant}.tflite")
+        with open(path, "wb") as f:
+            f.write(flatbuffer)
+        print(f"{variant:8s} {len(flatbuffer) / 1024:9.0f}  {path}")
+
+
+if __name__ == "__main__":
+    main()
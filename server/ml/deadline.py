@@ -0,0 +1,86 @@
+"""
+Per-request time budgets for the prediction pipeline.
+
+    with deadline.start(3000) as budget:
+        if budget.estimate_exceeds("validation", cost_ms):
+            budget.degrade("validation_proxy")
+            ...
+
+A request's budget is spread across its stages by STAGE_SHARES. A stage
+may use its share of whatever time is left, so when an earlier stage
+finishes quickly the later ones inherit the slack. When a stage would go
+over its allowance the pipeline switches to a cheaper version of it and
+records the degradation, which ends up in the result under "degradations".
+
+Outside start() current() returns None and nothing is degraded.
+"""
+import time
+import contextvars
+from contextlib import contextmanager
+
+import telemetry
+
+# Stages in pipeline order and their share of the budget
+STAGE_SHARES = {
+    "decode": 0.10,
+    "validation": 0.25,
+    "model": 0.15,
+    "llm": 0.50,
+}
+
+_current = contextvars.ContextVar("deadline", default=None)
+
+
+class Deadline:
+    def __init__(self, budget_ms, shares=STAGE_SHARES):
+        self.budget_ms = float(budget_ms)
+        self.shares = shares
+        self.started = time.perf_counter()
+        self.degradations = []
+
+    def elapsed_ms(self):
+        return (time.perf_counter() - self.started) * 1000
+
+    def remaining_ms(self):
+        return max(0.0, self.budget_ms - self.elapsed_ms())
+
+    def allowance_ms(self, stage):
+        """
+        Time the stage may use: its share of the remaining budget, relative
+        to the stages still to come
+        """
+        stages = list(self.shares)
+        later = sum(self.shares[s] for s in stages[stages.index(stage):])
+        return self.remaining_ms() * self.shares[stage] / later if later else self.remaining_ms()
+
+    def estimate_exceeds(self, stage, estimate_ms):
+        return estimate_ms > self.allowance_ms(stage)
+
+    def degrade(self, name):
+        if name not in self.degradations:
+            self.degradations.append(name)
+            telemetry.increment(f"degraded.{name}")
+
+
+def current():
+    """
+    Deadline of the request being served on this thread, or None
+    """
+    return _current.get()
+
+
+@contextmanager
+def start(budget_ms):
+    """
+    Runs the block under a budget of budget_ms; None or 0 means no deadline
+    and yields None
+    """
+    if not budget_ms or budget_ms <= 0:
+        yield None
+        return
+    budget = Deadline(budget_ms)
+    token = _current.set(budget)
+    try:
+        yield budget
+    finally:
+        _current.reset(token)
@@ -0,0 +1,79 @@
+"""
+Exports the Keras model as an inference-only SavedModel for fast cold starts.
+
+The .keras archive is rebuilt layer by layer on load (with its optimizer
+state) and traced again on the first predict. The export holds just the
+weights and one serving function traced for (None, H, W, 3) float32 input,
+so loading it skips Keras deserialisation and the first call skips tracing.
+
+    python3 ml/export_model.py
+    ML_MODEL_BACKEND=savedmodel python3 ml/predict.py leaf.jpg
+"""
+import os
+# Suppress TensorFlow messages BEFORE importing tensorflow
+os.environ['TF_CPP_MIN_LOG_LEVEL'] = '2'
+
+import sys
+import time
+import shutil
+import argparse
+
+import numpy as np
+
+ML_DIR = os.path.dirname(os.path.abspath(__file__))
+MODEL_PATH = os.path.join(ML_DIR, "coffee_disease_final.keras")
+EXPORT_PATH = os.path.join(ML_DIR, "coffee_disease_final.savedmodel")
+
+
+def export(model_path, export_path):
+    import keras # pyright: ignore[reportMissingImports]
+    import tensorflow as tf # pyright: ignore[reportMissingModuleSource]
+
+    model = keras.models.load_model(model_path, compile=False)
+    input_shape = (None,) + tuple(model.input_shape[1:])
+
+    archive = keras.export.ExportArchive()
+    archive.track(model)
+    archive.add_endpoint(
+        name="serve",
+        fn=lambda x: model(x, training=False),
+        input_signature=[tf.TensorSpec(shape=input_shape, dtype=tf.float32, name="image")],
+    )
+
+    # Write next to the target and swap, so a running worker never sees half an export
+    staging = export_path + ".tmp"
+    shutil.rmtree(staging, ignore_errors=True)
+    archive.write_out(staging, verbose=False)
+    shutil.rmtree(export_path, ignore_errors=True)
+    os.replace(staging, export_path)
+    return model, input_shape
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export the Keras model as an inference-only SavedModel")
+    parser.add_argument("--model", default=MODEL_PATH)
+    parser.add_argument("--out", default=EXPORT_PATH)
+    args = parser.parse_args()
+
+    if not os.path.exists(args.model):
+        raise FileNotFoundError(f"Model file not found: {args.model}")
+
+    model, input_shape = export(args.model, args.out)
+
+    # The export must agree with the model it came from
+    from backends import SavedModelBackend
+    sample = np.random.default_rng(0).random((4,) + input_shape[1:], dtype=np.float32)
+    start = time.perf_counter()
+    exported = SavedModelBackend(args.out)
+    load_ms = (time.perf_counter() - start) * 1000
+    drift = float(np.abs(exported.predict(sample) - model.predict(sample, verbose=0)).max())
+    if drift > 1e-4:
+        print(f"Exported model disagrees with {args.model} (max drift {drift:.2e})", file=sys.stderr)
+        sys.exit(1)
+
+    size = sum(os.path.getsize(os.path.join(root, f)) for root, _, files in os.walk(args.out) for f in files)
+    print(f"Exported {args.out} ({size / 1024:.0f} KiB, loads in {load_ms:.0f} ms, max drift {drift:.1e})")
+
+
+if __name__ == "__main__":
+    main()
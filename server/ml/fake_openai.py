@@ -0,0 +1,137 @@
+"""
+Local fake of the OpenAI chat completions endpoint, for development and
+testing without network access or an API key.
+
+Answers POST /v1/chat/completions, streamed (server-sent events) or not,
+with a canned reply that echoes the last user message. Latencies are
+configurable so streaming and timeouts can be exercised:
+
+    python3 ml/fake_openai.py --port 8089 --first-token-ms 300 --token-ms 20
+    OPENAI_BASE_URL=http://127.0.0.1:8089/v1 OPENAI_API_KEY=fake python3 ml/chat.py --worker
+"""
+import sys
+import json
+import time
+import uuid
+import argparse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+REPLY = (
+    "Thanks for your question about \"{question}\". This is a reply from the local "
+    "fake OpenAI server, streamed word by word so you can check the chat worker "
+    "end to end without calling the real API."
+)
+
+
+def reply_tokens(messages, max_tokens):
+    question = ""
+    for message in reversed(messages or []):
+        if message.get("role") == "user":
+            question = str(message.get("content", ""))[:60]
+            break
+    words = REPLY.format(question=question).split(" ")
+    tokens = [w if i == 0 else " " + w for i, w in enumerate(words)]
+    return tokens[:max_tokens or len(tokens)]
+
+
+class FakeOpenAIHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    first_token_ms = 200.0
+    token_ms = 15.0
+
+    def log_message(self, format, *args):
+        print(f"[fake-openai] {format % args}", file=sys.stderr)
+
+    def _json(self, status, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        try:
+            request = json.loads(self.rfile.read(length) or b"{}")
+        except ValueError:
+            self._json(400, {"error": {"message": "Invalid JSON body"}})
+            return
+
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self._json(404, {"error": {"message": f"Unknown endpoint: {self.path}"}})
+            return
+
+        model = request.get("model", "gpt-4o-mini")
+        tokens = reply_tokens(request.get("messages"), request.get("max_tokens"))
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:12]}"
+        created = int(time.time())
+        time.sleep(self.first_token_ms / 1000)
+
+        if not request.get("stream"):
+            time.sleep(self.token_ms * len(tokens) / 1000)
+            self._json(200, {
+                "id": completion_id,
+                "object": "chat.completion",
+                "created": created,
+                "model": model,
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": "".join(tokens)},
+                    "finish_reason": "stop"
+                }],
+                "usage": {"prompt_tokens": 0, "completion_tokens": len(tokens), "total_tokens": len(tokens)}
+            })
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        def event(delta, finish_reason=None):
+            chunk = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": model,
+                "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]
+            }
+            self._chunk(f"data: {json.dumps(chunk)}\n\n")
+
+        event({"role": "assistant", "content": ""})
+        for i, token in enumerate(tokens):
+            if i:
+                time.sleep(self.token_ms / 1000)
+            event({"content": token})
+        event({}, "stop")
+        self._chunk("data: [DONE]\n\n")
+        self.wfile.write(b"0\r\n\r\n")
+
+    def _chunk(self, text):
+        data = text.encode()
+        self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+        self.wfile.flush()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local fake OpenAI chat completions server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--first-token-ms", type=float, default=200.0)
+    parser.add_argument("--token-ms", type=float, default=15.0)
+    args = parser.parse_args()
+
+    FakeOpenAIHandler.first_token_ms = args.first_token_ms
+    FakeOpenAIHandler.token_ms = args.token_ms
+    server = ThreadingHTTPServer((args.host, args.port), FakeOpenAIHandler)
+    print(f"Fake OpenAI server on http://{args.host}:{args.port}/v1", file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
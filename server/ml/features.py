@@ -0,0 +1,140 @@
+"""
+Fused per-pixel statistics for the validation checks.
+
+The check_* helpers in model.py and validate_leaf_image in predict.py used
+to build their own masks, histograms and float64 derivative maps. Here the
+colour statistics come out of one pass over the image and the texture
+statistics out of a second one, both walking the image in row bands so no
+temporary is ever larger than a band. Results are cached on the
+ImageContext, so every check that needs them shares one extraction.
+"""
+import cv2
+import numpy as np
+
+# Rows per band; temporaries are at most this many rows of the image
+BAND_ROWS = 256
+
+# HSV histogram layout. Saturation and value use 10-wide bins so the 20 and
+# 30 thresholds of the green ranges fall exactly on bin edges.
+_HSV_BINS = [180, 26, 26]
+_HSV_RANGES = [0, 180, 0, 260, 0, 260]
+
+
+def _green_hsv_selector():
+    """
+    Boolean selector over the HSV histogram for the two green ranges of
+    check_green_content: H 30-90 with S, V >= 30, or H 20-40 with S, V >= 20
+    """
+    hue = np.arange(180)[:, None, None]
+    sat = (np.arange(26) * 10)[None, :, None]
+    val = (np.arange(26) * 10)[None, None, :]
+    healthy = (hue >= 30) & (hue <= 90) & (sat >= 30) & (val >= 30)
+    yellowish = (hue >= 20) & (hue <= 40) & (sat >= 20) & (val >= 20)
+    return healthy | yellowish
+
+
+_GREEN_HSV = _green_hsv_selector()
+
+
+def _channel_stats(hist, total):
+    """
+    Mean and population standard deviation of a channel from its histogram
+    """
+    levels = np.arange(256, dtype=np.float64)
+    mean = float(np.dot(hist, levels)) / total
+    var = float(np.dot(hist, (levels - mean) ** 2)) / total
+    return mean, float(np.sqrt(var))
+
+
+def extract_color_features(rgb):
+    """
+    One pass over an RGB uint8 image. Returns:
+    - hsv_green_share: share of pixels in the green HSV ranges
+    - dominant_green_share: share of pixels with G > R, G > B and G > 50
+    - hist: normalised 256-bin histogram per channel (R, G, B)
+    - mean / std: per-channel mean and population standard deviation
+    """
+    height, width = rgb.shape[:2]
+    total = height * width
+
+    hsv_hist = np.zeros(_HSV_BINS, np.float32)
+    channel_hists = [np.zeros(256, np.float64) for _ in range(3)]
+    dominant = 0
+
+    for y0 in range(0, height, BAND_ROWS):
+        band = np.ascontiguousarray(rgb[y0:y0 + BAND_ROWS])
+
+        # calcHist's accumulate flag doesn't survive the Python binding for
+        # 3-D histograms, so band histograms are summed here
+        hsv = cv2.cvtColor(band, cv2.COLOR_RGB2HSV)
+        hsv_hist += cv2.calcHist([hsv], [0, 1, 2], None, _HSV_BINS, _HSV_RANGES)
+        for c in range(3):
+            channel_hists[c] += cv2.calcHist([band], [c], None, [256], [0, 256]).ravel()
+
+        # G > max(R, B, 50) is the same as G > R and G > B and G > 50
+        ceiling = cv2.max(band[:, :, 0], band[:, :, 2])
+        cv2.max(ceiling, 50, dst=ceiling)
+        dominant += cv2.countNonZero(cv2.compare(band[:, :, 1], ceiling, cv2.CMP_GT))
+
+    stats = [_channel_stats(h, total) for h in channel_hists]
+
+    return {
+        "pixels": total,
+        "hsv_green_share": float(hsv_hist[_GREEN_HSV].sum()) / total,
+        "dominant_green_share": dominant / total,
+        "hist": [h / h.sum() for h in channel_hists],
+        "mean": [m for m, _ in stats],
+        "std": [s for _, s in stats],
+    }
+
+
+def extract_texture_features(gray):
+    """
+    Laplacian variance and mean Sobel gradient magnitude of a grayscale image.
+    Derivatives are computed in int16 per band, with a one-row halo so the
+    results match a whole-image computation exactly.
+    """
+    height = gray.shape[0]
+    total = gray.size
+
+    lap_sum = 0.0
+    lap_sq_sum = 0.0
+    grad_sum = 0.0
+
+    for y0 in range(0, height, BAND_ROWS):
+        y1 = min(height, y0 + BAND_ROWS)
+        top = max(0, y0 - 1)
+        bottom = min(height, y1 + 1)
+        band = gray[top:bottom]
+        rows = slice(y0 - top, y0 - top + (y1 - y0))
+
+        lap = cv2.Laplacian(band, cv2.CV_16S)[rows]
+        mean, std = cv2.meanStdDev(lap)
+        n = lap.size
+        lap_sum += float(mean[0, 0]) * n
+        lap_sq_sum += (float(std[0, 0]) ** 2 + float(mean[0, 0]) ** 2) * n
+
+        sobelx = cv2.Sobel(band, cv2.CV_16S, 1, 0, ksize=3)[rows]
+        sobely = cv2.Sobel(band, cv2.CV_16S, 0, 1, ksize=3)[rows]
+        magnitude = cv2.magnitude(sobelx.astype(np.float32), sobely.astype(np.float32))
+        grad_sum += float(cv2.sumElems(magnitude)[0])
+
+    lap_mean = lap_sum / total
+    return {
+        "laplacian_var": lap_sq_sum / total - lap_mean ** 2,
+        "gradient_magnitude": grad_sum / total,
+    }
+
+
+def color_features(img):
+    """
+    Colour statistics of an ImageContext, extracted once and cached
+    """
+    return img.cached("color_features", lambda: extract_color_features(img.rgb))
+
+
+def texture_features(img):
+    """
+    Texture statistics of an ImageContext, extracted once and cached
+    """
+    return img.cached("texture_features", lambda: extract_texture_features(img.gray))
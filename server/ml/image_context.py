@@ -0,0 +1,227 @@
+import os
+import threading
+
+import cv2
+import numpy as np
+from PIL import Image
+
+import telemetry
+from phash import phash_energy
+
+# Reduced views keep at least this many pixels on their short side. Scaled
+# by the long side alone, a long, narrow upload (900x100 at 512 is 512x57)
+# keeps too few rows for the shape and texture checks to agree with full
+# resolution
+MIN_VIEW_SHORT_SIDE = int(os.getenv("ML_VALIDATION_MIN_SHORT_SIDE", "256"))
+
+# What decoding a missing, truncated or malformed upload raises (PIL raises
+# SyntaxError for some broken headers)
+DECODE_ERRORS = (OSError, ValueError, SyntaxError, Image.DecompressionBombError)
+
+
+class ImageContext:
+    """
+    One uploaded image, decoded once.
+
+    Every stage of the pipeline (leaf validation, content checks and model
+    preprocessing) reads its pixels from here. Derived forms such as BGR,
+    HSV, grayscale and the model tensor are computed on first use and cached.
+    Decoding itself is lazy too, so a broken file fails in whichever stage
+    touches it first, just like when every stage opened the file itself.
+    """
+
+    def __init__(self, path=None, pil_image=None):
+        self.path = path
+        self._pil = pil_image
+        self._cache = {}
+        # Checks may run on several threads; each derived form is still
+        # computed once, under its own lock, so different forms are computed
+        # in parallel. _lock only guards _key_locks
+        self._lock = threading.Lock()
+        self._key_locks = {}
+        # Size of this view relative to the original upload (1.0 = full resolution)
+        self.scale = 1.0
+        self._full_size = None
+
+    @classmethod
+    def from_path(cls, path):
+        return cls(path=path)
+
+    @classmethod
+    def from_array(cls, rgb):
+        """
+        Wraps an already decoded RGB uint8 array
+        """
+        ctx = cls(pil_image=Image.fromarray(rgb))
+        ctx._cache["rgb"] = rgb
+        return ctx
+
+    @classmethod
+    def from_shared(cls, rgb, full_size, model_tensors, path=None):
+        """
+        Wraps pixels another process decoded (see shm_ring) without copying
+        them: rgb is a reduced proxy of an upload of full_size (width,
+        height), and model_tensors maps an input size to its ready
+        (1, H, W, 3) tensor
+        """
+        ctx = cls(path=path)
+        ctx._cache["rgb"] = rgb
+        for size, tensor in model_tensors.items():
+            ctx._cache[("model_tensor", tuple(size))] = tensor
+        ctx._full_size = tuple(full_size)
+        ctx.scale = min(1.0, rgb.shape[1] / full_size[0])
+        return ctx
+
+    def _key_lock(self, name):
+        with self._lock:
+            lock = self._key_locks.get(name)
+            if lock is None:
+                lock = self._key_locks[name] = threading.Lock()
+        return lock
+
+    def cached(self, name, compute):
+        """
+        Returns the value cached under name, computing it once on first use.
+        Threads asking for the same name wait for one compute; other names
+        don't wait on it
+        """
+        value = self._cache.get(name)
+        if value is None:
+            with self._key_lock(name):
+                value = self._cache.get(name)
+                if value is None:
+                    value = compute()
+                    self._cache[name] = value
+        return value
+
+    @property
+    def pil(self):
+        """
+        Decoded PIL image in RGB mode
+        """
+        if self._pil is None:
+            with self._key_lock("pil"):
+                if self._pil is None and "rgb" in self._cache:
+                    self._pil = Image.fromarray(self._cache["rgb"])
+                elif self._pil is None:
+                    if self.path is None or not os.path.exists(self.path):
+                        raise FileNotFoundError(f"Image file not found: {self.path}")
+                    with telemetry.stage("decode"), Image.open(self.path) as img:
+                        self._pil = img.convert("RGB")
+        return self._pil
+
+    @property
+    def decoded(self):
+        """
+        True once pixels are in memory, decoded here or handed over
+        """
+        return self._pil is not None or "rgb" in self._cache
+
+    @property
+    def full_size(self):
+        """
+        (width, height) of the original upload. Only reads the file header
+        when nothing has been decoded yet
+        """
+        if self._full_size is None:
+            if self._pil is not None:
+                self._full_size = self._pil.size
+            else:
+                if self.path is None or not os.path.exists(self.path):
+                    raise FileNotFoundError(f"Image file not found: {self.path}")
+                with Image.open(self.path) as img:
+                    self._full_size = img.size
+        return self._full_size
+
+    def validation_view(self, max_side):
+        """
+        Returns a context whose long side is at most max_side pixels, for the
+        heuristic checks, unless that would take the short side below
+        MIN_VIEW_SHORT_SIDE; elongated images are reduced less, or not at
+        all. If the full image hasn't been decoded yet, JPEGs are decoded
+        directly at 1/2, 1/4 or 1/8 scale (PIL draft mode) and the rest of the
+        reduction is an area-average resize. max_side of 0 or None returns
+        this context unchanged
+        """
+        if not max_side:
+            return self
+        return self.cached(("validation_view", max_side), lambda: self._make_view(max_side))
+
+    def _make_view(self, max_side):
+        width, height = self.full_size
+        scale = max(max_side / max(width, height), MIN_VIEW_SHORT_SIDE / min(width, height))
+        if scale >= 1:
+            return self
+
+        target = (max(1, round(width * scale)), max(1, round(height * scale)))
+        if self.scale < 1 and max(self.rgb.shape[:2]) <= max(target):
+            # Already a proxy no larger than asked for
+            return self
+
+        if self._pil is None and "rgb" not in self._cache:
+            with telemetry.stage("decode_reduced"), Image.open(self.path) as img:
+                # Only JPEG honours draft(); other formats decode at full size
+                img.draft("RGB", target)
+                small = img.convert("RGB")
+        else:
+            small = self.pil
+
+        if small.size != target:
+            small = small.resize(target, Image.BOX)
+
+        view = ImageContext(path=self.path, pil_image=small)
+        view.scale = scale
+        view._full_size = (width, height)
+        return view
+
+    @property
+    def rgb(self):
+        return self.cached("rgb", lambda: np.asarray(self.pil))
+
+    @property
+    def bgr(self):
+        return self.cached("bgr", lambda: cv2.cvtColor(self.rgb, cv2.COLOR_RGB2BGR))
+
+    @property
+    def hsv(self):
+        return self.cached("hsv", lambda: cv2.cvtColor(self.rgb, cv2.COLOR_RGB2HSV))
+
+    @property
+    def gray(self):
+        return self.cached("gray", lambda: cv2.cvtColor(self.rgb, cv2.COLOR_RGB2GRAY))
+
+    @property
+    def shape(self):
+        return self.rgb.shape
+
+    @property
+    def perceptual_hash(self):
+        """
+        64-bit pHash of the pixels and the energy it was taken from (see
+        phash.py)
+        """
+        return self.cached("phash", lambda: phash_energy(self.rgb))
+
+    def model_tensor(self, size):
+        """
+        (1, H, W, 3) float32 array scaled to [0, 1], resized the same way
+        keras image.load_img does (nearest neighbour)
+        """
+        def compute():
+            height, width = size
+            img = self.pil
+            if img.size != (width, height):
+                img = img.resize((width, height), Image.NEAREST)
+            arr = np.asarray(img, dtype=np.float32) / 255.0
+            return np.expand_dims(arr, axis=0)
+
+        return self.cached(("model_tensor", tuple(size)), compute)
+
+
+def as_image_context(img):
+    """
+    Accepts either a file path or an ImageContext
+    """
+    if isinstance(img, ImageContext):
+        return img
+    return ImageContext.from_path(img)
@@ -0,0 +1,238 @@
+"""
+Single-flight layer around the OpenAI client.
+
+    client = SingleFlightClient(OpenAI(max_retries=0))
+    client.chat.completions.create(model="gpt-4o-mini", messages=[...])
+
+In a burst, many predictions end up sending the very same prompt. Requests
+with the same normalised model, messages and parameters that are in flight
+at the same time share one upstream call, and every caller gets its result
+(or its error). On top of that:
+
+- at most ML_LLM_MAX_CONCURRENCY upstream calls run at once
+- connection errors, timeouts, 408/409/429 and 5xx responses are retried
+  up to ML_LLM_MAX_RETRIES times, sleeping a random time up to
+  ML_LLM_BACKOFF_S * 2^attempt (at most ML_LLM_BACKOFF_MAX_S), or the
+  server's Retry-After if that is longer
+- stats() counts requests, upstream calls, coalesced requests, retries
+  and failures
+
+Streams (chat replies) aren't coalesced: each goes upstream on its own,
+with the same retries and concurrency limit while connecting.
+AsyncSingleFlightClient does the same for AsyncOpenAI on an event loop.
+LazyClient(lambda: OpenAI(...)) builds the client on first use, so a
+process that never calls the API doesn't need a key.
+bench/single_flight.py exercises both against a local fake server.
+"""
+import os
+import json
+import time
+import random
+import asyncio
+import hashlib
+import threading
+from types import SimpleNamespace
+
+import openai
+
+MAX_CONCURRENCY = int(os.getenv("ML_LLM_MAX_CONCURRENCY", "8"))
+MAX_RETRIES = int(os.getenv("ML_LLM_MAX_RETRIES", "3"))
+BACKOFF_S = float(os.getenv("ML_LLM_BACKOFF_S", "0.5"))
+BACKOFF_MAX_S = float(os.getenv("ML_LLM_BACKOFF_MAX_S", "8"))
+
+RETRY_STATUSES = {408, 409, 429}
+
+
+def _normalize(value):
+    if isinstance(value, str):
+        return " ".join(value.split())
+    if isinstance(value, dict):
+        return {k: _normalize(v) for k, v in value.items() if v is not None}
+    if isinstance(value, (list, tuple)):
+        return [_normalize(v) for v in value]
+    return value
+
+
+def request_key(kwargs):
+    """
+    Identity of a create() call: model, messages and parameters with
+    whitespace collapsed and unset (None) parameters dropped
+    """
+    normalized = _normalize(kwargs)
+    normalized["model"] = str(normalized.get("model", "")).lower()
+    return hashlib.sha256(json.dumps(normalized, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def is_retryable(e):
+    if isinstance(e, (openai.APIConnectionError, ConnectionError, TimeoutError)):
+        return True
+    if isinstance(e, openai.APIStatusError):
+        return e.status_code in RETRY_STATUSES or e.status_code >= 500
+    return False
+
+
+def _retry_after_s(e):
+    response = getattr(e, "response", None)
+    try:
+        return float(response.headers.get("retry-after"))
+    except (AttributeError, TypeError, ValueError):
+        return 0.0
+
+
+class LazyClient:
+    """
+    Stands in for the client factory() returns, building it on first use.
+    Without an API key, only the calls fail, not the import
+    """
+
+    def __init__(self, factory):
+        self._factory = factory
+        self._client = None
+        self._lock = threading.Lock()
+
+    def __getattr__(self, name):
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    self._client = self._factory()
+        return getattr(self._client, name)
+
+
+class _SingleFlight:
+    def __init__(self, client, max_concurrency=None, max_retries=None, backoff_s=None, backoff_max_s=None):
+        self.client = client
+        self.max_concurrency = max(1, max_concurrency or MAX_CONCURRENCY)
+        self.max_retries = MAX_RETRIES if max_retries is None else max_retries
+        self.backoff_s = BACKOFF_S if backoff_s is None else backoff_s
+        self.backoff_max_s = BACKOFF_MAX_S if backoff_max_s is None else backoff_max_s
+        self._flights = {}
+        self._lock = threading.Lock()
+        self.counters = {
+            "requests": 0, "upstream_calls": 0, "coalesced": 0,
+            "retries": 0, "failures": 0, "streams": 0, "in_flight": 0
+        }
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    def _count(self, name, value=1):
+        with self._lock:
+            self.counters[name] += value
+
+    def _backoff_s(self, attempt, e):
+        jitter = random.uniform(0, min(self.backoff_max_s, self.backoff_s * 2 ** attempt))
+        return max(jitter, min(self.backoff_max_s, _retry_after_s(e)))
+
+    def _give_up(self, attempt, e):
+        if attempt >= self.max_retries or not is_retryable(e):
+            self._count("failures")
+            return True
+        self._count("retries")
+        return False
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.counters)
+        stats["coalesced_rate"] = round(stats["coalesced"] / stats["requests"], 4) if stats["requests"] else 0.0
+        stats["max_concurrency"] = self.max_concurrency
+        return stats
+
+
+class SingleFlightClient(_SingleFlight):
+    """
+    Wraps a blocking OpenAI client; create() may be called from any thread
+    """
+
+    def __init__(self, client, **kwargs):
+        super().__init__(client, **kwargs)
+        self._slots = threading.BoundedSemaphore(self.max_concurrency)
+
+    def _upstream(self, kwargs):
+        for attempt in range(self.max_retries + 1):
+            try:
+                with self._slots:
+                    self._count("upstream_calls")
+                    return self.client.chat.completions.create(**kwargs)
+            except Exception as e:
+                if self._give_up(attempt, e):
+                    raise
+                time.sleep(self._backoff_s(attempt, e))
+
+    def create(self, **kwargs):
+        self._count("requests")
+        if kwargs.get("stream"):
+            self._count("streams")
+            return self._upstream(kwargs)
+
+        key = request_key(kwargs)
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = SimpleNamespace(done=threading.Event(), result=None, error=None)
+                self.counters["in_flight"] += 1
+            else:
+                self.counters["coalesced"] += 1
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+
+        try:
+            flight.result = self._upstream(kwargs)
+            return flight.result
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+                self.counters["in_flight"] -= 1
+            flight.done.set()
+
+
+class AsyncSingleFlightClient(_SingleFlight):
+    """
+    Wraps an AsyncOpenAI client; create() is a coroutine. Use it from one
+    event loop
+    """
+
+    def __init__(self, client, **kwargs):
+        super().__init__(client, **kwargs)
+        self._slots = None
+
+    async def _upstream(self, kwargs):
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.max_concurrency)
+        for attempt in range(self.max_retries + 1):
+            try:
+                async with self._slots:
+                    self._count("upstream_calls")
+                    return await self.client.chat.completions.create(**kwargs)
+            except Exception as e:
+                if self._give_up(attempt, e):
+                    raise
+                await asyncio.sleep(self._backoff_s(attempt, e))
+
+    def _landed(self, key):
+        with self._lock:
+            del self._flights[key]
+            self.counters["in_flight"] -= 1
+
+    async def create(self, **kwargs):
+        self._count("requests")
+        if kwargs.get("stream"):
+            self._count("streams")
+            return await self._upstream(kwargs)
+
+        key = request_key(kwargs)
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is None:
+                flight = self._flights[key] = asyncio.ensure_future(self._upstream(kwargs))
+                flight.add_done_callback(lambda _: self._landed(key))
+                self.counters["in_flight"] += 1
+            else:
+                self.counters["coalesced"] += 1
+        # A caller that gives up (deadline) doesn't cancel the shared call
+        return await asyncio.shield(flight)
@@ -0,0 +1,73 @@
+"""
+Offline stand-in for the OpenAI client.
+
+Implements the one call the ML scripts make, chat.completions.create, and
+answers with canned text so the pipeline can run without network access or
+an API key (ML_LLM_STUB=1, or inject StubClient() directly in tests).
+delay_s makes every answer take that long, like a slow API.
+AsyncStubClient does the same for the AsyncOpenAI interface.
+"""
+import time
+import asyncio
+import itertools
+import threading
+from types import SimpleNamespace
+
+DEFAULT_REPLIES = [
+    "Thanks for sharing your photo. The diagnosis is shown above; "
+    "feel free to ask me any follow-up questions.",
+    "Here is what the system found. Let me know if you would like to know more.",
+]
+
+
+def _completion(content):
+    return SimpleNamespace(
+        choices=[SimpleNamespace(message=SimpleNamespace(role="assistant", content=content))]
+    )
+
+
+class _Completions:
+    def __init__(self, stub):
+        self._stub = stub
+
+    def create(self, model=None, messages=None, **kwargs):
+        content = self._stub._record(model, messages, kwargs)
+        if self._stub.delay_s > 0:
+            time.sleep(self._stub.delay_s)
+        return _completion(content)
+
+
+class _AsyncCompletions(_Completions):
+    async def create(self, model=None, messages=None, **kwargs):
+        content = self._stub._record(model, messages, kwargs)
+        if self._stub.delay_s > 0:
+            await asyncio.sleep(self._stub.delay_s)
+        return _completion(content)
+
+
+class StubClient:
+    """
+    Cycles through replies; every request is recorded in .calls
+    """
+
+    _completions = _Completions
+
+    def __init__(self, replies=None, delay_s=0.0):
+        self.delay_s = delay_s
+        self._replies = itertools.cycle(replies or DEFAULT_REPLIES)
+        self._lock = threading.Lock()
+        self.calls = []
+        self.chat = SimpleNamespace(completions=self._completions(self))
+
+    def _record(self, model, messages, kwargs):
+        with self._lock:
+            self.calls.append({"model": model, "messages": messages, **kwargs})
+            return next(self._replies)
+
+
+class AsyncStubClient(StubClient):
+    """
+    StubClient whose create() is a coroutine
+    """
+
+    _completions = _AsyncCompletions
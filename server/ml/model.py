@@ -1,129 +1,280 @@
 import os
 # Suppress TensorFlow messages BEFORE importing tensorflow
 os.environ['TF_CPP_MIN_LOG_LEVEL'] = '2'
-os.environ['TF_ENABLE_ONEDNN_OPTS'] = '0'
+
+# Thread counts, CPU affinity and oneDNN too (see runtime_config.py)
+import runtime_config
+runtime_config.apply()
 
 import sys
+import time
+_import_started = time.perf_counter()
 import traceback
 import cv2
 import numpy as np
 from PIL import Image
 
-try:
-    import tensorflow as tf
-    
-    # Try different import paths for different TensorFlow versions
-    try:
-        from tensorflow.keras.utils import image # pyright: ignore[reportMissingImports]
-        print("Using tensorflow.keras.utils.image", file=sys.stderr)
-    except ImportError:
-        try:
-            from tensorflow.keras.preprocessing import image # pyright: ignore[reportMissingImports]
-            print("Using tensorflow.keras.preprocessing.image", file=sys.stderr)
-        except ImportError:
-            from keras.utils import image_utils as image
-            print("Using keras.utils.image_utils", file=sys.stderr)
-    
-    print("TensorFlow imports successful", file=sys.stderr)
-except ImportError as e:
-    print(f"Missing required packages: {e}", file=sys.stderr)
-    print("Run: pip install tensorflow numpy Pillow opencv-python", file=sys.stderr)
-    sys.exit(1)
+from image_context import as_image_context
+import validation_pool
+import telemetry
+from features import color_features, texture_features
+from model_registry import ModelRegistry
 
 # ====== Load Model Once (Global) ======
-MODEL_PATH = os.path.join(os.path.dirname(__file__), "coffee_disease_final.keras")
+# Model versions: every artifact ships with a manifest (class names, input
+# size, preprocessing, thresholds) in ML_MODEL_REGISTRY, and ML_MODEL_VERSION
+# picks the one loaded at startup. A long-running worker can swap in another
+# version later and roll it back (see model_registry.py)
+MODEL_REGISTRY_DIR = os.getenv("ML_MODEL_REGISTRY", os.path.dirname(os.path.abspath(__file__)))
+MODEL_VERSION = os.getenv("ML_MODEL_VERSION", "v1")
+
+# Inference backend: "keras" runs the .keras archive, "savedmodel" the
+# inference-only export from export_model.py (fastest cold start with
+# TensorFlow), "tflite" a quantized flatbuffer produced by convert_tflite.py.
+# TensorFlow is only imported by the backend that needs it. Each version's
+# manifest names its artifact per backend; ML_SAVEDMODEL_PATH and
+# ML_TFLITE_MODEL replace it for the startup version.
+MODEL_BACKEND = os.getenv("ML_MODEL_BACKEND", "keras")
+SAVEDMODEL_PATH = os.getenv("ML_SAVEDMODEL_PATH")
+TFLITE_MODEL_PATH = os.getenv("ML_TFLITE_MODEL")
+TFLITE_THREADS = int(os.getenv("ML_TFLITE_THREADS", "0")) or runtime_config.applied["tf_intra_threads"] or None
+# Keras backend: call a tf.function traced once for every batch size instead
+# of model.predict() ("0" goes back to model.predict)
+KERAS_COMPILED = os.getenv("ML_KERAS_COMPILED", "1") != "0"
+
+# Batch sizes run through the model once at startup, so tracing and buffer
+# allocation aren't paid by the first requests ("" skips the warm-up)
+WARMUP_BATCH_SIZES = [int(b) for b in os.getenv("ML_WARMUP_BATCH_SIZES", "1").split(",") if b.strip()]
+
+if MODEL_BACKEND == "tflite":
+    _backend_options = {"num_threads": TFLITE_THREADS}
+elif MODEL_BACKEND == "keras":
+    _backend_options = {"compiled": KERAS_COMPILED}
+else:
+    _backend_options = {}
+
+_load_started = time.perf_counter()
+registry = ModelRegistry(MODEL_REGISTRY_DIR, MODEL_BACKEND, _backend_options, WARMUP_BATCH_SIZES)
+registry.activate(MODEL_VERSION, {"savedmodel": SAVEDMODEL_PATH, "tflite": TFLITE_MODEL_PATH}.get(MODEL_BACKEND))
+_startup_version = registry.active
+
+# The version loaded at startup. Code that may run in a long-running worker
+# uses the version it got from registry.use() instead, which can be newer
+model = _startup_version.backend
+CLASS_NAMES = _startup_version.class_names
+IMG_SIZE = _startup_version.input_size
+MODEL_FINGERPRINT = _startup_version.fingerprint
+
+# Cold start of this process, in ms. Loading includes importing the
+# backend's runtime (TensorFlow for keras and savedmodel)
+STARTUP_TIMINGS = {
+    "backend": MODEL_BACKEND,
+    "model_version": _startup_version.version,
+    "imports_ms": round((_load_started - _import_started) * 1000, 1),
+    "model_load_ms": _startup_version.timings["model_load_ms"],
+    "warmup_ms": _startup_version.timings["warmup_ms"],
+    "warmup_batch_sizes": WARMUP_BATCH_SIZES,
+    "runtime": dict(runtime_config.applied),
+}
+for _stage in ("imports", "model_load", "warmup"):
+    telemetry.record(f"startup.{_stage}", STARTUP_TIMINGS[f"{_stage}_ms"])
+print(f"Model {_startup_version.version} ready in {(time.perf_counter() - _import_started) * 1000:.0f}ms "
+      f"(imports {STARTUP_TIMINGS['imports_ms']:.0f}ms, load {STARTUP_TIMINGS['model_load_ms']:.0f}ms, "
+      f"warm-up {STARTUP_TIMINGS['warmup_ms']:.0f}ms)", file=sys.stderr)
 
-if not os.path.exists(MODEL_PATH):
-    raise FileNotFoundError(f"Model file not found: {MODEL_PATH}")
+# Run the heuristic checks on a proxy whose long side is at most this many
+# pixels (0 = full resolution). JPEGs are decoded directly at reduced scale.
+VALIDATION_MAX_SIDE = int(os.getenv("ML_VALIDATION_MAX_SIDE", "0"))
+
+# Multi-leaf mode: besides the whole frame, up to MULTI_LEAF_MAX_CROPS of the
+# best leaf contours (shape score of at least MULTI_LEAF_MIN_SCORE, i.e. two
+# of check_leaf_shapes' three criteria) are cropped from the upload and
+# classified in the same forward pass. Results then also carry "leaves",
+# one per crop with its box in upload pixels, and "aggregate". Candidates
+# are the leaf contours validation already found (check_leaf_shapes, on the
+# ML_VALIDATION_MAX_SIDE view) plus green regions segmented on a copy of at
+# most MULTI_LEAF_SIDE pixels.
+MULTI_LEAF = os.getenv("ML_MULTI_LEAF", "0") == "1"
+MULTI_LEAF_MAX_CROPS = int(os.getenv("ML_MULTI_LEAF_MAX_CROPS", "4"))
+MULTI_LEAF_MIN_SCORE = float(os.getenv("ML_MULTI_LEAF_MIN_SCORE", "0.65"))
+MULTI_LEAF_SIDE = int(os.getenv("ML_MULTI_LEAF_SIDE", "512"))
+
+# Texture statistics on a proxy are mapped back to full-resolution
+# equivalents as value * scale ** exponent. Calibrated with
+# bench/validation_report.py on the synthetic corpus; re-run it on field
+# photos before changing these.
+PROXY_LAPLACIAN_EXPONENT = 0.0
+PROXY_GRADIENT_EXPONENT = 0.35
+
+# Threads for running independent validation checks side by side
+# ("0" = serially, a number, or "auto" to share the cores with TensorFlow)
+VALIDATION_THREADS = runtime_config.setting("ML_VALIDATION_THREADS", "0")
+if MODEL_BACKEND == "tflite":
+    _inference_threads = TFLITE_THREADS or 0
+else:
+    _inference_threads = sys.modules["tensorflow"].config.threading.get_intra_op_parallelism_threads()
+validation_pool.configure_pool(validation_pool.resolve_pool_size(VALIDATION_THREADS, _inference_threads))
+
+def weighted_validation_score(checks):
+    """
+    Combines the individual check scores into the total validation score
+    """
+    # Calculate weighted score with STRICTER weights for green content
+    return (
+        checks["green_content"] * 0.35 +  # Increased from 0.35
+        checks["leaf_shape"] * 0.25 +
+        checks["texture"] * 0.20 +  # Reduced from 0.20
+        checks["color_distribution"] * 0.15 +  # Reduced from 0.15
+        checks["size_quality"] * 0.05
+    )
+
+def validation_outcome(checks, total_score):
+    """
+    Accept/reject decision for a set of check scores and their total
+    """
+    # STRICTER threshold - require higher score to pass
+    if total_score < 0.25:  # Changed from 0.25
+        if checks["green_content"] < 0.15:  # Changed from 0.15
+            return {
+                "is_valid": False,
+                "reason": "No plant material detected - image appears to be a non-plant object",
+                "suggestion": "Please upload a photo of a coffee plant leaf",
+                "validation_score": total_score
+            }
+        elif checks["leaf_shape"] < 0.2:  # Changed from 0.2
+            return {
+                "is_valid": False,
+                "reason": "No leaf-like structure detected in the image",
+                "suggestion": "Please upload a clear photo focusing on a single coffee leaf",
+                "validation_score": total_score
+            }
+        else:
+            return {
+                "is_valid": False,
+                "reason": "Image content not suitable for coffee leaf analysis",
+                "suggestion": "Please upload a clear, well-lit photo of a coffee leaf against a simple background",
+                "validation_score": total_score
+            }
+    
+    # Additional check: Even if total score passes, green content MUST be reasonable
+    if checks["green_content"] < 0.2:  # NEW CHECK
+        return {
+            "is_valid": False,
+            "reason": "Insufficient plant material detected in the image",
+            "suggestion": "Please ensure the image clearly shows a coffee leaf with visible green color",
+            "validation_score": total_score
+        }
+    
+    return {
+        "is_valid": True,
+        "confidence": total_score,
+        "reason": "Image appears to contain a coffee leaf",
+        "validation_score": total_score
+    }
 
-try:
-    model = tf.keras.models.load_model(MODEL_PATH)
-    print("Model loaded successfully", file=sys.stderr)
-except Exception as e:
-    raise RuntimeError(f"Failed to load model from {MODEL_PATH}: {e}")
+def _timed_check(check, img):
+    start = time.perf_counter()
+    score = check(img)
+    return score, round((time.perf_counter() - start) * 1000, 3)
 
-# Define your class labels
-CLASS_NAMES = ["miner", "nodisease", "phoma", "rust"]
-IMG_SIZE = (128, 128)
+def _validation_waves():
+    """
+    Groups VALIDATION_STAGES into the units the cascade runs at once: one
+    check at a time serially, whole waves when a thread pool is available
+    """
+    if validation_pool.get_pool() is None:
+        return [[(name, check)] for name, check, _, _ in VALIDATION_STAGES]
+    
+    waves = {}
+    for name, check, _, wave in VALIDATION_STAGES:
+        waves.setdefault(wave, []).append((name, check))
+    return [waves[w] for w in sorted(waves)]
 
-def validate_image_content(img_path):
+def _early_validation_outcome(checks):
     """
-    Multi-layered validation to detect if image is a coffee leaf
+    Returns a rejection for a partial set of checks once no score of the
+    checks that haven't run yet could turn it into an acceptance, else None.
+    Acceptances always run every check because they report the exact score.
+    
+    Every branch of validation_outcome is a threshold on a single score, so
+    the outcome at both ends of the remaining range bounds every outcome in
+    between. The reason reported is the one for the lowest remaining scores;
+    reason_is_exact says whether the highest give the same one, i.e. whether
+    a full run would too. The returned validation_score is a lower bound of
+    the full score (validation_score_is_lower_bound), not the score itself
     """
+    low = {name: score_range[0] for name, _, score_range, _ in VALIDATION_STAGES}
+    high = {name: score_range[1] for name, _, score_range, _ in VALIDATION_STAGES}
+    low.update(checks)
+    high.update(checks)
+    
+    worst = validation_outcome(low, weighted_validation_score(low))
+    best = validation_outcome(high, weighted_validation_score(high))
+    
+    if best["is_valid"]:
+        return None
+    
+    worst["validation_score_is_lower_bound"] = True
+    worst["reason_is_exact"] = worst["reason"] == best["reason"]
+    return worst
+
+def validate_image_content(img, max_side=None):
+    """
+    Multi-layered validation to detect if image is a coffee leaf.
+    Accepts a file path or an ImageContext. The checks run on a proxy with a
+    long side of at most max_side pixels (defaults to VALIDATION_MAX_SIDE;
+    see ImageContext.validation_view for elongated images)
+    """
+    if max_side is None:
+        max_side = VALIDATION_MAX_SIDE
+
     try:
         # Load image
-        img = cv2.imread(img_path)
-        if img is None:
+        try:
+            img = as_image_context(img).validation_view(max_side)
+            img.rgb
+        except Exception:
             return {
                 "is_valid": False,
                 "reason": "Could not load image file",
                 "suggestion": "Please upload a valid image file (JPG, PNG, etc.)"
             }
         
-        # Convert to RGB
-        img_rgb = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+        # Run the checks cheapest first and stop as soon as the remaining
+        # ones can no longer change the outcome. With a validation thread
+        # pool, the checks of one wave run side by side
+        checks = {}
+        stages = []
+        outcome = None
         
-        # Run all validation checks
-        checks = {
-            "green_content": check_green_content(img_rgb),
-            "leaf_shape": check_leaf_shapes(img),
-            "texture": check_texture_features(img),
-            "color_distribution": check_color_distribution(img_rgb),
-            "size_quality": check_image_dimensions(img)
-        }
+        for wave in _validation_waves():
+            if outcome is not None:
+                stages.extend({"name": name, "ran": False} for name, _ in wave)
+                continue
+            
+            results = validation_pool.run_all([
+                (lambda check=check: _timed_check(check, img)) for _, check in wave
+            ])
+            for (name, _), (score, ms) in zip(wave, results):
+                checks[name] = score
+                stages.append({"name": name, "ran": True, "score": score, "ms": ms})
+                telemetry.record(f"check.{name}", ms)
+            
+            if len(checks) < len(VALIDATION_STAGES):
+                outcome = _early_validation_outcome(checks)
         
         print(f"Validation scores: {checks}", file=sys.stderr)
         
-        # Calculate weighted score with STRICTER weights for green content
-        total_score = (
-            checks["green_content"] * 0.35 +  # Increased from 0.35
-            checks["leaf_shape"] * 0.25 +
-            checks["texture"] * 0.20 +  # Reduced from 0.20
-            checks["color_distribution"] * 0.15 +  # Reduced from 0.15
-            checks["size_quality"] * 0.05
-        )
-        
-        print(f"Total validation score: {total_score:.3f}", file=sys.stderr)
-        
-        # STRICTER threshold - require higher score to pass
-        if total_score < 0.25:  # Changed from 0.25
-            if checks["green_content"] < 0.15:  # Changed from 0.15
-                return {
-                    "is_valid": False,
-                    "reason": "No plant material detected - image appears to be a non-plant object",
-                    "suggestion": "Please upload a photo of a coffee plant leaf",
-                    "validation_score": total_score
-                }
-            elif checks["leaf_shape"] < 0.2:  # Changed from 0.2
-                return {
-                    "is_valid": False,
-                    "reason": "No leaf-like structure detected in the image",
-                    "suggestion": "Please upload a clear photo focusing on a single coffee leaf",
-                    "validation_score": total_score
-                }
-            else:
-                return {
-                    "is_valid": False,
-                    "reason": "Image content not suitable for coffee leaf analysis",
-                    "suggestion": "Please upload a clear, well-lit photo of a coffee leaf against a simple background",
-                    "validation_score": total_score
-                }
-        
-        # Additional check: Even if total score passes, green content MUST be reasonable
-        if checks["green_content"] < 0.2:  # NEW CHECK
-            return {
-                "is_valid": False,
-                "reason": "Insufficient plant material detected in the image",
-                "suggestion": "Please ensure the image clearly shows a coffee leaf with visible green color",
-                "validation_score": total_score
-            }
+        if outcome is None:
+            total_score = weighted_validation_score(checks)
+            print(f"Total validation score: {total_score:.3f}", file=sys.stderr)
+            outcome = validation_outcome(checks, total_score)
+        else:
+            skipped = [stage["name"] for stage in stages if not stage["ran"]]
+            print(f"Validation decided early, skipped: {skipped}", file=sys.stderr)
         
-        return {
-            "is_valid": True,
-            "confidence": total_score,
-            "reason": "Image appears to contain a coffee leaf",
-            "validation_score": total_score
-        }
+        outcome["stages"] = stages
+        return outcome
         
     except Exception as e:
         print(f"Error in image validation: {e}", file=sys.stderr)
@@ -136,32 +287,14 @@ def validate_image_content(img_path):
             "validation_score": 0.0
         }
     
-def check_green_content(img_rgb):
+def check_green_content(img):
     """
     Enhanced green content detection for plant material - STRICTER VERSION
     """
     try:
-        # Convert to HSV for better color analysis
-        img_hsv = cv2.cvtColor(img_rgb, cv2.COLOR_RGB2HSV)
-        
-        # Multiple green ranges to catch different shades
-        # Healthy green leaves
-        lower_green1 = np.array([30, 30, 30])
-        upper_green1 = np.array([90, 255, 255])
-        
-        # Yellowish green (diseased leaves)
-        lower_green2 = np.array([20, 20, 20])
-        upper_green2 = np.array([40, 255, 255])
-        
-        # Create masks
-        mask1 = cv2.inRange(img_hsv, lower_green1, upper_green1)
-        mask2 = cv2.inRange(img_hsv, lower_green2, upper_green2)
-        green_mask = cv2.bitwise_or(mask1, mask2)
-        
-        # Calculate green percentage
-        green_pixels = np.sum(green_mask > 0)
-        total_pixels = img_rgb.shape[0] * img_rgb.shape[1]
-        green_percentage = green_pixels / total_pixels
+        # Share of pixels in the healthy (H 30-90) or yellowish (H 20-40,
+        # diseased leaves) green HSV ranges
+        green_percentage = color_features(img)["hsv_green_share"]
         
         print(f"Green content: {green_percentage:.2%}", file=sys.stderr)
         
@@ -182,64 +315,118 @@ def check_green_content(img_rgb):
         return 0.0  # Changed from 0.5 - fail on error
 
 
-def check_leaf_shapes(img):
+def leaf_edges(img):
     """
-    Detect leaf-like shapes using contour analysis
+    Canny edge map of the image, computed once per ImageContext
     """
-    try:
-        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    def compute():
+        # Apply bilateral filter to reduce noise while keeping edges.
+        # The neighbourhood is in pixels, so it shrinks with a reduced-size proxy
+        diameter, sigma_space = 9, 75
+        if img.scale < 1:
+            diameter = max(5, round(diameter * img.scale))
+            sigma_space = sigma_space * img.scale
+        filtered = cv2.bilateralFilter(img.gray, diameter, 75, sigma_space)
+        return cv2.Canny(filtered, 30, 100)
+    
+    return img.cached("leaf_edges", compute)
+
+def leaf_candidates(img):
+    """
+    The largest contours of the edge map that could be leaves, each with its
+    bounding box (x, y, w, h in this context's pixels) and shape score.
+    Computed once per ImageContext, so multi-leaf crops reuse what
+    check_leaf_shapes found. None when the edge map has no contours at all
+    """
+    return img.cached("leaf_candidates", lambda: _find_leaf_candidates(img, leaf_edges(img)))
+
+def leaf_regions(img):
+    """
+    Green regions that could be leaves, like leaf_candidates (boxes in this
+    context's pixels). Separated leaves are found even when Canny left
+    their outlines open; touching leaves come out as one region. Segmented
+    on a copy of at most MULTI_LEAF_SIDE pixels. Used for multi-leaf crops
+    only
+    """
+    def compute():
+        small = img.validation_view(MULTI_LEAF_SIDE)
+        hsv = small.hsv
+        # check_green_content's healthy green (H 30-90); its yellowish range
+        # also takes in brown soil
+        mask = cv2.inRange(hsv, (30, 30, 30), (90, 255, 255))
+        # Drop speckle, then bridge lesions and veins (about 1% of the long side)
+        size = max(3, round(max(mask.shape) * 0.01)) | 1
+        kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (size, size))
+        mask = cv2.morphologyEx(cv2.morphologyEx(mask, cv2.MORPH_OPEN, kernel), cv2.MORPH_CLOSE, kernel)
+        
+        to_img = img.rgb.shape[1] / small.rgb.shape[1]
+        return [
+            dict(region, box=tuple(round(v * to_img) for v in region["box"]), area=region["area"] * to_img ** 2)
+            for region in _find_leaf_candidates(small, mask) or []
+        ]
+    
+    return img.cached("leaf_regions", compute)
+
+def _find_leaf_candidates(img, edges):
+    # Find contours
+    contours, _ = cv2.findContours(edges, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    
+    if not contours:
+        return None
+    
+    # Analyze largest contours
+    contours = sorted(contours, key=cv2.contourArea, reverse=True)[:10]
+    
+    image_area = img.shape[0] * img.shape[1]
+    candidates = []
+    
+    for contour in contours:
+        area = cv2.contourArea(contour)
         
-        # Apply bilateral filter to reduce noise while keeping edges
-        filtered = cv2.bilateralFilter(gray, 9, 75, 75)
+        # Skip too small or too large contours
+        if area < (image_area * 0.02) or area > (image_area * 0.95):
+            continue
         
-        # Edge detection
-        edges = cv2.Canny(filtered, 30, 100)
+        # Get bounding rectangle
+        x, y, w, h = cv2.boundingRect(contour)
+        aspect_ratio = float(w) / h if h > 0 else 0
         
-        # Find contours
-        contours, _ = cv2.findContours(edges, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        # Calculate circularity and solidity
+        perimeter = cv2.arcLength(contour, True)
+        circularity = 4 * np.pi * area / (perimeter * perimeter) if perimeter > 0 else 0
         
-        if not contours:
-            return 0.1
+        hull = cv2.convexHull(contour)
+        hull_area = cv2.contourArea(hull)
+        solidity = float(area) / hull_area if hull_area > 0 else 0
         
-        # Analyze largest contours
-        contours = sorted(contours, key=cv2.contourArea, reverse=True)[:10]
+        # Leaf characteristics:
+        # - Aspect ratio: 0.4 to 2.5 (leaves are somewhat elongated)
+        # - Circularity: 0.3 to 0.8 (not perfect circle, not too irregular)
+        # - Solidity: 0.6 to 0.95 (some concavity but not too much)
+        score = 0.0
         
-        image_area = img.shape[0] * img.shape[1]
-        best_score = 0.0
+        if 0.4 <= aspect_ratio <= 2.5:
+            score += 0.35
+        if 0.3 <= circularity <= 0.8:
+            score += 0.35
+        if 0.6 <= solidity <= 0.95:
+            score += 0.3
         
-        for contour in contours:
-            area = cv2.contourArea(contour)
-            
-            # Skip too small or too large contours
-            if area < (image_area * 0.02) or area > (image_area * 0.95):
-                continue
-            
-            # Get bounding rectangle
-            x, y, w, h = cv2.boundingRect(contour)
-            aspect_ratio = float(w) / h if h > 0 else 0
-            
-            # Calculate circularity and solidity
-            perimeter = cv2.arcLength(contour, True)
-            circularity = 4 * np.pi * area / (perimeter * perimeter) if perimeter > 0 else 0
-            
-            hull = cv2.convexHull(contour)
-            hull_area = cv2.contourArea(hull)
-            solidity = float(area) / hull_area if hull_area > 0 else 0
-            
-            # Leaf characteristics:
-            # - Aspect ratio: 0.4 to 2.5 (leaves are somewhat elongated)
-            # - Circularity: 0.3 to 0.8 (not perfect circle, not too irregular)
-            # - Solidity: 0.6 to 0.95 (some concavity but not too much)
-            score = 0.0
-            
-            if 0.4 <= aspect_ratio <= 2.5:
-                score += 0.35
-            if 0.3 <= circularity <= 0.8:
-                score += 0.35
-            if 0.6 <= solidity <= 0.95:
-                score += 0.3
-            
-            best_score = max(best_score, score)
+        candidates.append({"box": (x, y, w, h), "area": float(area), "score": score})
+    
+    return candidates
+
+def check_leaf_shapes(img):
+    """
+    Detect leaf-like shapes using contour analysis
+    """
+    try:
+        candidates = leaf_candidates(img)
+        
+        if candidates is None:
+            return 0.1
+        
+        best_score = max((c["score"] for c in candidates), default=0.0)
         
         print(f"Leaf shape score: {best_score:.2f}", file=sys.stderr)
         return best_score
@@ -253,15 +440,16 @@ def check_texture_features(img):
     Analyze texture to distinguish leaves from other objects
     """
     try:
-        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+        features = texture_features(img)
         
-        # Calculate variance (texture complexity)
-        laplacian_var = cv2.Laplacian(gray, cv2.CV_64F).var()
+        # Laplacian variance (texture complexity) and gradient magnitude (edge strength)
+        laplacian_var = features["laplacian_var"]
+        gradient_magnitude = features["gradient_magnitude"]
         
-        # Calculate gradient magnitude (edge strength)
-        sobelx = cv2.Sobel(gray, cv2.CV_64F, 1, 0, ksize=3)
-        sobely = cv2.Sobel(gray, cv2.CV_64F, 0, 1, ksize=3)
-        gradient_magnitude = np.sqrt(sobelx**2 + sobely**2).mean()
+        # Map proxy statistics back to full-resolution equivalents
+        if img.scale < 1:
+            laplacian_var *= img.scale ** PROXY_LAPLACIAN_EXPONENT
+            gradient_magnitude *= img.scale ** PROXY_GRADIENT_EXPONENT
         
         # Leaves typically have moderate texture (not too smooth, not too busy)
         texture_score = 0.0
@@ -289,26 +477,21 @@ def check_texture_features(img):
         print(f"Error in texture check: {e}", file=sys.stderr)
         return 0.5
 
-def check_color_distribution(img_rgb):
+def check_color_distribution(img):
     """
     Check if color distribution matches leaf patterns
     """
     try:
-        # Calculate color histogram
-        hist_r = cv2.calcHist([img_rgb], [0], None, [256], [0, 256])
-        hist_g = cv2.calcHist([img_rgb], [1], None, [256], [0, 256])
-        hist_b = cv2.calcHist([img_rgb], [2], None, [256], [0, 256])
+        features = color_features(img)
         
-        # Normalize
-        hist_r = hist_r.flatten() / hist_r.sum()
-        hist_g = hist_g.flatten() / hist_g.sum()
-        hist_b = hist_b.flatten() / hist_b.sum()
+        # Normalized color histograms
+        hist_r, hist_g, hist_b = features["hist"]
         
         # Check if green channel is dominant
         green_dominance = np.sum(hist_g[50:150]) / np.sum(hist_r[50:150] + hist_b[50:150] + 0.001)
         
         # Calculate color variance (diverse colors suggest leaf with spots/disease)
-        color_std = np.std([np.std(img_rgb[:,:,0]), np.std(img_rgb[:,:,1]), np.std(img_rgb[:,:,2])])
+        color_std = np.std(features["std"])
         
         score = 0.0
         
@@ -340,7 +523,8 @@ def check_image_dimensions(img):
     Check if image dimensions and quality are reasonable
     """
     try:
-        height, width = img.shape[:2]
+        # Judge the original upload, not a reduced-size proxy
+        width, height = img.full_size
         
         # Check minimum size
         if height < 64 or width < 64:
@@ -359,30 +543,226 @@ def check_image_dimensions(img):
         print(f"Error in dimension check: {e}", file=sys.stderr)
         return 0.5
 
-def preprocess_image(img_path):
+# Validation cascade, cheapest check first:
+# (name, check, (lowest, highest) score the check can return, wave)
+# Checks in the same wave run side by side when a validation pool is configured.
+# Uploads with less than 20% green are rejected after the first wave (or the
+# green check, serially); the rest of the cascade only picks the reason
+VALIDATION_STAGES = [
+    ("size_quality", check_image_dimensions, (0.0, 1.0), 0),
+    ("green_content", check_green_content, (0.0, 1.0), 0),
+    ("color_distribution", check_color_distribution, (0.2, 1.0), 1),
+    ("texture", check_texture_features, (0.2, 1.0), 1),
+    ("leaf_shape", check_leaf_shapes, (0.0, 1.0), 1),
+]
+
+def preprocess_image(img, size=None):
     """
-    Loads and preprocesses image for prediction
+    Preprocesses an image (file path or ImageContext) for prediction, to
+    size (the active model's input size by default)
     """
+    img = as_image_context(img)
     try:
-        if not os.path.exists(img_path):
-            raise FileNotFoundError(f"Image file not found: {img_path}")
-        
-        img = image.load_img(img_path, target_size=IMG_SIZE)
-        img_array = image.img_to_array(img) / 255.0
-        img_array = np.expand_dims(img_array, axis=0)
-        return img_array
+        return img.model_tensor(size or registry.active.input_size)
     except Exception as e:
-        raise RuntimeError(f"Failed to preprocess image {img_path}: {e}")
+        raise RuntimeError(f"Failed to preprocess image {img.path}: {e}")
+
+def _overlap(a, b):
+    """
+    Intersection of two (x, y, w, h) boxes over the smaller one's area
+    """
+    width = min(a[0] + a[2], b[0] + b[2]) - max(a[0], b[0])
+    height = min(a[1] + a[3], b[1] + b[3]) - max(a[1], b[1])
+    if width <= 0 or height <= 0:
+        return 0.0
+    return width * height / min(a[2] * a[3], b[2] * b[3])
 
-def predict_image(img_path, confidence_threshold=0.50):  # Increased from 0.45
+def select_leaf_boxes(candidates, max_crops=MULTI_LEAF_MAX_CROPS, min_score=MULTI_LEAF_MIN_SCORE, max_overlap=0.6):
     """
-    Predicts disease from a coffee leaf image with comprehensive validation
+    Best-scoring leaf candidates first (larger ones on ties), skipping any
+    that mostly overlap one already chosen
     """
+    chosen = []
+    for candidate in sorted(candidates or [], key=lambda c: (c["score"], c["area"]), reverse=True):
+        # Scores are sums of 0.35s and 0.3s: compare with some slack
+        if len(chosen) >= max_crops or candidate["score"] < min_score - 1e-9:
+            break
+        if any(_overlap(candidate["box"], c["box"]) > max_overlap for c in chosen):
+            continue
+        chosen.append(candidate)
+    return chosen
+
+def leaf_crops(img, view, candidates, size=None, pad=0.08):
+    """
+    Model input for leaf candidates found on view (a validation proxy of
+    img): an (N, H, W, 3) array cut from img's own pixels at size (the
+    active model's input size by default), and each box in upload pixels
+    """
+    source = img.pil
+    to_source = img.scale / view.scale
+    height, width = size or registry.active.input_size
+    crops, boxes = [], []
+    for candidate in candidates:
+        x, y, w, h = candidate["box"]
+        pad_x, pad_y = w * pad, h * pad
+        left = max(0, round((x - pad_x) * to_source))
+        top = max(0, round((y - pad_y) * to_source))
+        right = min(source.width, round((x + w + pad_x) * to_source))
+        bottom = min(source.height, round((y + h + pad_y) * to_source))
+        # Same nearest-neighbour resize as the whole frame (ImageContext.model_tensor)
+        crop = source.crop((left, top, right, bottom)).resize((width, height), Image.NEAREST)
+        crops.append(np.asarray(crop, dtype=np.float32) / 255.0)
+        boxes.append([round(v / view.scale) for v in (x, y, w, h)])
+    return np.stack(crops), boxes
+
+def aggregate_leaves(leaves, confidence_threshold=0.50):
+    """
+    One verdict for all leaves: the disease found on most confidently
+    classified leaves (highest confidence breaks ties), "nodisease" when
+    they are all healthy, None when no leaf was classified confidently
+    """
+    reliable = [leaf for leaf in leaves if leaf["confidence"] >= confidence_threshold]
+    diseased = [leaf for leaf in reliable if leaf["predicted_class"] != "nodisease"]
+    classes = {}
+    for leaf in reliable:
+        classes[leaf["predicted_class"]] = classes.get(leaf["predicted_class"], 0) + 1
+    
+    verdict = None
+    if diseased:
+        verdict = max(diseased, key=lambda leaf: (classes[leaf["predicted_class"]], leaf["confidence"]))["predicted_class"]
+    elif reliable:
+        verdict = "nodisease"
+    
+    return {
+        "verdict": verdict,
+        "leaves": len(leaves),
+        "reliable_leaves": len(reliable),
+        "diseased_leaves": len(diseased),
+        "classes": classes
+    }
+
+def enable_batching(max_batch_size=8, max_wait_ms=5.0):
+    """
+    Routes single-image predictions through a MicroBatcher so that
+    concurrent requests share one forward pass. Every model version gets
+    its own, including versions swapped in later
+    """
+    if registry.active.batcher is None:
+        registry.enable_batching(max_batch_size, max_wait_ms)
+        print(f"Micro-batching enabled (max batch {max_batch_size}, max wait {max_wait_ms}ms)", file=sys.stderr)
+    return registry.active.batcher
+
+def run_model(img_array, version=None):
+    """
+    Runs the model (version, or the active one) on a preprocessed
+    (N, H, W, 3) array and returns one row of class probabilities per image
+    """
+    return (version or registry.active).predict(img_array)
+
+def interpret_prediction(pred, validation_result, confidence_threshold=None, version=None):
+    """
+    Turns one row of class probabilities into the prediction result dict,
+    with the labels and thresholds of version (the active one by default)
+    """
+    version = version or registry.active
+    class_names = version.class_names
+    if confidence_threshold is None:
+        confidence_threshold = version.thresholds["confidence"]
+    class_idx = np.argmax(pred)
+    confidence = float(pred[class_idx])
+    
+    # Calculate prediction entropy (lower = more confident)
+    entropy = -np.sum(pred * np.log(pred + 1e-10))
+    
+    print(f"Prediction: {class_names[class_idx]} ({confidence:.2%}), Entropy: {entropy:.3f}", file=sys.stderr)
+    
+    # Cross-validate with image quality
+    validation_score = validation_result.get("confidence", 1.0)
+    
+    # STRICTER check: If validation score is low, reject even with high model confidence
+    if validation_score < 0.3:  # Changed from 0.4
+        return {
+            "status": "invalid_image",
+            "predicted_class": "Not a Coffee Leaf",
+            "confidence": confidence,
+            "validation_score": validation_score,
+            "error": "Image does not appear to be a coffee leaf",
+            "suggestion": "Please upload a clear photo of a single coffee leaf with good lighting",
+            "advice": "The uploaded image doesn't meet the criteria for a coffee leaf. Please upload a clear photo of a coffee plant leaf.",
+            "all_probabilities": {
+                class_names[i]: float(pred[i]) for i in range(len(class_names))
+            }
+        }
+    
+    # If model confidence is low
+    if confidence < confidence_threshold:
+        return {
+            "status": "low_quality_prediction",
+            "predicted_class": class_names[class_idx],
+            "confidence": confidence,
+            "validation_score": validation_score,
+            "warning": "Prediction confidence is too low",
+            "suggestion": "Please upload a clearer, well-lit image focusing on a single coffee leaf",
+            "advice": f"Detected {class_names[class_idx]} but with low confidence ({confidence:.1%}). Please upload a clearer image for accurate diagnosis.",
+            "all_probabilities": {
+                class_names[i]: float(pred[i]) for i in range(len(class_names))
+            }
+        }
+    
+    # High entropy means uncertain prediction
+    if entropy > version.thresholds["max_entropy"]:
+        return {
+            "status": "low_quality_prediction",
+            "predicted_class": class_names[class_idx],
+            "confidence": confidence,
+            "validation_score": validation_score,
+            "warning": "Model is uncertain about this prediction",
+            "suggestion": "Try uploading a different angle or better quality image",
+            "advice": f"Detected {class_names[class_idx]} but the model is uncertain. Consider uploading another image for verification.",
+            "all_probabilities": {
+                class_names[i]: float(pred[i]) for i in range(len(class_names))
+            }
+        }
+    
+    # Successful prediction
+    return {
+        "status": "success",
+        "predicted_class": class_names[class_idx],
+        "confidence": confidence,
+        "validation_score": validation_score,
+        "all_probabilities": {
+            class_names[i]: float(pred[i]) for i in range(len(class_names))
+        },
+        "reliable": True,
+        "advice": f"The leaf is classified as **{class_names[class_idx]}** "
+              f"with {confidence:.1%} confidence."
+    }
+
+def predict_image(img_path, confidence_threshold=None, validation_max_side=None, multi_leaf=None, version=None):
+    """
+    Predicts disease from a coffee leaf image with comprehensive validation.
+    img_path may also be an ImageContext that earlier stages already decoded.
+    validation_max_side overrides VALIDATION_MAX_SIDE for the content checks,
+    multi_leaf overrides MULTI_LEAF. version is the model version to use
+    (from registry.use()); by default the active one, held for the call
+    """
+    if version is None:
+        with registry.use() as version:
+            return predict_image(img_path, confidence_threshold, validation_max_side, multi_leaf, version)
+    if confidence_threshold is None:
+        confidence_threshold = version.thresholds["confidence"]
+    if validation_max_side is None:
+        validation_max_side = VALIDATION_MAX_SIDE
+    if multi_leaf is None:
+        multi_leaf = MULTI_LEAF
+
     try:
+        img = as_image_context(img_path)
         print("Starting image validation...", file=sys.stderr)
         
         # First validate the image content
-        validation_result = validate_image_content(img_path)
+        with telemetry.stage("validate_image_content"):
+            validation_result = validate_image_content(img, validation_max_side)
         
         if not validation_result["is_valid"]:
             return {
@@ -392,87 +772,55 @@ def predict_image(img_path, confidence_threshold=0.50):  # Increased from 0.45
                 "advice": validation_result["suggestion"],
                 "predicted_class": "Not a Coffee Leaf",
                 "confidence": 0.0,
-                "validation_score": validation_result.get("validation_score", 0.0)
+                "validation_score": validation_result.get("validation_score", 0.0),
+                "validation_stages": validation_result.get("stages", []),
+                # Decided before every check ran: the score is only a lower bound
+                "validation_score_is_lower_bound": validation_result.get("validation_score_is_lower_bound", False),
+                "reason_is_exact": validation_result.get("reason_is_exact", True),
+                "model_version": version.version
             }
         
         print(f"Image validation passed (score: {validation_result['confidence']:.3f}), proceeding with prediction...", file=sys.stderr)
         
         # Proceed with normal prediction
-        img_array = preprocess_image(img_path)
-        preds = model.predict(img_array, verbose=0)
-        class_idx = np.argmax(preds[0])
-        confidence = float(preds[0][class_idx])
-        
-        # Calculate prediction entropy (lower = more confident)
-        entropy = -np.sum(preds[0] * np.log(preds[0] + 1e-10))
-        
-        print(f"Prediction: {CLASS_NAMES[class_idx]} ({confidence:.2%}), Entropy: {entropy:.3f}", file=sys.stderr)
-        
-        # Cross-validate with image quality
-        validation_score = validation_result.get("confidence", 1.0)
-        
-        # STRICTER check: If validation score is low, reject even with high model confidence
-        if validation_score < 0.3:  # Changed from 0.4
-            return {
-                "status": "invalid_image",
-                "predicted_class": "Not a Coffee Leaf",
-                "confidence": confidence,
-                "validation_score": validation_score,
-                "error": "Image does not appear to be a coffee leaf",
-                "suggestion": "Please upload a clear photo of a single coffee leaf with good lighting",
-                "advice": "The uploaded image doesn't meet the criteria for a coffee leaf. Please upload a clear photo of a coffee plant leaf.",
-                "all_probabilities": {
-                    CLASS_NAMES[i]: float(preds[0][i]) for i in range(len(CLASS_NAMES))
-                }
-            }
-        
-        # If model confidence is low
-        if confidence < confidence_threshold:
-            return {
-                "status": "low_quality_prediction",
-                "predicted_class": CLASS_NAMES[class_idx],
-                "confidence": confidence,
-                "validation_score": validation_score,
-                "warning": "Prediction confidence is too low",
-                "suggestion": "Please upload a clearer, well-lit image focusing on a single coffee leaf",
-                "advice": f"Detected {CLASS_NAMES[class_idx]} but with low confidence ({confidence:.1%}). Please upload a clearer image for accurate diagnosis.",
-                "all_probabilities": {
-                    CLASS_NAMES[i]: float(preds[0][i]) for i in range(len(CLASS_NAMES))
-                }
-            }
-        
-        # High entropy means uncertain prediction
-        if entropy > 1.0:
-            return {
-                "status": "low_quality_prediction",
-                "predicted_class": CLASS_NAMES[class_idx],
-                "confidence": confidence,
-                "validation_score": validation_score,
-                "warning": "Model is uncertain about this prediction",
-                "suggestion": "Try uploading a different angle or better quality image",
-                "advice": f"Detected {CLASS_NAMES[class_idx]} but the model is uncertain. Consider uploading another image for verification.",
-                "all_probabilities": {
-                    CLASS_NAMES[i]: float(preds[0][i]) for i in range(len(CLASS_NAMES))
-                }
-            }
-        
-        # Successful prediction
-        result = {
-            "status": "success",
-            "predicted_class": CLASS_NAMES[class_idx],
-            "confidence": confidence,
-            "validation_score": validation_score,
-            "all_probabilities": {
-                CLASS_NAMES[i]: float(preds[0][i]) for i in range(len(CLASS_NAMES))
-            },
-            "reliable": True,
-            "advice": f"The leaf is classified as **{CLASS_NAMES[class_idx]}** "
-                  f"with {confidence:.1%} confidence."
-        }
+        with telemetry.stage("preprocess"):
+            img_array = preprocess_image(img, version.input_size)
+        
+        boxes = []
+        if multi_leaf:
+            # The view validation ran on, so check_leaf_shapes' contours are
+            # already there
+            with telemetry.stage("leaf_crops"):
+                view = img.validation_view(validation_max_side)
+                candidates = select_leaf_boxes((leaf_candidates(view) or []) + leaf_regions(view))
+                if candidates:
+                    crops, boxes = leaf_crops(img, view, candidates, version.input_size)
+                    img_array = np.concatenate([img_array, crops])
+        
+        # Whole frame and leaf crops in one forward pass
+        with telemetry.stage("model"):
+            preds = run_model(img_array, version)
 
+        result = interpret_prediction(preds[0], validation_result, confidence_threshold, version)
+        result["validation_stages"] = validation_result.get("stages", [])
+        result["model_version"] = version.version
+        
+        if multi_leaf and result["status"] != "invalid_image":
+            leaves = []
+            for box, pred, candidate in zip(boxes, preds[1:], candidates):
+                class_idx = int(np.argmax(pred))
+                leaves.append({
+                    "box": box,
+                    "shape_score": candidate["score"],
+                    "predicted_class": version.class_names[class_idx],
+                    "confidence": float(pred[class_idx]),
+                    "all_probabilities": {name: float(p) for name, p in zip(version.class_names, pred)}
+                })
+            result["leaves"] = leaves
+            result["aggregate"] = aggregate_leaves(leaves, confidence_threshold)
         return result
         
     except Exception as e:
         print(f"Prediction error: {e}", file=sys.stderr)
         traceback.print_exc(file=sys.stderr)
-        raise RuntimeError(f"Prediction failed: {e}")
\ No newline at end of file
+        raise RuntimeError(f"Prediction failed: {e}")
@@ -0,0 +1,309 @@
+"""
+Versioned model artifacts, and swapping the one being served.
+
+Every model version ships with a manifest, <name>.manifest.json, in the
+registry directory (ML_MODEL_REGISTRY, the ml/ directory by default):
+
+    {
+      "version": "v1",
+      "class_names": ["miner", "nodisease", "phoma", "rust"],
+      "input_size": [128, 128],
+      "preprocessing": {"color": "rgb", "resize": "nearest", "scale": "0-1"},
+      "thresholds": {"confidence": 0.5, "max_entropy": 1.0, "min_confidence": 0.35},
+      "artifacts": {"keras": "coffee_disease_final.keras", "tflite": "..."}
+    }
+
+Artifact paths are relative to the manifest, one per backend. The pipeline
+only does the preprocessing above (ImageContext.model_tensor), so manifests
+asking for anything else are rejected instead of scoring garbage.
+
+ModelRegistry.activate() loads a version, warms it up and checks its output
+shape before swapping it in; until then the current version keeps serving.
+Requests take the active version once (use()) and finish on it, even if a
+swap happens meanwhile. The version swapped out stays loaded so rollback()
+is instant; older ones are closed once their last request is done.
+"""
+import os
+import sys
+import json
+import glob
+import time
+import threading
+import contextlib
+
+import numpy as np
+
+import telemetry
+from batching import MicroBatcher
+from backends import load_backend, warm_up
+from result_cache import hash_file, fingerprint
+
+MANIFEST_SUFFIX = ".manifest.json"
+
+# What ImageContext.model_tensor produces
+SUPPORTED_PREPROCESSING = {"color": "rgb", "resize": "nearest", "scale": "0-1"}
+
+DEFAULT_THRESHOLDS = {"confidence": 0.5, "max_entropy": 1.0, "min_confidence": 0.35}
+
+
+def read_manifest(path):
+    """
+    Parses and checks one manifest. Artifact paths come back absolute
+    """
+    try:
+        with open(path) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError) as e:
+        raise ValueError(f"Unreadable model manifest {path}: {e}")
+
+    for field in ("version", "class_names", "input_size", "artifacts"):
+        if not manifest.get(field):
+            raise ValueError(f"Model manifest {path} has no {field}")
+    if len(manifest["input_size"]) != 2:
+        raise ValueError(f"Model manifest {path}: input_size must be [height, width]")
+
+    preprocessing = dict(SUPPORTED_PREPROCESSING, **manifest.get("preprocessing", {}))
+    if preprocessing != SUPPORTED_PREPROCESSING:
+        raise ValueError(f"Model manifest {path}: unsupported preprocessing {manifest['preprocessing']}")
+
+    base = os.path.dirname(os.path.abspath(path))
+    return dict(
+        manifest,
+        version=str(manifest["version"]),
+        input_size=tuple(int(v) for v in manifest["input_size"]),
+        preprocessing=preprocessing,
+        thresholds=dict(DEFAULT_THRESHOLDS, **manifest.get("thresholds", {})),
+        artifacts={name: os.path.join(base, p) for name, p in manifest["artifacts"].items()},
+        path=path
+    )
+
+
+def list_manifests(directory):
+    """
+    Every manifest in directory by version. Read afresh on each call, so
+    versions added after startup are found
+    """
+    manifests = {}
+    for path in sorted(glob.glob(os.path.join(directory, "*" + MANIFEST_SUFFIX))):
+        try:
+            manifest = read_manifest(path)
+        except ValueError as e:
+            print(f"Skipping model manifest: {e}", file=sys.stderr)
+            continue
+        if manifest["version"] in manifests:
+            print(f"Skipping model manifest {path}: version {manifest['version']} is already in "
+                  f"{manifests[manifest['version']]['path']}", file=sys.stderr)
+            continue
+        manifests[manifest["version"]] = manifest
+    return manifests
+
+
+class ModelVersion:
+    """
+    One loaded and warmed-up model with its labels and thresholds
+    """
+
+    def __init__(self, manifest, backend_name, backend, timings):
+        self.manifest = manifest
+        self.version = manifest["version"]
+        self.class_names = list(manifest["class_names"])
+        self.input_size = manifest["input_size"]
+        self.thresholds = manifest["thresholds"]
+        self.backend_name = backend_name
+        self.backend = backend
+        self.timings = timings
+        # Identifies the weights and labels in use; part of every result
+        # cache key, so results of other versions are never served
+        self.fingerprint = fingerprint(
+            hash_file(backend.model_path), backend_name, self.class_names, self.input_size, self.thresholds
+        )
+        self.batcher = None
+        self.in_flight = 0
+        self.retired = False
+        self._lock = threading.Lock()
+
+    def predict(self, batch):
+        """
+        Class probabilities for an (N, H, W, 3) batch; single images go
+        through the micro-batcher when batching is on
+        """
+        if self.batcher is not None and len(batch) == 1:
+            return self.batcher.predict(batch[0])[np.newaxis, :]
+        return self.backend.predict(batch)
+
+    def enable_batching(self, max_batch_size, max_wait_ms):
+        if self.batcher is None:
+            self.batcher = MicroBatcher(self.backend.predict, max_batch_size=max_batch_size, max_wait_ms=max_wait_ms)
+
+    def _acquire(self):
+        with self._lock:
+            self.in_flight += 1
+
+    def _release(self):
+        with self._lock:
+            self.in_flight -= 1
+            idle = self.retired and self.in_flight == 0
+        if idle:
+            self.close()
+
+    def retire(self):
+        """
+        Closes the version as soon as no request is using it
+        """
+        with self._lock:
+            self.retired = True
+            idle = self.in_flight == 0
+        if idle:
+            self.close()
+
+    def close(self):
+        batcher, self.batcher = self.batcher, None
+        if batcher is not None:
+            batcher.close()
+        print(f"Model {self.version} unloaded", file=sys.stderr)
+
+    def describe(self):
+        return {
+            "version": self.version,
+            "backend": self.backend_name,
+            "artifact": os.path.basename(self.backend.model_path),
+            "fingerprint": self.fingerprint,
+            "class_names": self.class_names,
+            "input_size": list(self.input_size),
+            "thresholds": self.thresholds,
+            "in_flight": self.in_flight,
+            **self.timings
+        }
+
+
+class ModelRegistry:
+    """
+    Manifests in one directory, the version being served and the one
+    before it
+    """
+
+    def __init__(self, directory, backend_name, backend_options=None, warmup_batch_sizes=(1,)):
+        self.directory = directory
+        self.backend_name = backend_name
+        self.backend_options = backend_options or {}
+        self.warmup_batch_sizes = list(warmup_batch_sizes)
+        self.active = None
+        self.previous = None
+        self.history = []
+        self._batching = None
+        # Swaps are quick; loads take seconds and only one runs at a time
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+
+    def versions(self):
+        return list_manifests(self.directory)
+
+    def load(self, version, artifact_path=None):
+        """
+        Loads and warms up a version without serving it. artifact_path
+        replaces the manifest's artifact for the configured backend
+        """
+        manifests = self.versions()
+        if version not in manifests:
+            raise ValueError(f"Unknown model version {version!r} (available: {', '.join(manifests) or 'none'})")
+        manifest = manifests[version]
+        if artifact_path is None:
+            artifact_path = manifest["artifacts"].get(self.backend_name)
+        if artifact_path is None:
+            raise ValueError(f"Model version {version} has no {self.backend_name} artifact")
+
+        started = time.perf_counter()
+        backend = load_backend(self.backend_name, artifact_path, **self.backend_options)
+        loaded = time.perf_counter()
+        input_shape = manifest["input_size"] + (3,)
+        warm_up(backend, input_shape, self.warmup_batch_sizes)
+        warmed = time.perf_counter()
+
+        # A model that doesn't take the manifest's input or doesn't give one
+        # probability per class never gets to serve
+        try:
+            output = np.asarray(backend.predict(np.zeros((1,) + input_shape, dtype=np.float32)))
+        except Exception as e:
+            raise RuntimeError(f"Model version {version} rejects {list(input_shape)} input: {e}")
+        if output.shape != (1, len(manifest["class_names"])):
+            raise RuntimeError(f"Model version {version} outputs shape {list(output.shape)}, "
+                               f"the manifest lists {len(manifest['class_names'])} classes")
+
+        loaded_version = ModelVersion(manifest, self.backend_name, backend, {
+            "model_load_ms": round((loaded - started) * 1000, 1),
+            "warmup_ms": round((warmed - loaded) * 1000, 1),
+        })
+        if self._batching is not None:
+            loaded_version.enable_batching(*self._batching)
+        return loaded_version
+
+    def activate(self, version, artifact_path=None):
+        """
+        Serves version from now on: loads it (unless it is the previous
+        one, still loaded), then swaps it in. Requests already running
+        finish on the version they started with. Returns status()
+        """
+        with self._load_lock:
+            if self.active is not None and self.active.version == version and artifact_path is None:
+                return self.status()
+            if self.previous is not None and self.previous.version == version and artifact_path is None:
+                candidate = self.previous
+            else:
+                started = time.perf_counter()
+                candidate = self.load(version, artifact_path)
+                telemetry.record("model.reload", (time.perf_counter() - started) * 1000)
+
+            with self._lock:
+                outgoing, dropped = self.active, self.previous
+                self.active, self.previous = candidate, outgoing
+                self.history.append({"version": version, "activated_at": time.time()})
+                del self.history[:-20]
+            if dropped is not None and dropped is not candidate:
+                dropped.retire()
+
+            if outgoing is not None:
+                telemetry.increment("model.swap")
+                print(f"Model {outgoing.version} -> {candidate.version}", file=sys.stderr)
+            return self.status()
+
+    def rollback(self):
+        """
+        Goes back to the version served before the last swap
+        """
+        previous = self.previous
+        if previous is None:
+            raise ValueError("No previous model version to roll back to")
+        return self.activate(previous.version)
+
+    @contextlib.contextmanager
+    def use(self):
+        """
+        The active version, kept loaded until the block ends
+        """
+        with self._lock:
+            version = self.active
+            version._acquire()
+        try:
+            yield version
+        finally:
+            version._release()
+
+    def enable_batching(self, max_batch_size, max_wait_ms):
+        """
+        Micro-batching for the loaded versions and every one loaded later
+        """
+        self._batching = (max_batch_size, max_wait_ms)
+        for version in (self.active, self.previous):
+            if version is not None:
+                version.enable_batching(max_batch_size, max_wait_ms)
+
+    def status(self):
+        with self._lock:
+            active, previous = self.active, self.previous
+            history = list(self.history)
+        return {
+            "active": active.describe() if active is not None else None,
+            "previous": previous.version if previous is not None else None,
+            "available": sorted(self.versions()),
+            "history": history
+        }
@@ -0,0 +1,186 @@
+"""
+Perceptual hashes and a near-duplicate index for burst and repeat uploads.
+
+Farmers often send several shots of the same leaf: re-framed, recompressed
+by WhatsApp or slightly rotated. The byte hash of the result cache misses
+those, but their 64-bit perceptual hashes are only a few bits apart.
+
+- dhash: sign of the horizontal gradient on a 9x8 thumbnail
+- phash: sign against the median of the 8x8 lowest DCT frequencies of a
+  32x32 thumbnail
+
+Flat, smooth or noise-only images all hash to nearly the same bits, so
+is_distinctive() tells the hashes worth matching from those that aren't.
+
+NearDuplicateIndex finds the closest recent hash within max_distance bits
+using multi-index hashing: each hash is split into max_distance + 1 chunks
+and, by the pigeonhole principle, any hash within max_distance matches at
+least one chunk exactly, so only those candidates are compared in full.
+"""
+import time
+import threading
+from collections import OrderedDict
+
+import cv2
+import numpy as np
+
+HASH_BITS = 64
+
+
+def popcount(value):
+    # int.bit_count() needs Python 3.10; the Docker image ships 3.9
+    return bin(value).count("1")
+
+
+def _bits_to_int(bits):
+    value = 0
+    for bit in bits.ravel():
+        value = (value << 1) | int(bit)
+    return value
+
+
+def thumbnail(rgb, size):
+    """
+    Grayscale thumbnail of size (width, height), area-averaged
+    """
+    small = cv2.resize(rgb, size, interpolation=cv2.INTER_AREA)
+    return cv2.cvtColor(small, cv2.COLOR_RGB2GRAY).astype(np.float32)
+
+
+def dhash(rgb):
+    gray = thumbnail(rgb, (9, 8))
+    return _bits_to_int(gray[:, 1:] > gray[:, :-1])
+
+
+def phash_energy(rgb):
+    """
+    pHash and the RMS of the 63 frequencies it was taken from, in gray
+    levels per pixel: how much structure the bits describe
+    """
+    gray = thumbnail(rgb, (32, 32))
+    low = cv2.dct(gray)[:8, :8].ravel()
+    # The DC term only tracks overall brightness
+    return _bits_to_int(low > np.median(low[1:])), float(np.sqrt(np.mean(low[1:] ** 2)) / 32)
+
+
+def phash(rgb):
+    return phash_energy(rgb)[0]
+
+
+def is_distinctive(value, energy, min_energy=0.5, min_bits=8):
+    """
+    False for hashes that unrelated photos share: too little energy (flat
+    or noise-only images, whose bits are set by JPEG noise), or almost all
+    frequency bits on one side of the median (smooth gradients, solid
+    colours hash to the DC bit alone)
+    """
+    ac_bits = popcount(value & ((1 << (HASH_BITS - 1)) - 1))
+    return energy >= min_energy and min_bits <= ac_bits <= HASH_BITS - 1 - min_bits
+
+
+def hamming(a, b):
+    return popcount(a ^ b)
+
+
+class NearDuplicateIndex:
+    """
+    Bounded index of recent hashes -> values, looked up by Hamming distance.
+
+    Entries are kept per scope (e.g. one user): a lookup only sees hashes
+    stored with the same scope. The least recently used entries are
+    evicted beyond max_entries, and entries older than ttl_s (0 = never)
+    are ignored and dropped. put() and nearest() are thread-safe.
+    """
+
+    def __init__(self, max_distance=6, max_entries=512, ttl_s=600):
+        if not 0 <= max_distance < HASH_BITS:
+            raise ValueError(f"max_distance must be between 0 and {HASH_BITS - 1}")
+        self.max_distance = max_distance
+        self.max_entries = max_entries
+        self.ttl_s = ttl_s
+
+        # Chunk boundaries: max_distance + 1 nearly equal bit ranges
+        chunks = max_distance + 1
+        edges = [HASH_BITS * i // chunks for i in range(chunks + 1)]
+        self._chunks = [(low, (1 << (high - low)) - 1) for low, high in zip(edges, edges[1:])]
+        self._tables = [{} for _ in self._chunks]
+
+        self._entries = OrderedDict()  # (scope, hash) -> (value, stored_at)
+        self._lock = threading.Lock()
+        self.counters = {"hits": 0, "misses": 0, "stores": 0, "evictions": 0, "expired": 0}
+
+    def _keys(self, entry):
+        scope, value = entry
+        return [(scope, (value >> low) & mask) for low, mask in self._chunks]
+
+    def _remove(self, entry):
+        self._entries.pop(entry, None)
+        for table, key in zip(self._tables, self._keys(entry)):
+            bucket = table.get(key)
+            if bucket is not None:
+                bucket.discard(entry)
+                if not bucket:
+                    del table[key]
+
+    def _expired(self, stored_at, now):
+        return self.ttl_s > 0 and now - stored_at > self.ttl_s
+
+    def nearest(self, value, scope=None):
+        """
+        (stored value, distance) of the closest entry of scope within
+        max_distance, or (None, None)
+        """
+        now = time.time()
+        with self._lock:
+            candidates = set()
+            for table, key in zip(self._tables, self._keys((scope, value))):
+                candidates.update(table.get(key, ()))
+
+            best, best_distance = None, None
+            for candidate in candidates:
+                stored, stored_at = self._entries[candidate]
+                if self._expired(stored_at, now):
+                    self._remove(candidate)
+                    self.counters["expired"] += 1
+                    continue
+                distance = hamming(value, candidate[1])
+                if distance <= self.max_distance and (best_distance is None or distance < best_distance):
+                    best, best_distance = candidate, distance
+
+            if best is None:
+                self.counters["misses"] += 1
+                return None, None
+            self._entries.move_to_end(best)
+            self.counters["hits"] += 1
+            return self._entries[best][0], best_distance
+
+    def put(self, value, stored, scope=None):
+        entry = (scope, value)
+        with self._lock:
+            if entry in self._entries:
+                self._remove(entry)
+            self._entries[entry] = (stored, time.time())
+            for table, key in zip(self._tables, self._keys(entry)):
+                table.setdefault(key, set()).add(entry)
+            self.counters["stores"] += 1
+
+            while len(self._entries) > self.max_entries:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.counters["evictions"] += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            for table in self._tables:
+                table.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.counters["hits"] + self.counters["misses"]
+            return {
+                **self.counters,
+                "entries": len(self._entries),
+                "max_distance": self.max_distance,
+                "hit_rate": round(self.counters["hits"] / lookups, 4) if lookups else 0.0,
+            }
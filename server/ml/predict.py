@@ -1,53 +1,191 @@
 import os
 # Suppress TensorFlow messages BEFORE importing tensorflow
 os.environ['TF_CPP_MIN_LOG_LEVEL'] = '2'
-os.environ['TF_ENABLE_ONEDNN_OPTS'] = '0'
 
 import sys
+import copy
 import json
+import time
+_process_started = time.perf_counter()
+import asyncio
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
 import numpy as np # pyright: ignore[reportMissingImports]
 from PIL import Image
-from openai import OpenAI # pyright: ignore[reportMissingImports]
-from model import predict_image  # Ensure this import is correct
-import tensorflow as tf # pyright: ignore[reportMissingModuleSource]
+from openai import OpenAI, AsyncOpenAI # pyright: ignore[reportMissingImports]
+from model import predict_image, enable_batching, VALIDATION_MAX_SIDE, STARTUP_TIMINGS, registry  # Ensure this import is correct
+from model import MULTI_LEAF, MULTI_LEAF_MAX_CROPS, MULTI_LEAF_MIN_SCORE
+from image_context import ImageContext, as_image_context, DECODE_ERRORS
+from features import color_features
+from result_cache import ResultCache, hash_file, fingerprint
+from advice_cache import AdviceCache, PLACEHOLDER, confidence_bucket
+from llm_stub import StubClient, AsyncStubClient
+from llm_client import SingleFlightClient, AsyncSingleFlightClient, LazyClient
+from phash import NearDuplicateIndex, is_distinctive
+import telemetry
+import deadline
 
-# 🔹 Setup OpenAI client
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+# 🔹 Setup OpenAI client (ML_LLM_STUB=1 answers with canned text, for offline dev;
+# ML_LLM_STUB_DELAY_MS makes it as slow as the real API). The worker's event
+# loop uses async_client, everything else the blocking client. Both go
+# through llm_client's single-flight layer, which also does the retries.
+# The OpenAI clients are built on first use, so runs without the LLM
+# (batch_score.py) don't need OPENAI_API_KEY
+if os.getenv("ML_LLM_STUB") == "1":
+    stub_delay_s = float(os.getenv("ML_LLM_STUB_DELAY_MS", "0")) / 1000
+    client = SingleFlightClient(StubClient(delay_s=stub_delay_s))
+    async_client = AsyncSingleFlightClient(AsyncStubClient(delay_s=stub_delay_s))
+else:
+    client = SingleFlightClient(LazyClient(lambda: OpenAI(api_key=os.getenv("OPENAI_API_KEY"), max_retries=0)))
+    async_client = AsyncSingleFlightClient(
+        LazyClient(lambda: AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"), max_retries=0))
+    )
 
+LLM_SYSTEM_PROMPT = "You are an agronomy assistant for coffee plants. Provide detailed, friendly, and practical advice to coffee farmers based on system diagnoses. Make responses human-like and lively."
 
-def validate_leaf_image(img_path):
+# 🔹 Advice cache
+# A few LLM texts per (status, class, confidence bucket) are generated once
+# and rotated, instead of a gpt-4o-mini round-trip per upload.
+# ML_ADVICE_VARIANTS=0 turns the cache off. Texts older than ADVICE_TTL_S
+# are replaced in the background and never served past ADVICE_MAX_AGE_S.
+ADVICE_VARIANTS = int(os.getenv("ML_ADVICE_VARIANTS", "3"))
+ADVICE_TTL_S = float(os.getenv("ML_ADVICE_TTL_S", str(7 * 86400)))
+ADVICE_MAX_AGE_S = float(os.getenv("ML_ADVICE_MAX_AGE_S", str(30 * 86400)))
+ADVICE_CACHE_PATH = os.getenv("ML_ADVICE_CACHE_PATH", "")
+
+advice_cache = None
+if ADVICE_VARIANTS > 0:
+    advice_cache = AdviceCache(
+        client,
+        LLM_SYSTEM_PROMPT,
+        variants=ADVICE_VARIANTS,
+        ttl_s=ADVICE_TTL_S,
+        path=ADVICE_CACHE_PATH or None,
+        async_client=async_client,
+        max_age_s=ADVICE_MAX_AGE_S
+    )
+
+# 🔹 Worker mode settings
+# Up to BATCH_MAX_SIZE concurrent images share one forward pass, waiting at most
+# BATCH_MAX_WAIT_MS for the batch to fill. A batch size of 1 disables batching.
+BATCH_MAX_SIZE = int(os.getenv("ML_BATCH_MAX_SIZE", "8"))
+BATCH_MAX_WAIT_MS = float(os.getenv("ML_BATCH_MAX_WAIT_MS", "5"))
+WORKER_CONCURRENCY = int(os.getenv("ML_WORKER_CONCURRENCY", str(max(1, BATCH_MAX_SIZE))))
+
+# 🔹 Result cache
+# Re-uploads of the same photo return the stored result instead of running
+# validation, the model and the LLM again. The memory tier only helps the
+# long-lived worker; set ML_RESULT_CACHE_PATH to keep results across
+# restarts and one-shot runs.
+RESULT_CACHE_SIZE = int(os.getenv("ML_RESULT_CACHE_SIZE", "256"))
+RESULT_CACHE_TTL_S = float(os.getenv("ML_RESULT_CACHE_TTL_S", "86400"))
+RESULT_CACHE_PATH = os.getenv("ML_RESULT_CACHE_PATH", "")
+RESULT_CACHE_DISK_ENTRIES = int(os.getenv("ML_RESULT_CACHE_DISK_ENTRIES", "10000"))
+
+# 🔹 Near-duplicate reuse (off unless ML_NEAR_DUP_ENTRIES > 0)
+# Re-framed, recompressed or slightly rotated shots of a leaf the same user
+# recently sent (perceptual hash within NEAR_DUP_DISTANCE bits) reuse its
+# validation and prediction. Only requests that carry a scope (the Node side
+# sends the user id) are matched, and only against that scope's uploads.
+# Hashes of flat, smooth or noise-only images (energy below
+# NEAR_DUP_MIN_ENERGY, see phash.is_distinctive) match unrelated photos and
+# are never used. The distance comes from bench/near_duplicates.py.
+NEAR_DUP_DISTANCE = int(os.getenv("ML_NEAR_DUP_DISTANCE", "6"))
+NEAR_DUP_ENTRIES = int(os.getenv("ML_NEAR_DUP_ENTRIES", "0"))
+NEAR_DUP_TTL_S = float(os.getenv("ML_NEAR_DUP_TTL_S", "900"))
+NEAR_DUP_MIN_ENERGY = float(os.getenv("ML_NEAR_DUP_MIN_ENERGY", "0.5"))
+
+near_duplicates = None
+if NEAR_DUP_ENTRIES > 0:
+    near_duplicates = NearDuplicateIndex(
+        max_distance=NEAR_DUP_DISTANCE,
+        max_entries=NEAR_DUP_ENTRIES,
+        ttl_s=NEAR_DUP_TTL_S
+    )
+
+# 🔹 Deadlines
+# A request can carry a time budget (deadline_ms, or ML_DEADLINE_MS for every
+# request; 0 = none) that deadline.py spreads over decode, validation, model
+# and LLM. A stage that would overrun its share degrades instead: large
+# uploads are decoded and/or validated on a DEADLINE_PROXY_SIDE proxy, and
+# LLM text that can't arrive in time is replaced by local_advice(). The
+# costs per megapixel were measured on one core with bench/deadline_bench.py.
+DEADLINE_MS = float(os.getenv("ML_DEADLINE_MS", "0"))
+DEADLINE_PROXY_SIDE = int(os.getenv("ML_DEADLINE_PROXY_SIDE", "512"))
+DEADLINE_DECODE_MS_PER_MP = float(os.getenv("ML_DEADLINE_DECODE_MS_PER_MP", "10"))
+DEADLINE_VALIDATION_MS_PER_MP = float(os.getenv("ML_DEADLINE_VALIDATION_MS_PER_MP", "32"))
+DEADLINE_LLM_MIN_MS = float(os.getenv("ML_DEADLINE_LLM_MIN_MS", "200"))
+
+# LLM calls under a deadline run here, so a late answer can be abandoned
+llm_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv("ML_DEADLINE_LLM_THREADS", "8")),
+    thread_name_prefix="llm"
+)
+
+# Attach per-stage milliseconds to every result under "timings" (worker
+# requests can also ask for them with "timings": true)
+RESULT_TIMINGS = os.getenv("ML_RESULT_TIMINGS", "0") == "1"
+
+# Bump when the validation/confidence thresholds or the result format change
+RESULT_VERSION = 2
+
+
+def result_fingerprint(version):
+    """
+    Everything but the image that decides a result served by a model
+    version. Results of other versions are kept, so a rollback finds its
+    old entries again
     """
-    Validates if the image looks like a plant leaf using multiple checks:
+    return fingerprint(
+        version.fingerprint, VALIDATION_MAX_SIDE, RESULT_VERSION,
+        # Multi-leaf results carry more; without it the keys stay as they were
+        *([MULTI_LEAF_MAX_CROPS, MULTI_LEAF_MIN_SCORE] if MULTI_LEAF else [])
+    )
+
+
+result_cache = None
+if RESULT_CACHE_SIZE > 0 or RESULT_CACHE_PATH:
+    result_cache = ResultCache(
+        max_entries=RESULT_CACHE_SIZE,
+        ttl_s=RESULT_CACHE_TTL_S,
+        disk_path=RESULT_CACHE_PATH or None,
+        disk_max_entries=RESULT_CACHE_DISK_ENTRIES
+    )
+
+
+def validate_leaf_image(img, max_side=None):
+    """
+    Validates if the image (file path or ImageContext) looks like a plant leaf
+    using multiple checks:
     1. Color analysis (green content)
     2. Edge detection (leaf texture)
     3. Aspect ratio check
+    The checks run on a proxy of at most max_side pixels (defaults to
+    VALIDATION_MAX_SIDE)
     """
+    if max_side is None:
+        max_side = VALIDATION_MAX_SIDE
+
     try:
-        img = Image.open(img_path)
-        img_array = np.array(img.convert('RGB'))
+        features = color_features(as_image_context(img).validation_view(max_side))
         
         # Check 1: Green content analysis
-        # Leaves typically have dominant green color
-        red = img_array[:, :, 0]
-        green = img_array[:, :, 1]
-        blue = img_array[:, :, 2]
-        
-        # Calculate green dominance
-        green_mask = (green > red) & (green > blue) & (green > 50)
-        green_percentage = np.sum(green_mask) / (img_array.shape[0] * img_array.shape[1])
+        # Leaves typically have dominant green color (G > R, G > B and G > 50)
+        green_percentage = features["dominant_green_share"]
         
         # Check 2: Overall color variance (leaves aren't uniform)
-        color_std = np.std(green)
+        color_std = features["std"][1]
         
         # Check 3: Brightness check (not too dark or too bright)
-        brightness = np.mean(img_array)
+        brightness = np.mean(features["mean"])
         
         # Validation thresholds
         is_greenish = green_percentage > 0.15  # At least 15% green pixels
         has_texture = color_std > 15  # Reasonable color variance
         proper_brightness = 30 < brightness < 230  # Not too dark/bright
         
-        validation_score = sum([is_greenish, has_texture, proper_brightness])
+        validation_score = int(sum([is_greenish, has_texture, proper_brightness]))
         
         return {
             "is_valid": validation_score >= 2,  # At least 2 out of 3 checks pass
@@ -91,88 +229,153 @@ def get_disease_description(disease_class):
     }
     return descriptions.get(disease_class, disease_class)
 
-def get_llm_response(prediction):
-    try:
-        if prediction.get("status") == "invalid_image":
-            # Directly return a clear message without LLM
-            error_reason = prediction.get('reason', 'Image validation failed')
-            suggestion = prediction.get('suggestion', 'Please upload a clear image of a coffee leaf')
-            
-            prediction["llm_response"] = (
-                f"⚠️ **Unable to Analyze Image**\n\n"
-                f"{error_reason}\n\n"
-                f"**What to do:**\n"
-                f"{suggestion}\n\n"
-                f"Please upload a clear photo of a coffee plant leaf so I can help diagnose any potential diseases."
-            )
-            return prediction
-            
-        elif prediction.get("status") == "low_quality_prediction":
-            confidence = prediction.get('confidence', 0)
-            predicted_class = prediction.get('predicted_class', 'unknown')
-            
-            if confidence < 0.35:  # Very low confidence
-                prediction["llm_response"] = (
-                    f"⚠️ **Unable to Provide Reliable Diagnosis**\n\n"
-                    f"The image quality is too poor or doesn't clearly show a coffee leaf. "
-                    f"The system detected '{predicted_class}' but with very low confidence ({confidence:.1%}).\n\n"
-                    f"**Please upload:**\n"
-                    f"- A clear, well-lit photo of a single coffee leaf\n"
-                    f"- Make sure the leaf fills most of the frame\n"
-                    f"- Avoid blurry or dark images"
-                )
-                return prediction
-            
-            # Otherwise use LLM for moderate confidence cases
-            prompt = (
-                f"The system detected {predicted_class} "
-                f"but with low confidence ({confidence:.1%}). "
-                "This might not be a coffee leaf or the image quality is poor. "
-                "In 2-3 sentences, advise the user to take a clearer photo of a coffee leaf for better results. "
-                "Be friendly but clear that the current result may not be accurate."
-            )
-            
-        elif prediction.get("status") == "success":
-            disease_class = prediction['predicted_class']
-            confidence = prediction['confidence']
-            disease_desc = get_disease_description(disease_class)
-            
-            if disease_class == "nodisease":
-                prompt = (
-                    f"The coffee leaf appears healthy with {confidence:.1%} confidence. "
-                    "Congratulate the user briefly and encourage them to keep up the good work with their coffee plants. "
-                    "Keep it cheerful, friendly, and SHORT - just 2-3 sentences maximum. "
-                    "DO NOT give any care tips unless asked."
-                )
-            else:
-                prompt = (
-                    f"The system detected {disease_desc} with {confidence:.1%} confidence. "
-                    "Provide a brief, friendly acknowledgment of the diagnosis. "
-                    "Explain what this disease is in 2-3 sentences maximum. "
-                    "DO NOT provide treatment steps, prevention methods, or any advice yet. "
-                    "Just describe what the disease is and acknowledge the situation. "
-                    "Keep it empathetic but SHORT. "
-                    "Let the user know they can ask follow-up questions for treatment advice."
-                )
-        else:
-            prompt = (
-                f"System could not confidently classify the image. "
-                f"Reason: {prediction.get('error', prediction.get('warning', 'Unknown'))}. "
-                "Kindly suggest uploading a clearer coffee leaf image. Keep it brief and friendly."
-            )
+def local_advice(prediction):
+    """
+    Advice text built locally from get_disease_description, for when the
+    LLM can't answer in time
+    """
+    status = prediction.get("status")
+    predicted_class = prediction.get("predicted_class", "unknown")
+    confidence = prediction.get("confidence", 0)
+
+    if status == "success" and predicted_class == "nodisease":
+        return (
+            f"Good news! Your coffee leaf looks healthy ({confidence:.1%} confidence). "
+            "Keep up the good work with your plants."
+        )
+    if status == "success":
+        return (
+            f"The system detected {get_disease_description(predicted_class)} "
+            f"({confidence:.1%} confidence). "
+            "Feel free to ask follow-up questions for treatment advice."
+        )
+    if status == "low_quality_prediction":
+        return (
+            f"The system detected {get_disease_description(predicted_class)}, but only with "
+            f"{confidence:.1%} confidence, so the result may not be accurate. "
+            "Please take a clearer, well-lit photo of a single coffee leaf for a better diagnosis."
+        )
+    return "The system could not confidently classify this image. Please upload a clearer photo of a coffee leaf."
+
+def complete_advice(prompt):
+    """
+    One uncached gpt-4o-mini round-trip
+    """
+    completion = client.chat.completions.create(
+        model="gpt-4o-mini",
+        messages=[
+            {"role": "system", "content": LLM_SYSTEM_PROMPT},
+            {"role": "user", "content": prompt}
+        ]
+    )
+    return completion.choices[0].message.content
+
 
-        completion = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[
-                {
-                    "role": "system", 
-                    "content": "You are an agronomy assistant for coffee plants. Provide detailed, friendly, and practical advice to coffee farmers based on system diagnoses. Make responses human-like and lively."
-                },
-                {"role": "user", "content": prompt}
-            ]
+async def complete_advice_async(prompt):
+    completion = await async_client.chat.completions.create(
+        model="gpt-4o-mini",
+        messages=[
+            {"role": "system", "content": LLM_SYSTEM_PROMPT},
+            {"role": "user", "content": prompt}
+        ]
+    )
+    return completion.choices[0].message.content
+
+
+def advice_prompt(prediction):
+    """
+    What the advice for a prediction needs: (text, None) for the fixed
+    messages, or (None, prompt) when it has to come from the LLM. Prompts
+    that mention the confidence write it as PLACEHOLDER
+    """
+    if prediction.get("status") == "invalid_image":
+        # Directly return a clear message without LLM
+        error_reason = prediction.get('reason', 'Image validation failed')
+        suggestion = prediction.get('suggestion', 'Please upload a clear image of a coffee leaf')
+        
+        return (
+            f"⚠️ **Unable to Analyze Image**\n\n"
+            f"{error_reason}\n\n"
+            f"**What to do:**\n"
+            f"{suggestion}\n\n"
+            f"Please upload a clear photo of a coffee plant leaf so I can help diagnose any potential diseases."
+        ), None
+        
+    elif prediction.get("status") == "low_quality_prediction":
+        confidence = prediction.get('confidence', 0)
+        predicted_class = prediction.get('predicted_class', 'unknown')
+        
+        if confidence < 0.35:  # Very low confidence
+            return (
+                f"⚠️ **Unable to Provide Reliable Diagnosis**\n\n"
+                f"The image quality is too poor or doesn't clearly show a coffee leaf. "
+                f"The system detected '{predicted_class}' but with very low confidence ({confidence:.1%}).\n\n"
+                f"**Please upload:**\n"
+                f"- A clear, well-lit photo of a single coffee leaf\n"
+                f"- Make sure the leaf fills most of the frame\n"
+                f"- Avoid blurry or dark images"
+            ), None
+        
+        # Otherwise use LLM for moderate confidence cases
+        return None, (
+            f"The system detected {predicted_class} "
+            f"but with low confidence ({PLACEHOLDER}, {confidence_bucket(confidence)} confidence). "
+            "This might not be a coffee leaf or the image quality is poor. "
+            "In 2-3 sentences, advise the user to take a clearer photo of a coffee leaf for better results. "
+            "Be friendly but clear that the current result may not be accurate."
+        )
+        
+    elif prediction.get("status") == "success":
+        predicted_class = prediction['predicted_class']
+        confidence = prediction['confidence']
+        disease_desc = get_disease_description(predicted_class)
+        
+        if predicted_class == "nodisease":
+            return None, (
+                f"The coffee leaf appears healthy with {PLACEHOLDER} confidence "
+                f"({confidence_bucket(confidence)} confidence). "
+                "Congratulate the user briefly and encourage them to keep up the good work with their coffee plants. "
+                "Keep it cheerful, friendly, and SHORT - just 2-3 sentences maximum. "
+                "DO NOT give any care tips unless asked."
+            )
+        return None, (
+            f"The system detected {disease_desc} with {PLACEHOLDER} confidence "
+            f"({confidence_bucket(confidence)} confidence). "
+            "Provide a brief, friendly acknowledgment of the diagnosis. "
+            "Explain what this disease is in 2-3 sentences maximum. "
+            "DO NOT provide treatment steps, prevention methods, or any advice yet. "
+            "Just describe what the disease is and acknowledge the situation. "
+            "Keep it empathetic but SHORT. "
+            "Let the user know they can ask follow-up questions for treatment advice."
         )
 
-        prediction["llm_response"] = completion.choices[0].message.content
+    # Not tied to a confidence, so never served from the advice cache
+    return None, (
+        f"System could not confidently classify the image. "
+        f"Reason: {prediction.get('error', prediction.get('warning', 'Unknown'))}. "
+        "Kindly suggest uploading a clearer coffee leaf image. Keep it brief and friendly."
+    )
+
+
+def _advice_key(prediction):
+    return AdviceCache.key(prediction["status"], prediction["predicted_class"], prediction["confidence"])
+
+
+def get_llm_response(prediction, use_llm=True):
+    """
+    Adds "llm_response" to the prediction. With use_llm=False the fixed
+    messages are still filled in, but anything that needs the OpenAI API is
+    left as None
+    """
+    try:
+        text, prompt = advice_prompt(prediction)
+        if text is None and use_llm:
+            confidence_text = f"{prediction.get('confidence', 0):.1%}"
+            if advice_cache is None or PLACEHOLDER not in prompt:
+                text = complete_advice(prompt.replace(PLACEHOLDER, confidence_text))
+            else:
+                text = advice_cache.respond(_advice_key(prediction), prompt, confidence_text)
+        prediction["llm_response"] = text
         return prediction
 
     except Exception as e:
@@ -180,65 +383,541 @@ def get_llm_response(prediction):
         return prediction
 
 
-def main():
+async def get_llm_response_async(prediction):
+    """
+    get_llm_response for the worker's event loop: the OpenAI round-trip
+    awaits async_client, so other requests keep running meanwhile
+    """
     try:
-        if len(sys.argv) < 2:
-            result = {"error": "No image path provided", "status": "error"}
-            print(json.dumps(result))
-            return
+        text, prompt = advice_prompt(prediction)
+        if text is None:
+            confidence_text = f"{prediction.get('confidence', 0):.1%}"
+            if advice_cache is None or PLACEHOLDER not in prompt:
+                text = await complete_advice_async(prompt.replace(PLACEHOLDER, confidence_text))
+            else:
+                text = await advice_cache.respond_async(_advice_key(prediction), prompt, confidence_text)
+        prediction["llm_response"] = text
+        return prediction
 
-        img_path = sys.argv[1]
+    except Exception as e:
+        prediction["llm_response"] = f"Error getting LLM response: {str(e)}"
+        return prediction
 
-        # Check if image file exists
-        if not os.path.exists(img_path):
-            result = {"error": f"Image file not found: {img_path}", "status": "error"}
-            print(json.dumps(result))
-            return
 
-        # 🔹 Step 1: Validate if image looks like a leaf
-        validation = validate_leaf_image(img_path)
+def is_cacheable(result):
+    """
+    Only finished results are cached; errors, failed LLM calls and results
+    a deadline degraded are retried
+    """
+    if result.get("status") == "error":
+        return False
+    budget = deadline.current()
+    if budget is not None and budget.degradations:
+        return False
+    return not str(result.get("llm_response", "")).startswith("Error getting LLM response")
+
+
+def score_image(img, version, validation_max_side=None):
+    """
+    Validation and model version for one decoded image, everything before
+    the LLM. validation_max_side overrides VALIDATION_MAX_SIDE for the
+    heuristic checks
+    """
+    # 🔹 Step 1: Validate if image looks like a leaf
+    with telemetry.stage("validate_leaf_image"):
+        validation = validate_leaf_image(img, validation_max_side)
         
-        if not validation["is_valid"]:
-            result = {
-                "status": "invalid_image",
-                "predicted_class": "Not a Coffee Leaf",
-                "confidence": 0.0,
-                "reason": "The uploaded image doesn't appear to be a plant leaf. Please upload a clear image of a coffee leaf.",
-                "validation_details": {
-                    "green_percentage": validation.get("green_percentage", 0),
-                    "checks_passed": validation.get("checks_passed", 0)
-                },
-                "advice": "Please upload a clear, well-lit image of a coffee plant leaf for accurate disease detection."
-            }
-            result = get_llm_response(result)
-            print(json.dumps(result))
-            return
+    if not validation["is_valid"]:
+        result = {
+            "status": "invalid_image",
+            "predicted_class": "Not a Coffee Leaf",
+            "confidence": 0.0,
+            "reason": "The uploaded image doesn't appear to be a plant leaf. Please upload a clear image of a coffee leaf.",
+            "validation_details": {
+                "green_percentage": validation.get("green_percentage", 0),
+                "checks_passed": validation.get("checks_passed", 0)
+            },
+            "advice": "Please upload a clear, well-lit image of a coffee plant leaf for accurate disease detection.",
+            "model_version": version.version
+        }
+        return result
 
-        # 🔹 Step 2: Run prediction on validated image
-        result = predict_image(img_path)
+    # 🔹 Step 2: Run prediction on validated image
+    result = predict_image(img, validation_max_side=validation_max_side, version=version)
 
-        # 🔹 Step 3: Additional confidence-based validation
-        confidence_check = validate_with_confidence_threshold(result, min_confidence=0.35)
+    # 🔹 Step 3: Additional confidence-based validation
+    confidence_check = validate_with_confidence_threshold(result, version.thresholds["min_confidence"])
         
-        if not confidence_check["is_valid"]:
-            result["status"] = "low_quality_prediction"
-            result["original_confidence"] = result.get("confidence", 0)
-            result["warning"] = "Low confidence prediction - image may not be a coffee leaf or quality is poor"
-            result["advice"] = "Try uploading a clearer, well-lit image of a coffee leaf for better results."
+    if not confidence_check["is_valid"]:
+        result["status"] = "low_quality_prediction"
+        result["original_confidence"] = result.get("confidence", 0)
+        result["warning"] = "Low confidence prediction - image may not be a coffee leaf or quality is poor"
+        result["advice"] = "Try uploading a clearer, well-lit image of a coffee leaf for better results."
+
+    return result
+
+
+def plan_stages(img, budget):
+    """
+    Picks the decode and validation cost the deadline leaves room for.
+    Returns the context to score and the validation max side to use
+    """
+    if budget is None:
+        return img, None
+    try:
+        width, height = img.full_size
+    except Exception:
+        # Unreadable image: let validation report it as usual
+        return img, None
+
+    megapixels = width * height / 1e6
+    if not img.decoded and budget.estimate_exceeds("decode", megapixels * DEADLINE_DECODE_MS_PER_MP):
+        # Every stage works from a reduced decode (JPEG draft mode)
+        budget.degrade("reduced_decode")
+        img = img.validation_view(DEADLINE_PROXY_SIDE)
+        megapixels = img.shape[0] * img.shape[1] / 1e6
+
+    validated = megapixels
+    if VALIDATION_MAX_SIDE:
+        validated *= min(1.0, VALIDATION_MAX_SIDE / max(width, height) / img.scale) ** 2
+    if budget.estimate_exceeds("validation", validated * DEADLINE_VALIDATION_MS_PER_MP):
+        budget.degrade("validation_proxy")
+        return img, DEADLINE_PROXY_SIDE
+    return img, None
+
+
+def advise_within(result, use_llm, budget):
+    """
+    get_llm_response bounded by the deadline. When the LLM can't answer in
+    the time left, the advice comes from local_advice() instead; the late
+    answer still completes in the background and fills the advice cache
+    """
+    if not use_llm or budget is None:
+        return get_llm_response(result, use_llm)
+
+    # Fixed messages (invalid images, very low confidence) need no LLM
+    offline = get_llm_response(dict(result), use_llm=False)
+    if offline["llm_response"] is not None:
+        return offline
+
+    allowance = budget.allowance_ms("llm")
+    if allowance >= DEADLINE_LLM_MIN_MS:
+        pending = llm_executor.submit(get_llm_response, dict(result), use_llm)
+        try:
+            return pending.result(timeout=allowance / 1000)
+        except FutureTimeout:
+            pass
+
+    budget.degrade("llm_template")
+    offline["llm_response"] = local_advice(offline)
+    return offline
+
+
+async def advise_within_async(result, use_llm, budget):
+    """
+    advise_within for the worker's event loop
+    """
+    if not use_llm:
+        return get_llm_response(result, use_llm=False)
+    if budget is None:
+        return await get_llm_response_async(result)
+
+    offline = get_llm_response(dict(result), use_llm=False)
+    if offline["llm_response"] is not None:
+        return offline
+
+    allowance = budget.allowance_ms("llm")
+    if allowance >= DEADLINE_LLM_MIN_MS:
+        pending = asyncio.ensure_future(get_llm_response_async(dict(result)))
+        try:
+            # shield: on timeout the call carries on and fills the advice cache
+            return await asyncio.wait_for(asyncio.shield(pending), allowance / 1000)
+        except asyncio.TimeoutError:
+            pass
 
+    budget.degrade("llm_template")
+    offline["llm_response"] = local_advice(offline)
+    return offline
+
+
+def score_request(img_path, version, scope=None):
+    """
+    Everything before the LLM for one image: decode, the deadline's plan,
+    near-duplicate reuse (within scope), validation and model version
+    """
+    # Decode once, every stage below shares the same pixels
+    img = as_image_context(img_path)
+    budget = deadline.current()
+    img, validation_max_side = plan_stages(img, budget)
+
+    result = None
+    hash_key = None
+    previous = None
+    if near_duplicates is not None and scope is not None:
+        with telemetry.stage("near_duplicate"):
+            try:
+                # The pixels validation decodes anyway
+                view = img.validation_view(VALIDATION_MAX_SIDE if validation_max_side is None else validation_max_side)
+                view.rgb
+            except DECODE_ERRORS:
+                # Unreadable image: let validation report it as usual
+                view = None
+            if view is not None:
+                hash_key, energy = view.perceptual_hash
+                if is_distinctive(hash_key, energy, NEAR_DUP_MIN_ENERGY):
+                    previous, distance = near_duplicates.nearest(hash_key, scope)
+                else:
+                    telemetry.increment("near_duplicate.indistinct")
+                    hash_key = None
+        # Scored by a version swapped out since (or still finishing on one)
+        if previous is not None and previous.get("model_version") != version.version:
+            previous = None
+        if previous is not None:
+            telemetry.increment("near_duplicate.hit")
+            result = copy.deepcopy(previous)
+            result["near_duplicate"] = {"distance": distance}
+
+    if result is None:
+        result = score_image(img, version, validation_max_side)
+        # Degraded scores aren't reused for later uploads
+        if hash_key is not None and not (budget is not None and budget.degradations):
+            near_duplicates.put(hash_key, copy.deepcopy(result), scope)
+    return result
+
+
+def failed_result(e):
+    return {
+        "error": "Prediction failed",
+        "details": str(e),
+        "type": str(type(e).__name__),
+        "status": "error"
+    }
+
+
+def prepare_prediction(img_path, use_llm=True, scope=None):
+    """
+    First phase of a prediction: the stored result if the result cache has
+    one, else validation and model without the LLM text. The model version
+    active when it starts serves the whole request, even if another one is
+    swapped in meanwhile. Near duplicates are only looked up within scope
+    (None: not at all).
+    Returns (result, cache_key, done); done means result is already final
+    """
+    try:
+        with registry.use() as version:
+            # Pixels handed over through shm_ring: no file to check or hash
+            if isinstance(img_path, ImageContext):
+                return score_request(img_path, version, scope), None, False
+
+            # Check if image file exists
+            if not os.path.exists(img_path):
+                return {"error": f"Image file not found: {img_path}", "status": "error"}, None, True
+
+            cache_key = None
+            # Results without the LLM text aren't complete, so they bypass the cache
+            if result_cache is not None and use_llm:
+                with telemetry.stage("result_cache"):
+                    cache_key = f"{hash_file(img_path)}:{result_fingerprint(version)}"
+                    cached = result_cache.get(cache_key)
+                if cached is not None:
+                    telemetry.increment("result_cache.hit")
+                    cached["cached"] = True
+                    return cached, None, True
+
+            return score_request(img_path, version, scope), cache_key, False
+
+    except Exception as e:
+        return failed_result(e), None, True
+
+
+def store_result(cache_key, result):
+    if cache_key is not None and is_cacheable(result):
+        result_cache.put(cache_key, result)
+
+
+def predict_with_cache(img_path, use_llm=True, scope=None):
+    """
+    Serves the result from the result cache, or runs the pipeline and stores it
+    """
+    result, cache_key, done = prepare_prediction(img_path, use_llm, scope)
+    if done:
+        return result
+
+    try:
         # 🔹 Step 4: Add LLM response based on final status
-        result = get_llm_response(result)
+        with telemetry.stage("llm"):
+            result = advise_within(result, use_llm, deadline.current())
+        store_result(cache_key, result)
+        return result
+    except Exception as e:
+        return failed_result(e)
+
+
+def finish_result(result, timings, include_timings, budget):
+    """
+    Counts the outcome and attaches the timings and degradations asked for
+    """
+    telemetry.increment(f"status.{result.get('status', 'unknown')}")
+    if include_timings and timings is not None:
+        result["timings"] = timings
+    if budget is not None:
+        result["degradations"] = list(budget.degradations)
+    return result
+
+
+def run_prediction(img_path, include_timings=None, use_llm=True, deadline_ms=None, scope=None):
+    """
+    Runs the full pipeline on one image and returns the result dict. With
+    include_timings (default ML_RESULT_TIMINGS) the milliseconds spent in
+    each stage are added under "timings"; use_llm=False skips the OpenAI call.
+    With deadline_ms (default ML_DEADLINE_MS) the stages degrade to stay
+    within that budget, and "degradations" lists what was cut. scope (e.g.
+    a user id) enables near-duplicate reuse among that scope's uploads.
+    img_path may also be an already decoded ImageContext
+    """
+    if include_timings is None:
+        include_timings = RESULT_TIMINGS
+    if deadline_ms is None:
+        deadline_ms = DEADLINE_MS
+
+    with telemetry.collect() as timings, deadline.start(deadline_ms) as budget:
+        with telemetry.stage("request"):
+            result = predict_with_cache(img_path, use_llm, scope)
+
+    return finish_result(result, timings, include_timings, budget)
+
+
+def in_thread(executor, fn, *args):
+    """
+    Runs fn on the executor with this task's telemetry and deadline
+    """
+    context = contextvars.copy_context()
+    return asyncio.get_running_loop().run_in_executor(executor, context.run, fn, *args)
+
+
+async def serve_prediction(message, send, executor):
+    """
+    Two-phase prediction for the worker. Validation and model run on the
+    executor; with "stream": true the result so far goes out right away as a
+    {"type": "prediction"} event. The LLM text is then awaited on the event
+    loop and the complete result follows as the {"type": "predict"} response
+    """
+    request_id = message.get("id")
+    img_path = message.get("image_path")
+    if not img_path:
+        send({"id": request_id, "type": "predict", "result": {"error": "No image path provided", "status": "error"}})
+        return
 
-        print(json.dumps(result))
+    include_timings = message.get("timings")
+    if include_timings is None:
+        include_timings = RESULT_TIMINGS
+    deadline_ms = message.get("deadline_ms")
+    if deadline_ms is None:
+        deadline_ms = DEADLINE_MS
 
+    with telemetry.collect() as timings, deadline.start(deadline_ms) as budget:
+        with telemetry.stage("request"):
+            scope = message.get("scope")
+            result, cache_key, done = await in_thread(
+                executor, prepare_prediction, img_path, True, None if scope is None else str(scope)
+            )
+            if message.get("stream"):
+                send({
+                    "id": request_id,
+                    "type": "prediction",
+                    "result": {k: v for k, v in result.items() if k != "llm_response"}
+                })
+
+            if not done:
+                try:
+                    with telemetry.stage("llm"):
+                        result = await advise_within_async(result, True, budget)
+                    await in_thread(executor, store_result, cache_key, result)
+                except Exception as e:
+                    result = failed_result(e)
+
+    send({"id": request_id, "type": "predict", "result": finish_result(result, timings, include_timings, budget)})
+
+
+def swap_model(message):
+    """
+    reload_model: load, warm up and swap in message["version"];
+    rollback_model: go back to the version served before.
+    Near-duplicate entries of the outgoing version are dropped, result
+    cache entries are keyed by version and stay for a rollback
+    """
+    if message.get("type") == "rollback_model":
+        status = registry.rollback()
+    else:
+        if not message.get("version"):
+            raise ValueError("No model version provided")
+        status = registry.activate(str(message["version"]))
+    if near_duplicates is not None:
+        near_duplicates.clear()
+    return status
+
+
+async def serve_model_swap(message, send, loader):
+    """
+    Runs swap_model on the loader thread; predictions keep being served by
+    the current version until the new one is warmed up
+    """
+    try:
+        status = await in_thread(loader, swap_model, message)
+        send({"id": message.get("id"), "type": message.get("type"), "status": "ok", "model": status})
     except Exception as e:
-        error_info = {
-            "error": "Prediction failed",
-            "details": str(e),
-            "type": str(type(e).__name__),
-            "status": "error"
-        }
-        print(json.dumps(error_info))
+        print(f"Model swap failed: {e}", file=sys.stderr)
+        send({"id": message.get("id"), "type": "error", "error": str(e)})
+
+
+def handle_worker_message(message, stats):
+    """
+    Answers one JSON-lines request from the Node worker pool, other than
+    predict (see serve_prediction) and model swaps (see serve_model_swap).
+    Supported types: health, ready, metrics
+    """
+    msg_type = message.get("type")
+    response = {"id": message.get("id"), "type": msg_type}
+
+    if msg_type in ("health", "ready"):
+        response.update({
+            "status": "ok",
+            "ready": True,
+            "pid": os.getpid(),
+            "uptime_s": round(time.monotonic() - stats["started_at"], 3),
+            "requests_served": stats["requests_served"],
+            "in_flight": stats["in_flight"],
+            "startup": stats.get("startup"),
+            "model": registry.status(),
+            "result_cache": result_cache.stats() if result_cache is not None else None,
+            "advice_cache": advice_cache.stats() if advice_cache is not None else None,
+            "near_duplicates": near_duplicates.stats() if near_duplicates is not None else None,
+            "llm": {"blocking": client.stats(), "async": async_client.stats()}
+        })
+    elif msg_type == "metrics":
+        # The Node side may pass every worker's JSON snapshot to render one merged view
+        snapshots = message.get("snapshots") or [telemetry.snapshot()]
+        if message.get("format") == "prometheus":
+            response["metrics"] = telemetry.render_prometheus(telemetry.merge(snapshots))
+        else:
+            response["metrics"] = telemetry.snapshot()
+    else:
+        response["type"] = "error"
+        response["error"] = f"Unknown message type: {msg_type}"
+
+    return response
+
+
+async def serve_worker_async():
+    # Keep stdout for the protocol only, stray prints go to stderr
+    out = sys.stdout
+    sys.stdout = sys.stderr
+    loop = asyncio.get_running_loop()
+
+    # Only the event loop thread writes, so lines never interleave
+    def send(payload):
+        out.write(json.dumps(payload) + "\n")
+        out.flush()
+
+    async def respond(message):
+        stats["in_flight"] += 1
+        try:
+            await serve_prediction(message, send, executor)
+        except Exception as e:
+            send({"id": message.get("id"), "type": "error", "error": str(e)})
+        finally:
+            stats["in_flight"] -= 1
+            stats["requests_served"] += 1
+
+    if BATCH_MAX_SIZE > 1:
+        enable_batching(BATCH_MAX_SIZE, BATCH_MAX_WAIT_MS)
+    # Validation and model; LLM calls wait on the event loop and hold no thread
+    executor = ThreadPoolExecutor(max_workers=WORKER_CONCURRENCY, thread_name_prefix="predict")
+    # Model versions load here, one at a time, next to the predictions
+    loader = ThreadPoolExecutor(max_workers=1, thread_name_prefix="model-loader")
+
+    # Blocking stdin reads stay off the event loop
+    lines = asyncio.Queue()
+
+    def read_stdin():
+        for line in sys.stdin:
+            loop.call_soon_threadsafe(lines.put_nowait, line)
+        loop.call_soon_threadsafe(lines.put_nowait, None)
+
+    threading.Thread(target=read_stdin, name="stdin", daemon=True).start()
+
+    # Process start to ready, on top of the model's own breakdown
+    startup = dict(STARTUP_TIMINGS, ready_ms=round((time.perf_counter() - _process_started) * 1000, 1))
+    stats = {"started_at": time.monotonic(), "requests_served": 0, "in_flight": 0, "startup": startup}
+
+    # The model is already loaded and warmed up at import time, so we are ready to serve
+    send({"type": "ready", "pid": os.getpid(), "startup": startup})
+    print("Prediction worker ready", file=sys.stderr)
+
+    tasks = set()
+    while True:
+        line = await lines.get()
+        if line is None:
+            break
+        line = line.strip()
+        if not line:
+            continue
+
+        try:
+            message = json.loads(line)
+        except json.JSONDecodeError as e:
+            send({"type": "error", "error": f"Invalid JSON: {e}"})
+            continue
+
+        if message.get("type") == "shutdown":
+            break
+
+        # Health checks are answered right away, even while predictions run
+        if message.get("type", "predict") == "predict":
+            task = asyncio.create_task(respond(message))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        elif message.get("type") in ("reload_model", "rollback_model"):
+            task = asyncio.create_task(serve_model_swap(message, send, loader))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        else:
+            try:
+                send(handle_worker_message(message, stats))
+            except Exception as e:
+                send({"id": message.get("id"), "type": "error", "error": str(e)})
+
+    if tasks:
+        await asyncio.gather(*tasks)
+    executor.shutdown(wait=True)
+    loader.shutdown(wait=True)
+    if advice_cache is not None:
+        advice_cache.close()
+    print("Prediction worker shutting down", file=sys.stderr)
+
+
+def serve_worker():
+    """
+    Long-lived worker mode: the model stays loaded and requests arrive as
+    JSON lines on stdin. Every response is one JSON line on stdout.
+    Predictions run concurrently so they can be micro-batched, and their
+    LLM calls overlap on one asyncio event loop (see serve_prediction).
+    reload_model / rollback_model swap the model version without a restart
+    """
+    asyncio.run(serve_worker_async())
+
+
+def main():
+    if len(sys.argv) >= 2 and sys.argv[1] == "--worker":
+        serve_worker()
+        sys.exit(0)
+
+    if len(sys.argv) < 2:
+        result = {"error": "No image path provided", "status": "error"}
+    else:
+        result = run_prediction(sys.argv[1])
+
+    print(json.dumps(result))
 
     # Force flush and exit
     sys.stdout.flush()
@@ -0,0 +1,182 @@
+"""
+Content-addressed cache of final prediction results.
+
+Entries are keyed by a hash of the uploaded image bytes plus a fingerprint of
+everything that decides the result (model weights, class names, thresholds).
+A bounded in-memory LRU sits in front of an optional SQLite file that
+survives restarts. Both tiers expire entries after a TTL.
+"""
+import os
+import sys
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+
+_CHUNK = 1 << 20
+
+
+def hash_file(path):
+    """
+    SHA-256 of a file's contents, or of every file (and its relative path)
+    under a directory such as an exported SavedModel
+    """
+    digest = hashlib.sha256()
+    if os.path.isdir(path):
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            for name in sorted(files):
+                full = os.path.join(root, name)
+                digest.update(os.path.relpath(full, path).encode())
+                digest.update(hash_file(full).encode())
+        return digest.hexdigest()
+
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(_CHUNK), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def fingerprint(*parts):
+    """
+    Short stable hash of anything JSON-serialisable
+    """
+    return hashlib.sha256(json.dumps(parts, sort_keys=True).encode()).hexdigest()[:16]
+
+
+class ResultCache:
+    """
+    LRU of result dicts with an optional on-disk tier.
+
+    max_entries bounds the memory tier, disk_max_entries the SQLite file;
+    the least recently used entries are evicted first. ttl_s of 0 keeps
+    entries until evicted. Stored and returned dicts are copies, so callers
+    can modify them freely.
+    """
+
+    def __init__(self, max_entries=256, ttl_s=86400, disk_path=None, disk_max_entries=10000):
+        self.max_entries = max_entries
+        self.ttl_s = ttl_s
+        self.disk_max_entries = disk_max_entries
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        self.counters = {
+            "memory_hits": 0,
+            "disk_hits": 0,
+            "misses": 0,
+            "stores": 0,
+            "evictions": 0,
+            "expired": 0,
+        }
+
+        if disk_path:
+            try:
+                os.makedirs(os.path.dirname(os.path.abspath(disk_path)), exist_ok=True)
+                self._db = sqlite3.connect(disk_path, check_same_thread=False, isolation_level=None)
+                self._db.execute("PRAGMA journal_mode=WAL")
+                self._db.execute(
+                    "CREATE TABLE IF NOT EXISTS results ("
+                    "key TEXT PRIMARY KEY, value TEXT NOT NULL, "
+                    "created_at REAL NOT NULL, used_at REAL NOT NULL)"
+                )
+                self._db.execute("CREATE INDEX IF NOT EXISTS results_used_at ON results (used_at)")
+            except (OSError, sqlite3.Error) as e:
+                print(f"Result cache disk tier disabled ({disk_path}): {e}", file=sys.stderr)
+                self._db = None
+
+    def _expired(self, created_at, now):
+        return self.ttl_s > 0 and now - created_at > self.ttl_s
+
+    def _remember(self, key, value, created_at):
+        self._memory[key] = (value, created_at)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+            self.counters["evictions"] += 1
+
+    def get(self, key):
+        """
+        Returns a copy of the cached result, or None
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                value, created_at = entry
+                if not self._expired(created_at, now):
+                    self._memory.move_to_end(key)
+                    self.counters["memory_hits"] += 1
+                    return json.loads(value)
+                del self._memory[key]
+                self.counters["expired"] += 1
+
+            if self._db is not None:
+                try:
+                    row = self._db.execute(
+                        "SELECT value, created_at FROM results WHERE key = ?", (key,)
+                    ).fetchone()
+                    if row is not None:
+                        value, created_at = row
+                        if not self._expired(created_at, now):
+                            self._db.execute("UPDATE results SET used_at = ? WHERE key = ?", (now, key))
+                            if self.max_entries > 0:
+                                self._remember(key, value, created_at)
+                            self.counters["disk_hits"] += 1
+                            return json.loads(value)
+                        self._db.execute("DELETE FROM results WHERE key = ?", (key,))
+                        self.counters["expired"] += 1
+                except sqlite3.Error as e:
+                    print(f"Result cache read failed: {e}", file=sys.stderr)
+
+            self.counters["misses"] += 1
+            return None
+
+    def put(self, key, result):
+        now = time.time()
+        value = json.dumps(result)
+        with self._lock:
+            if self.max_entries > 0:
+                self._remember(key, value, now)
+
+            if self._db is not None:
+                try:
+                    self._db.execute(
+                        "INSERT OR REPLACE INTO results (key, value, created_at, used_at) VALUES (?, ?, ?, ?)",
+                        (key, value, now, now)
+                    )
+                    self._prune_disk(now)
+                except sqlite3.Error as e:
+                    print(f"Result cache write failed: {e}", file=sys.stderr)
+
+            self.counters["stores"] += 1
+
+    def _prune_disk(self, now):
+        if self.ttl_s > 0:
+            self._db.execute("DELETE FROM results WHERE created_at < ?", (now - self.ttl_s,))
+        count = self._db.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+        excess = count - self.disk_max_entries
+        if excess > 0:
+            self._db.execute(
+                "DELETE FROM results WHERE key IN "
+                "(SELECT key FROM results ORDER BY used_at ASC LIMIT ?)", (excess,)
+            )
+            self.counters["evictions"] += excess
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM results")
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.counters)
+            stats["memory_entries"] = len(self._memory)
+            if self._db is not None:
+                stats["disk_entries"] = self._db.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+        lookups = stats["memory_hits"] + stats["disk_hits"] + stats["misses"]
+        stats["hit_rate"] = round((stats["memory_hits"] + stats["disk_hits"]) / lookups, 4) if lookups else 0.0
+        return stats
@@ -0,0 +1,163 @@
+"""
+Thread and core layout of one ML worker process.
+
+When several workers share a box, each one's TensorFlow, oneDNN and OpenCV
+thread pools default to every core, and throughput collapses from
+oversubscription. These settings size them per worker. Each is read from
+the environment, or else from the JSON file named by ML_RUNTIME_CONFIG
+(same keys); the environment wins.
+
+ML_TF_INTRA_THREADS   TensorFlow intra-op threads (also oneDNN/OpenMP and the
+                      TFLite interpreter). "0" keeps TensorFlow's default,
+                      "auto" uses the cores this worker may run on
+ML_TF_INTER_THREADS   TensorFlow inter-op threads ("0" = default, "auto")
+ML_CV_THREADS         OpenCV threads ("" keeps OpenCV's default, "auto")
+ML_CPU_AFFINITY       "" leaves the affinity alone, "auto" pins worker
+                      ML_WORKER_INDEX of ML_WORKER_COUNT to its own equal
+                      slice of the available cores, or an explicit list
+                      such as "0-3,6"
+ML_ONEDNN             "1" turns TensorFlow's oneDNN kernels on (default "0");
+                      compare both with bench/thread_sweep.py first
+
+apply() has to run before TensorFlow is imported; model.py calls it first
+thing. configure_tensorflow() then sizes TensorFlow's pools right after the
+import, before any op runs. bench/thread_sweep.py finds the best layout of
+workers x threads for a machine.
+"""
+import os
+import sys
+import json
+
+from validation_pool import available_cores
+
+_file_settings = None
+
+# What apply() ended up using, for health checks and the sweep tool
+applied = {}
+
+
+def setting(name, default=""):
+    """
+    One setting: the environment first, then the ML_RUNTIME_CONFIG file
+    """
+    global _file_settings
+    if name in os.environ:
+        return os.environ[name]
+
+    if _file_settings is None:
+        _file_settings = {}
+        path = os.getenv("ML_RUNTIME_CONFIG")
+        if path:
+            try:
+                with open(path) as f:
+                    _file_settings = {k: str(v) for k, v in json.load(f).items()}
+            except (OSError, ValueError) as e:
+                print(f"Could not read ML_RUNTIME_CONFIG {path}: {e}", file=sys.stderr)
+    return _file_settings.get(name, default)
+
+
+def parse_cpu_list(text):
+    """
+    "0-3,6" -> {0, 1, 2, 3, 6}
+    """
+    cpus = set()
+    for part in text.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        if "-" in part:
+            low, high = part.split("-", 1)
+            cpus.update(range(int(low), int(high) + 1))
+        else:
+            cpus.add(int(part))
+    return cpus
+
+
+def worker_cpus(index, count, cpus):
+    """
+    Equal, contiguous slice of cpus for worker index of count. With more
+    workers than cores, workers share cores round-robin
+    """
+    cpus = sorted(cpus)
+    count = max(1, count)
+    if count >= len(cpus):
+        return {cpus[index % len(cpus)]}
+    start = index * len(cpus) // count
+    end = (index + 1) * len(cpus) // count
+    return set(cpus[start:end])
+
+
+def _threads(name):
+    value = setting(name).strip().lower()
+    if value == "auto":
+        return available_cores()
+    if not value:
+        return None
+    try:
+        return max(0, int(value))
+    except ValueError:
+        print(f"Invalid {name} value: {value}, keeping the default", file=sys.stderr)
+        return None
+
+
+def _set_affinity():
+    value = setting("ML_CPU_AFFINITY").strip().lower()
+    if not value or not hasattr(os, "sched_setaffinity"):
+        return None
+
+    try:
+        if value == "auto":
+            cpus = worker_cpus(
+                int(setting("ML_WORKER_INDEX", "0")),
+                int(setting("ML_WORKER_COUNT", "1")),
+                os.sched_getaffinity(0)
+            )
+        else:
+            cpus = parse_cpu_list(value)
+        os.sched_setaffinity(0, cpus)
+    except (ValueError, OSError) as e:
+        print(f"Could not set CPU affinity {value}: {e}", file=sys.stderr)
+        return None
+    return sorted(cpus)
+
+
+def apply():
+    """
+    Sets CPU affinity, oneDNN and the OpenCV/OpenMP thread counts for this
+    process. Must run before TensorFlow is imported; later calls do nothing
+    """
+    if applied:
+        return applied
+
+    # Affinity first, so "auto" thread counts see this worker's share
+    applied["cpus"] = _set_affinity()
+    applied["onednn"] = setting("ML_ONEDNN", "0") == "1"
+    os.environ["TF_ENABLE_ONEDNN_OPTS"] = "1" if applied["onednn"] else "0"
+
+    applied["tf_intra_threads"] = _threads("ML_TF_INTRA_THREADS") or 0
+    applied["tf_inter_threads"] = _threads("ML_TF_INTER_THREADS") or 0
+    if applied["tf_intra_threads"]:
+        # oneDNN and MKL run on OpenMP, which reads these at start-up
+        os.environ.setdefault("OMP_NUM_THREADS", str(applied["tf_intra_threads"]))
+        os.environ.setdefault("MKL_NUM_THREADS", str(applied["tf_intra_threads"]))
+
+    applied["cv_threads"] = _threads("ML_CV_THREADS")
+    if applied["cv_threads"] is not None:
+        import cv2
+        cv2.setNumThreads(applied["cv_threads"])
+
+    return applied
+
+
+def configure_tensorflow(tf):
+    """
+    Applies the TensorFlow pool sizes; call right after importing it
+    """
+    try:
+        if applied.get("tf_intra_threads"):
+            tf.config.threading.set_intra_op_parallelism_threads(applied["tf_intra_threads"])
+        if applied.get("tf_inter_threads"):
+            tf.config.threading.set_inter_op_parallelism_threads(applied["tf_inter_threads"])
+    except RuntimeError as e:
+        # TensorFlow was already initialised by someone else
+        print(f"TensorFlow thread settings not applied: {e}", file=sys.stderr)
@@ -0,0 +1,416 @@
+"""
+Shared-memory ring of decoded images, for handing uploads to inference
+worker processes without pickling or copying pixels.
+
+A dispatcher decodes each image once and writes, into a free slot, the
+model tensor (IMG_SIZE float32, ready for the forward pass) and a validation
+proxy (uint8 RGB, ImageContext.validation_view(proxy_side), stored if it
+has no more than proxy_side ** 2 pixels). It then passes the slot's
+(index, generation) handle to a worker, which reads both as NumPy views of
+the shared segment and frees the slot when it is done:
+
+    ring = SlotRing.create(slots=16)                  # dispatcher
+    handle = ring.put_image("leaf.jpg")
+
+    ring = SlotRing.attach(name)                      # worker
+    with ring.open(handle) as slot:
+        result = run_prediction(slot.image_context())
+
+Slot lifecycle: FREE -> WRITING -> READY -> READING -> FREE. Only the
+creating process allocates slots, so FREE -> WRITING needs no lock, and
+WRITING -> READY is made by the dispatcher alone. A READY slot can be taken
+by a worker (open) or reclaimed by the dispatcher at the same time, so
+open(), release() and reclaim() re-check and change a slot's state under
+that slot's lock: a byte-range lock on a file next to the segment, plus a
+lock between the threads of one process (record locks don't exclude them).
+When no slot is free, put_image() blocks (backpressure) until a worker
+releases one, raising RingFull after the timeout. While waiting it
+reclaims slots whose reader process has died, and READY slots nobody
+opened within stale_after_s. The segment and its lock file are removed
+when the creator closes the ring or exits; attached processes never remove
+them.
+"""
+import os
+import time
+import fcntl
+import atexit
+import tempfile
+import threading
+import contextlib
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from image_context import ImageContext
+
+# Must match model.IMG_SIZE; workers check this when they attach
+MODEL_SIZE = (128, 128)
+PROXY_SIDE = 512
+
+FREE, WRITING, READY, READING = 0, 1, 2, 3
+STATE_NAMES = {FREE: "free", WRITING: "writing", READY: "ready", READING: "reading"}
+
+_MAGIC = 0x4746524B52494E47  # "GFRKRING"
+_ALIGN = 64
+_HEADER_FIELDS = 8
+# Slot table columns
+_STATE, _GENERATION, _OWNER, _SINCE_US, _PROXY_H, _PROXY_W, _FULL_W, _FULL_H = range(8)
+
+
+class RingFull(TimeoutError):
+    """No slot was freed before the timeout"""
+
+
+class StaleHandle(RuntimeError):
+    """The slot was reclaimed or reused since the handle was issued"""
+
+
+# Record locks belong to the process, so threads (and rings attached twice
+# in one process) take this first
+_thread_lock = threading.Lock()
+
+
+def _lock_path(name):
+    return os.path.join(tempfile.gettempdir(), f"{name.lstrip('/')}.slots.lock")
+
+
+def _aligned(size):
+    return (size + _ALIGN - 1) // _ALIGN * _ALIGN
+
+
+def _now_us():
+    return time.time_ns() // 1000
+
+
+def _pid_alive(pid):
+    if pid <= 0:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _attach_segment(name):
+    """
+    Opens an existing segment without registering it with this process's
+    resource tracker, which would otherwise unlink it when a worker exits
+    """
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        pass
+
+    # Python < 3.13 has no track argument. Skip the registration instead of
+    # undoing it: spawned workers share the creator's tracker, and an
+    # unregister from here would drop the creator's entry
+    from multiprocessing import resource_tracker
+    register = resource_tracker.register
+    resource_tracker.register = lambda name, rtype: rtype == "shared_memory" or register(name, rtype)
+    try:
+        return shared_memory.SharedMemory(name=name)
+    finally:
+        resource_tracker.register = register
+
+
+class Slot:
+    """
+    A READING slot held by this process. model and proxy are views into the
+    shared segment and must not be used after release(). proxy is None when
+    the image's validation view was too large for the slot
+    """
+
+    def __init__(self, ring, index, generation):
+        self.ring = ring
+        self.index = index
+        self.generation = generation
+        row = ring._table[index]
+        self.model = ring._model[index]
+        height, width = int(row[_PROXY_H]), int(row[_PROXY_W])
+        self.proxy = ring._proxy[index][:height * width * 3].reshape(height, width, 3) if height else None
+        self.full_size = (int(row[_FULL_W]), int(row[_FULL_H]))
+
+    def image_context(self, path=None):
+        """
+        ImageContext over the slot's pixels; path is only used in messages,
+        unless the slot has no proxy: then validation decodes the file
+        """
+        if self.proxy is None:
+            ctx = ImageContext.from_path(path)
+            ctx._cache[("model_tensor", tuple(self.ring.model_size))] = self.model[np.newaxis]
+            return ctx
+        return ImageContext.from_shared(
+            self.proxy, self.full_size, {self.ring.model_size: self.model[np.newaxis]}, path=path
+        )
+
+    def release(self):
+        if self.ring is not None:
+            self.ring.release(self.index, self.generation)
+            self.ring = self.model = self.proxy = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+class SlotRing:
+    """
+    Fixed-size slots of decoded images in one shared-memory segment
+    """
+
+    def __init__(self, segment, owner):
+        self._segment = segment
+        self.name = segment.name
+        self.owner = owner
+
+        header = np.ndarray((_HEADER_FIELDS,), dtype=np.int64, buffer=segment.buf)
+        if header[0] != _MAGIC:
+            raise ValueError(f"Shared memory segment {segment.name} is not a slot ring")
+        self.slots, model_h, model_w, self.proxy_side = (int(v) for v in header[1:5])
+        self.model_size = (model_h, model_w)
+
+        model_shape = (model_h, model_w, 3)
+        proxy_bytes = self.proxy_side * self.proxy_side * 3
+        table_bytes = _aligned(self.slots * 8 * 8)
+        slot_bytes = _aligned(4 * int(np.prod(model_shape))) + _aligned(proxy_bytes)
+
+        offset = _aligned(_HEADER_FIELDS * 8)
+        self._table = np.ndarray((self.slots, 8), dtype=np.int64, buffer=segment.buf, offset=offset)
+        offset += table_bytes
+        # Per slot: the model tensor, then the proxy's bytes (any shape with
+        # at most proxy_side ** 2 pixels). Strided views over the whole data
+        # area, so slot i is just [i] on each
+        self._model = np.ndarray(
+            (self.slots,) + model_shape, dtype=np.float32, buffer=segment.buf, offset=offset,
+            strides=(slot_bytes, model_w * 3 * 4, 3 * 4, 4)
+        )
+        self._proxy = np.ndarray(
+            (self.slots, proxy_bytes), dtype=np.uint8, buffer=segment.buf,
+            offset=offset + _aligned(4 * int(np.prod(model_shape))),
+            strides=(slot_bytes, 1)
+        )
+
+        self._lock_fd = os.open(_lock_path(self.name), os.O_RDWR | (os.O_CREAT if owner else 0), 0o600)
+
+        self._next = 0
+        self.counters = {"written": 0, "released": 0, "full_waits": 0, "reclaimed_dead": 0, "reclaimed_stale": 0}
+        if owner:
+            atexit.register(self.close)
+
+    @classmethod
+    def create(cls, slots, model_size=MODEL_SIZE, proxy_side=PROXY_SIDE):
+        """
+        Creates a new ring; the calling process becomes its dispatcher
+        """
+        if slots < 1:
+            raise ValueError("slots must be at least 1")
+        model_h, model_w = model_size
+        slot_bytes = _aligned(4 * model_h * model_w * 3) + _aligned(proxy_side * proxy_side * 3)
+        size = _aligned(_HEADER_FIELDS * 8) + _aligned(slots * 8 * 8) + slots * slot_bytes
+
+        segment = shared_memory.SharedMemory(create=True, size=size)
+        header = np.ndarray((_HEADER_FIELDS,), dtype=np.int64, buffer=segment.buf)
+        header[:] = [_MAGIC, slots, model_h, model_w, proxy_side, os.getpid(), 0, 0]
+        table = np.ndarray((slots, 8), dtype=np.int64, buffer=segment.buf, offset=_aligned(_HEADER_FIELDS * 8))
+        table[:] = 0
+        del header, table
+        return cls(segment, owner=True)
+
+    @classmethod
+    def attach(cls, name):
+        """
+        Opens a ring created by another process
+        """
+        return cls(_attach_segment(name), owner=False)
+
+    @contextlib.contextmanager
+    def _locked(self, index):
+        """
+        Holds slot index against every other process and thread
+        """
+        with _thread_lock:
+            fcntl.lockf(self._lock_fd, fcntl.LOCK_EX, 1, index)
+            try:
+                yield
+            finally:
+                fcntl.lockf(self._lock_fd, fcntl.LOCK_UN, 1, index)
+
+    # Dispatcher side
+
+    def acquire(self, timeout=None, stale_after_s=None):
+        """
+        Claims a free slot and returns its index, waiting while the ring is
+        full. Raises RingFull if none frees up within timeout seconds
+        """
+        if not self.owner:
+            raise RuntimeError("Only the process that created the ring allocates slots")
+
+        deadline = None if timeout is None else time.monotonic() + timeout
+        delay = 0.0005
+        waited = False
+        while True:
+            for step in range(self.slots):
+                index = (self._next + step) % self.slots
+                if self._table[index, _STATE] == FREE:
+                    self._table[index, _STATE] = WRITING
+                    self._table[index, _SINCE_US] = _now_us()
+                    self._next = (index + 1) % self.slots
+                    return index
+
+            if not waited:
+                self.counters["full_waits"] += 1
+                waited = True
+            if self.reclaim(stale_after_s):
+                continue
+            if deadline is not None and time.monotonic() >= deadline:
+                raise RingFull(f"No free slot in {self.slots} after {timeout}s")
+            time.sleep(delay)
+            delay = min(delay * 2, 0.01)
+
+    def publish(self, index):
+        """
+        Marks a written slot READY and returns its handle
+        """
+        row = self._table[index]
+        row[_GENERATION] += 1
+        row[_OWNER] = 0
+        row[_SINCE_US] = _now_us()
+        row[_STATE] = READY
+        self.counters["written"] += 1
+        return (index, int(row[_GENERATION]))
+
+    def abandon(self, index):
+        """
+        Returns a slot that was acquired but never published
+        """
+        self._table[index, _STATE] = FREE
+
+    def put_image(self, img, timeout=None, stale_after_s=None):
+        """
+        Decodes an image (path or ImageContext) once into a free slot and
+        returns its (index, generation) handle
+        """
+        ctx = img if isinstance(img, ImageContext) else ImageContext.from_path(img)
+        # Decode before taking a slot so a broken file never holds one
+        tensor = ctx.model_tensor(self.model_size)[0]
+        proxy = ctx.validation_view(self.proxy_side).rgb
+        full_w, full_h = ctx.full_size
+        if proxy.shape[0] * proxy.shape[1] > self.proxy_side ** 2:
+            # Elongated images keep a larger view than fits; the reader
+            # decodes those from the file
+            proxy = None
+
+        index = self.acquire(timeout, stale_after_s)
+        try:
+            height, width = proxy.shape[:2] if proxy is not None else (0, 0)
+            self._model[index] = tensor
+            if proxy is not None:
+                self._proxy[index, :height * width * 3] = proxy.reshape(-1)
+            self._table[index, _PROXY_H:_FULL_H + 1] = [height, width, full_w, full_h]
+        except BaseException:
+            self.abandon(index)
+            raise
+        return self.publish(index)
+
+    def reclaim(self, stale_after_s=None):
+        """
+        Frees slots held by dead reader processes and, with stale_after_s,
+        READY slots nobody opened in that many seconds. Returns the count
+        """
+        freed = 0
+        now = _now_us()
+        for index in range(self.slots):
+            row = self._table[index]
+            if self._reclaimable(row, now, stale_after_s) is None:
+                continue
+            with self._locked(index):
+                # A worker may have opened it meanwhile
+                reason = self._reclaimable(row, now, stale_after_s)
+                if reason is None:
+                    continue
+                self.counters[reason] += 1
+                row[_GENERATION] += 1
+                row[_OWNER] = 0
+                row[_STATE] = FREE
+                freed += 1
+        return freed
+
+    @staticmethod
+    def _reclaimable(row, now, stale_after_s):
+        state = row[_STATE]
+        if state == READING and not _pid_alive(int(row[_OWNER])):
+            return "reclaimed_dead"
+        if state == READY and stale_after_s is not None and now - row[_SINCE_US] > stale_after_s * 1e6:
+            return "reclaimed_stale"
+        return None
+
+    # Worker side
+
+    def open(self, handle):
+        """
+        Takes a READY slot for reading; use as a context manager, or call
+        release() on the returned Slot
+        """
+        index, generation = handle
+        row = self._table[index]
+        with self._locked(index):
+            if row[_STATE] != READY or row[_GENERATION] != generation:
+                raise StaleHandle(f"Slot {index} generation {generation} is no longer available")
+            row[_OWNER] = os.getpid()
+            row[_SINCE_US] = _now_us()
+            row[_STATE] = READING
+        return Slot(self, index, generation)
+
+    def release(self, index, generation):
+        row = self._table[index]
+        with self._locked(index):
+            # A reclaimed slot may already belong to someone else
+            if row[_GENERATION] == generation and row[_STATE] == READING:
+                row[_OWNER] = 0
+                row[_STATE] = FREE
+                self.counters["released"] += 1
+
+    def stats(self):
+        states = self._table[:, _STATE]
+        return {
+            "name": self.name,
+            "slots": self.slots,
+            "bytes": self._segment.size,
+            **{STATE_NAMES[s]: int((states == s).sum()) for s in STATE_NAMES},
+            **self.counters,
+        }
+
+    def close(self):
+        """
+        Drops this process's mapping; the creator also unlinks the segment
+        """
+        if self._segment is None:
+            return
+        # The views must go before the mapping can be closed
+        self._table = self._model = self._proxy = None
+        segment, self._segment = self._segment, None
+        try:
+            segment.close()
+        except BufferError:
+            # A caller still holds a view; the mapping goes away with the process
+            pass
+        with _thread_lock:
+            # Closing any descriptor of the file drops this process's locks on it
+            os.close(self._lock_fd)
+        if self.owner:
+            for unlink in (segment.unlink, lambda: os.unlink(_lock_path(self.name))):
+                try:
+                    unlink()
+                except FileNotFoundError:
+                    pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,166 @@
+"""
+Stage timers and counters for the prediction pipeline.
+
+    with telemetry.stage("model"):
+        preds = run_model(img_array)
+
+Every stage duration goes into a per-process histogram, and into the timings
+of the request being served (collect() / timings()), which predict.py can
+attach to the result. snapshot() and render_prometheus() expose the
+histograms of a long-running worker.
+
+With ML_TELEMETRY=0 stage() returns a shared no-op context manager and
+record()/increment() return immediately, so instrumented code costs one
+function call per stage.
+"""
+import os
+import time
+import threading
+import contextvars
+from contextlib import contextmanager, nullcontext
+
+ENABLED = os.getenv("ML_TELEMETRY", "1") != "0"
+
+# Histogram bucket upper bounds in milliseconds
+BUCKETS_MS = (1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000)
+
+_NULL = nullcontext()
+_lock = threading.Lock()
+_histograms = {}
+_counters = {}
+_started_at = time.time()
+
+# Timings of the request being served on this thread (None outside one)
+_request = contextvars.ContextVar("telemetry_request", default=None)
+
+
+def record(name, ms):
+    """
+    Adds one duration (in ms) to the stage's histogram and the current request
+    """
+    if not ENABLED:
+        return
+
+    with _lock:
+        hist = _histograms.get(name)
+        if hist is None:
+            hist = _histograms[name] = {"count": 0, "sum": 0.0, "buckets": [0] * (len(BUCKETS_MS) + 1)}
+        hist["count"] += 1
+        hist["sum"] += ms
+        for i, upper in enumerate(BUCKETS_MS):
+            if ms <= upper:
+                hist["buckets"][i] += 1
+                break
+        else:
+            hist["buckets"][-1] += 1
+
+    timings = _request.get()
+    if timings is not None:
+        timings[name] = round(timings.get(name, 0.0) + ms, 3)
+
+
+def increment(name, value=1):
+    if not ENABLED:
+        return
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + value
+
+
+@contextmanager
+def _timed(name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(name, (time.perf_counter() - start) * 1000)
+
+
+def stage(name):
+    """
+    Context manager timing one stage
+    """
+    if not ENABLED:
+        return _NULL
+    return _timed(name)
+
+
+@contextmanager
+def collect():
+    """
+    Collects the stage timings of one request; yields the dict they go into
+    """
+    if not ENABLED:
+        yield None
+        return
+    timings = {}
+    token = _request.set(timings)
+    try:
+        yield timings
+    finally:
+        _request.reset(token)
+
+
+def snapshot():
+    """
+    JSON-serialisable copy of all histograms and counters
+    """
+    with _lock:
+        return {
+            "enabled": ENABLED,
+            "pid": os.getpid(),
+            "uptime_s": round(time.time() - _started_at, 3),
+            "buckets_ms": list(BUCKETS_MS),
+            "stages": {
+                name: {"count": h["count"], "sum_ms": round(h["sum"], 3), "buckets": list(h["buckets"])}
+                for name, h in _histograms.items()
+            },
+            "counters": dict(_counters),
+        }
+
+
+def merge(snapshots):
+    """
+    Sums snapshots of several workers into one
+    """
+    merged = {"stages": {}, "counters": {}, "buckets_ms": list(BUCKETS_MS)}
+    for snap in snapshots:
+        for name, h in snap.get("stages", {}).items():
+            total = merged["stages"].setdefault(
+                name, {"count": 0, "sum_ms": 0.0, "buckets": [0] * len(h["buckets"])}
+            )
+            total["count"] += h["count"]
+            total["sum_ms"] += h["sum_ms"]
+            total["buckets"] = [a + b for a, b in zip(total["buckets"], h["buckets"])]
+        for name, value in snap.get("counters", {}).items():
+            merged["counters"][name] = merged["counters"].get(name, 0) + value
+    return merged
+
+
+def _label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def render_prometheus(snap=None):
+    """
+    Prometheus text exposition of a snapshot (this process by default)
+    """
+    snap = snap or snapshot()
+    bounds = snap.get("buckets_ms", BUCKETS_MS)
+    lines = [
+        "# HELP growfrika_ml_stage_duration_ms Duration of prediction pipeline stages",
+        "# TYPE growfrika_ml_stage_duration_ms histogram",
+    ]
+    for name, h in sorted(snap["stages"].items()):
+        label = _label(name)
+        cumulative = 0
+        for upper, count in zip(list(bounds) + ["+Inf"], h["buckets"]):
+            cumulative += count
+            lines.append(f'growfrika_ml_stage_duration_ms_bucket{{stage="{label}",le="{upper}"}} {cumulative}')
+        lines.append(f'growfrika_ml_stage_duration_ms_sum{{stage="{label}"}} {h["sum_ms"]:.3f}')
+        lines.append(f'growfrika_ml_stage_duration_ms_count{{stage="{label}"}} {h["count"]}')
+
+    lines.append("# HELP growfrika_ml_events_total Pipeline event counters")
+    lines.append("# TYPE growfrika_ml_events_total counter")
+    for name, value in sorted(snap["counters"].items()):
+        lines.append(f'growfrika_ml_events_total{{event="{_label(name)}"}} {value}')
+    return "\n".join(lines) + "\n"
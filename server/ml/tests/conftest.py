@@ -0,0 +1,38 @@
+"""
+The ml/ scripts import each other by bare name, like when run from ml/.
+The LLM is stubbed (llm_stub) and nothing is cached on disk, so the
+suite runs offline and leaves no files behind.
+"""
+import os
+import sys
+import threading
+from http.server import ThreadingHTTPServer
+
+import pytest
+
+ML_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ML_DIR)
+# For corpus
+sys.path.insert(0, os.path.join(ML_DIR, "bench"))
+
+os.environ.setdefault("TF_CPP_MIN_LOG_LEVEL", "2")
+os.environ["ML_LLM_STUB"] = "1"
+os.environ["ML_RESULT_CACHE_SIZE"] = "0"
+os.environ["ML_RESULT_CACHE_PATH"] = ""
+os.environ["ML_ADVICE_CACHE_PATH"] = ""
+os.environ["ML_NEAR_DUP_ENTRIES"] = "0"
+
+from fake_openai import FakeOpenAIHandler
+
+
+@pytest.fixture
+def fake_openai():
+    """
+    Base URL of a local fake_openai server, with short latencies
+    """
+    handler = type("Handler", (FakeOpenAIHandler,), {"first_token_ms": 50.0, "token_ms": 10.0})
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_port}/v1"
+    server.shutdown()
+    server.server_close()
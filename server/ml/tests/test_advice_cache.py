@@ -0,0 +1,131 @@
+import os
+import json
+import time
+import asyncio
+
+import advice_cache
+from advice_cache import AdviceCache, PLACEHOLDER
+from llm_stub import StubClient, AsyncStubClient
+
+PROMPT = f"Diagnosis: rust at {PLACEHOLDER} confidence. Advise the farmer."
+KEY = AdviceCache.key("success", "rust", 0.8)
+
+
+def templates(n):
+    return [f"Variant {i}: rust found with {PLACEHOLDER} confidence." for i in range(n)]
+
+
+def make_cache(stub, **kwargs):
+    return AdviceCache(stub, "You are an agronomist.", **dict({"variants": 3, "ttl_s": 60, "max_age_s": 600}, **kwargs))
+
+
+def age(cache, seconds):
+    for variant in cache._entries[KEY]:
+        variant["created_at"] -= seconds
+
+
+def test_miss_generates_one_text_only():
+    stub = StubClient(replies=templates(3))
+    cache = make_cache(stub)
+
+    assert cache.respond(KEY, PROMPT, "83%") == "Variant 0: rust found with 83% confidence."
+    cache.close()
+
+    # A one-shot run pays for the text it serves, not for the other variants
+    assert len(stub.calls) == 1
+    assert cache.stats()["misses"] == 1
+
+
+def test_hits_top_up_and_rotate_variants():
+    stub = StubClient(replies=templates(3))
+    cache = make_cache(stub)
+    cache.respond(KEY, PROMPT, "83%")
+
+    cache.respond(KEY, PROMPT, "84%")
+    cache.close()
+    assert len(stub.calls) == 3
+    assert cache.stats()["variants"] == 3
+
+    served = {cache.respond(KEY, PROMPT, "85%") for _ in range(3)}
+    assert served == {f"Variant {i}: rust found with 85% confidence." for i in range(3)}
+    assert len(stub.calls) == 3
+
+
+def test_stale_text_is_served_while_it_is_replaced():
+    stub = StubClient(replies=templates(4))
+    cache = make_cache(stub, variants=1)
+    cache.respond(KEY, PROMPT, "83%")
+    age(cache, 120)
+
+    assert cache.respond(KEY, PROMPT, "83%") == "Variant 0: rust found with 83% confidence."
+    cache.close()
+    assert len(stub.calls) == 2
+    assert [v["text"] for v in cache._entries[KEY]] == [templates(4)[1]]
+
+
+def test_text_past_max_age_is_never_served():
+    stub = StubClient(replies=templates(4))
+    cache = make_cache(stub, variants=1)
+    cache.respond(KEY, PROMPT, "83%")
+    age(cache, 900)
+
+    assert cache.respond(KEY, PROMPT, "83%") == "Variant 1: rust found with 83% confidence."
+    assert cache.stats()["misses"] == 2
+
+
+def test_text_with_a_literal_percentage_is_not_cached():
+    stub = StubClient(replies=["Rust, 90% sure.", "Rust at 83% confidence, spray copper."])
+    cache = make_cache(stub)
+
+    assert cache.respond(KEY, PROMPT, "83%") == "Rust at 83% confidence, spray copper."
+    assert cache.stats()["rejected"] == 1
+    assert cache.stats()["variants"] == 0
+    # The fallback asked with the number filled in
+    assert PLACEHOLDER not in stub.calls[-1]["messages"][-1]["content"]
+
+
+def test_loading_drops_texts_past_max_age(tmp_path):
+    path = tmp_path / "advice.json"
+    cache = make_cache(StubClient(replies=templates(1)), path=str(path))
+    cache.respond(KEY, PROMPT, "83%")
+    cache.close()
+    assert make_cache(StubClient(), path=str(path)).stats()["variants"] == 1
+
+    entries = json.loads(path.read_text())
+    entries[KEY][0]["created_at"] -= 900
+    path.write_text(json.dumps(entries))
+    assert make_cache(StubClient(), path=str(path)).stats()["variants"] == 0
+
+
+def test_async_miss_writes_the_file_off_the_event_loop(tmp_path, monkeypatch):
+    path = tmp_path / "advice.json"
+    cache = make_cache(StubClient(), path=str(path), async_client=AsyncStubClient(replies=templates(1)))
+    real_replace = os.replace
+
+    def slow_replace(src, dst):
+        time.sleep(0.3)
+        real_replace(src, dst)
+
+    monkeypatch.setattr(advice_cache.os, "replace", slow_replace)
+
+    async def main():
+        ticks = []
+
+        async def tick():
+            while True:
+                ticks.append(time.perf_counter())
+                await asyncio.sleep(0.01)
+
+        ticker = asyncio.create_task(tick())
+        await asyncio.sleep(0.02)
+        text = await cache.respond_async(KEY, PROMPT, "83%")
+        await asyncio.sleep(0.02)
+        ticker.cancel()
+        return text, max(b - a for a, b in zip(ticks, ticks[1:]))
+
+    text, longest_gap = asyncio.run(main())
+
+    assert text == "Variant 0: rust found with 83% confidence."
+    # The loop kept running while the slow write was in progress
+    assert longest_gap < 0.15
+    assert KEY in json.loads(path.read_text())
@@ -0,0 +1,138 @@
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pytest
+
+from batching import MicroBatcher
+
+
+class Model:
+    """
+    Returns each image's first pixel value as its row, and records batch sizes
+    """
+
+    def __init__(self, delay_s=0.0):
+        self.delay_s = delay_s
+        self.batches = []
+        self.lock = threading.Lock()
+
+    def __call__(self, batch):
+        with self.lock:
+            self.batches.append(len(batch))
+        time.sleep(self.delay_s)
+        return batch[:, 0, 0, :1] * np.ones((1, 3))
+
+
+def image(value):
+    return np.full((4, 4, 3), value, dtype=np.float32)
+
+
+def test_each_caller_gets_its_own_row():
+    model = Model()
+    batcher = MicroBatcher(model, max_batch_size=8, max_wait_ms=50)
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        rows = list(pool.map(lambda v: batcher.predict(image(v)), range(8)))
+    batcher.close()
+
+    assert [row[0] for row in rows] == list(range(8))
+    assert sum(model.batches) == 8
+    assert len(model.batches) < 8
+
+
+def test_full_batch_flushes_before_the_wait():
+    model = Model()
+    batcher = MicroBatcher(model, max_batch_size=4, max_wait_ms=10000)
+
+    started = time.perf_counter()
+    futures = [batcher.submit(image(v)) for v in range(4)]
+    [future.result(timeout=5) for future in futures]
+    batcher.close()
+
+    assert time.perf_counter() - started < 1
+    assert model.batches == [4]
+
+
+def test_lone_request_waits_at_most_max_wait():
+    model = Model()
+    batcher = MicroBatcher(model, max_batch_size=8, max_wait_ms=50)
+
+    started = time.perf_counter()
+    assert batcher.predict(image(3))[0] == 3
+    elapsed = time.perf_counter() - started
+    batcher.close()
+
+    assert 0.04 <= elapsed < 0.5
+    assert model.batches == [1]
+
+
+def test_failed_forward_pass_fails_its_batch_only():
+    calls = []
+
+    def flaky(batch):
+        calls.append(len(batch))
+        if len(calls) == 1:
+            raise RuntimeError("out of memory")
+        return batch[:, 0, 0, :1]
+
+    batcher = MicroBatcher(flaky, max_batch_size=2, max_wait_ms=1000)
+    first = [batcher.submit(image(v)) for v in range(2)]
+    second = [batcher.submit(image(v)) for v in range(2)]
+
+    for future in first:
+        with pytest.raises(RuntimeError, match="out of memory"):
+            future.result(timeout=5)
+    assert [future.result(timeout=5)[0] for future in second] == [0, 1]
+    batcher.close()
+
+
+def test_close_finishes_queued_work_and_refuses_more():
+    model = Model(delay_s=0.05)
+    batcher = MicroBatcher(model, max_batch_size=2, max_wait_ms=0)
+    futures = [batcher.submit(image(v)) for v in range(5)]
+
+    batcher.close()
+
+    assert [future.result(timeout=0)[0] for future in futures] == list(range(5))
+    with pytest.raises(RuntimeError):
+        batcher.submit(image(0))
+
+
+def test_invalid_batch_size():
+    with pytest.raises(ValueError):
+        MicroBatcher(Model(), max_batch_size=0)
+
+
+def test_batched_predictions_match_single_ones(tmp_path):
+    import cv2
+    import corpus
+    import model
+    from model_registry import ModelVersion
+
+    rng = np.random.default_rng(11)
+    paths = []
+    for i in range(6):
+        path = str(tmp_path / f"leaf_{i}.jpg")
+        cv2.imwrite(path, corpus.make_leaf(640, 480, rng, disease=["rust", "phoma", None][i % 3]))
+        paths.append(path)
+
+    active = model.registry.active
+    batched = ModelVersion(active.manifest, active.backend_name, active.backend, {})
+    batched.enable_batching(max_batch_size=6, max_wait_ms=200)
+    calls = []
+    forward = batched.batcher.predict_fn
+    batched.batcher.predict_fn = lambda batch: calls.append(len(batch)) or forward(batch)
+
+    single = [model.predict_image(path, version=active) for path in paths]
+    with ThreadPoolExecutor(max_workers=6) as pool:
+        together = list(pool.map(lambda path: model.predict_image(path, version=batched), paths))
+    batched.close()
+
+    assert max(calls) > 1
+    for a, b in zip(single, together):
+        assert b["status"] == a["status"]
+        assert b["predicted_class"] == a["predicted_class"]
+        assert b["confidence"] == pytest.approx(a["confidence"], abs=1e-4)
+        assert b["all_probabilities"] == pytest.approx(a["all_probabilities"], abs=1e-4)
@@ -0,0 +1,130 @@
+from chat import ContextManager, SUMMARY_PREFIX, message_tokens
+from llm_stub import StubClient
+
+SYSTEM = {"role": "system", "content": "You are an agronomy assistant. Diagnosis: rust, 91% confidence."}
+
+
+def turn(i, words=40):
+    role = "user" if i % 2 == 0 else "assistant"
+    return {"role": role, "content": f"Message {i}: " + "leaf " * words}
+
+
+def conversation(turns):
+    return [SYSTEM] + [turn(i) for i in range(turns)]
+
+
+def manager(client, budget=400):
+    return ContextManager(client, budget_tokens=budget, summary_tokens=60)
+
+
+def tokens(messages):
+    return sum(message_tokens(m) for m in messages)
+
+
+def test_short_conversation_is_sent_as_is():
+    stub = StubClient()
+    messages = conversation(2)
+
+    context, info = manager(stub).build(messages, "c1")
+
+    assert context == messages
+    assert info["tokens_sent"] == info["tokens_full"]
+    assert stub.calls == []
+
+
+def test_long_conversation_fits_the_budget():
+    stub = StubClient(replies=["The farmer has rust and asked about copper sprays."])
+    messages = conversation(20)
+
+    context, info = manager(stub).build(messages, "c1")
+
+    assert info["tokens_full"] > 400
+    assert info["tokens_sent"] <= 400 + 60
+    assert context[0] == SYSTEM
+    assert context[1]["content"] == SUMMARY_PREFIX + "The farmer has rust and asked about copper sprays."
+    assert context[-1] == messages[-1]
+    assert len(stub.calls) == 1
+
+
+def test_summary_is_reused_on_the_next_turns():
+    stub = StubClient(replies=["Summary."])
+    contexts = manager(stub)
+    contexts.build(conversation(20), "c1")
+
+    context, _ = contexts.build(conversation(21), "c1")
+
+    assert len(stub.calls) == 1
+    assert context[-1] == turn(20)
+    assert contexts.stats()["summary_cache_hits"] == 1
+
+
+def test_repeated_short_answers_are_always_sent():
+    stub = StubClient(replies=["Summary."])
+    contexts = manager(stub, budget=150)
+    messages = [SYSTEM]
+
+    for i in range(30):
+        messages.append({"role": "user", "content": "yes"})
+        context, _ = contexts.build(messages, "c1")
+        assert context[-1] is messages[-1]
+        messages.append({"role": "assistant", "content": f"Answer {i}: " + "spray " * 10})
+
+    assert tokens(context) <= 150 + 60
+
+
+def test_dropping_old_turns_does_not_refold_them():
+    stub = StubClient(replies=["Summary."])
+    contexts = manager(stub)
+    messages = conversation(20)
+    contexts.build(messages, "c1")
+
+    # The caller trims the history it keeps; the summary already covers it
+    trimmed = [SYSTEM] + messages[5:] + [turn(20)]
+    context, _ = contexts.build(trimmed, "c1")
+
+    assert len(stub.calls) == 1
+    assert context[-1] == turn(20)
+
+
+def test_failed_summary_sends_the_newest_turns():
+    class Failing(StubClient):
+        def _record(self, model, messages, kwargs):
+            raise ConnectionError("upstream down")
+
+    contexts = manager(Failing())
+    messages = conversation(20)
+
+    context, info = contexts.build(messages, "c1")
+
+    assert context[0] == SYSTEM
+    assert not any(m["content"].startswith(SUMMARY_PREFIX) for m in context)
+    assert context[-1] == messages[-1]
+    assert info["tokens_sent"] <= 400
+    assert contexts.stats()["summary_errors"] == 1
+
+
+def test_conversations_without_an_id_share_nothing():
+    stub = StubClient(replies=["Alice sprays copper."])
+    contexts = manager(stub)
+    alice = conversation(20)
+    bob = [SYSTEM] + [{"role": "user", "content": "Bob: " + "leaf " * 40}]
+
+    context, info = contexts.build(alice)
+    contexts.build(bob + [turn(i) for i in range(1, 20)])
+
+    assert stub.calls == []
+    assert contexts.stats()["conversations"] == 0
+    assert not any(m["content"].startswith(SUMMARY_PREFIX) for m in context)
+    assert context[-1] == alice[-1]
+    assert info["tokens_sent"] <= 400
+
+
+def test_summaries_are_kept_per_conversation_id():
+    stub = StubClient(replies=["Alice sprays copper.", "Bob prunes."])
+    contexts = manager(stub)
+
+    alice, _ = contexts.build(conversation(20), "alice")
+    bob, _ = contexts.build(conversation(20), "bob")
+
+    assert alice[1]["content"] == SUMMARY_PREFIX + "Alice sprays copper."
+    assert bob[1]["content"] == SUMMARY_PREFIX + "Bob prunes."
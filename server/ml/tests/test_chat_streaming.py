@@ -0,0 +1,75 @@
+import os
+import sys
+import json
+import time
+import subprocess
+
+import pytest
+from openai import OpenAI
+
+import chat
+from llm_client import SingleFlightClient
+
+ML_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CONVERSATION = [{"role": "user", "content": "How often should I spray copper on rust?"}]
+
+
+@pytest.fixture
+def worker(fake_openai):
+    proc = subprocess.Popen(
+        [sys.executable, os.path.join(ML_DIR, "chat.py"), "--worker"],
+        cwd=ML_DIR, text=True, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+        env=dict(os.environ, OPENAI_BASE_URL=fake_openai, OPENAI_API_KEY="fake")
+    )
+    assert json.loads(proc.stdout.readline())["type"] == "ready"
+    yield proc
+    proc.stdin.write(json.dumps({"type": "shutdown"}) + "\n")
+    proc.stdin.close()
+    proc.wait(timeout=30)
+
+
+def converse(worker, **fields):
+    """
+    Sends one chat request; returns every line answering it with its arrival time
+    """
+    worker.stdin.write(json.dumps({"id": "c1", "type": "chat", "messages": CONVERSATION, **fields}) + "\n")
+    worker.stdin.flush()
+    lines = []
+    while not lines or lines[-1][1]["type"] != "chat":
+        message = json.loads(worker.stdout.readline())
+        assert message["id"] == "c1"
+        lines.append((time.perf_counter(), message))
+    return lines
+
+
+def test_worker_streams_deltas_before_the_result(worker):
+    lines = converse(worker)
+    deltas = [message for _, message in lines if message["type"] == "delta"]
+    result = lines[-1][1]["result"]
+
+    assert result["success"]
+    assert len(deltas) > 10
+    assert "".join(d["content"] for d in deltas) == result["response"]
+    assert "How often should I spray copper on rust?" in result["response"]
+    # The first words arrive while the rest is still being generated
+    assert lines[-1][0] - lines[0][0] > 0.15
+    assert result["first_token_ms"] < result["total_ms"]
+
+
+def test_worker_answers_in_one_line_without_streaming(worker):
+    lines = converse(worker, stream=False)
+
+    assert [message["type"] for _, message in lines] == ["chat"]
+    assert lines[0][1]["result"]["success"]
+
+
+def test_upstream_failure_is_reported_not_raised(monkeypatch):
+    client = SingleFlightClient(OpenAI(base_url="http://127.0.0.1:9/v1", api_key="fake", max_retries=0), max_retries=0)
+    monkeypatch.setattr(chat, "client", client)
+    deltas = []
+
+    result = chat.get_chat_response(CONVERSATION, on_delta=deltas.append)
+
+    assert not result["success"]
+    assert deltas == []
+    assert client.stats()["failures"] == 1
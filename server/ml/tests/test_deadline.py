@@ -0,0 +1,96 @@
+import time
+
+import cv2
+import numpy as np
+import pytest
+
+import corpus
+import deadline
+import predict
+from image_context import ImageContext
+from llm_stub import DEFAULT_REPLIES
+
+
+@pytest.fixture
+def leaf_path(tmp_path):
+    def write(width=640, height=480):
+        path = str(tmp_path / f"leaf_{width}.jpg")
+        cv2.imwrite(path, corpus.make_leaf(width, height, np.random.default_rng(5)))
+        return path
+    return write
+
+
+@pytest.fixture
+def slow_llm(monkeypatch):
+    # Every LLM call goes upstream, through the stub
+    monkeypatch.setattr(predict, "advice_cache", None)
+    monkeypatch.setattr(predict, "result_cache", None)
+    return lambda seconds: monkeypatch.setattr(predict.client.client, "delay_s", seconds)
+
+
+def test_later_stages_inherit_the_time_left():
+    budget = deadline.Deadline(1000)
+    assert budget.allowance_ms("decode") == pytest.approx(100, abs=5)
+    assert budget.allowance_ms("llm") == pytest.approx(1000, abs=5)
+
+    budget.started -= 0.6
+    assert budget.allowance_ms("llm") == pytest.approx(400, abs=5)
+
+
+def test_no_deadline_outside_start():
+    assert deadline.current() is None
+    with deadline.start(0) as budget:
+        assert budget is None and deadline.current() is None
+    with deadline.start(500) as budget:
+        assert deadline.current() is budget
+    assert deadline.current() is None
+
+
+def test_large_upload_is_decoded_reduced(leaf_path):
+    upload = ImageContext.from_path(leaf_path(4000, 3000))
+    budget = deadline.Deadline(1000)
+
+    img, validation_max_side = predict.plan_stages(upload, budget)
+
+    assert budget.degradations == ["reduced_decode"]
+    assert img.shape[:2] == (384, 512)
+    assert validation_max_side is None
+
+
+def test_validation_of_a_decoded_upload_runs_on_the_proxy():
+    budget = deadline.Deadline(1000)
+    decoded = ImageContext.from_array(np.zeros((3000, 4000, 3), np.uint8))
+
+    img, validation_max_side = predict.plan_stages(decoded, budget)
+
+    assert budget.degradations == ["validation_proxy"]
+    assert img is decoded
+    assert validation_max_side == predict.DEADLINE_PROXY_SIDE
+
+
+def test_generous_budget_degrades_nothing(leaf_path):
+    upload = ImageContext.from_path(leaf_path(4000, 3000))
+    budget = deadline.Deadline(60000)
+    predict.plan_stages(upload, budget)
+    assert budget.degradations == []
+
+
+def test_slow_llm_is_replaced_by_local_advice(leaf_path, slow_llm):
+    slow_llm(3.0)
+    started = time.perf_counter()
+
+    result = predict.run_prediction(leaf_path(), use_llm=True, deadline_ms=1500)
+
+    assert time.perf_counter() - started < 2.5
+    assert result["status"] == "success"
+    assert result["degradations"] == ["llm_template"]
+    assert result["llm_response"] == predict.local_advice(result)
+
+
+def test_llm_answer_in_time_is_used(leaf_path, slow_llm):
+    slow_llm(0.0)
+
+    result = predict.run_prediction(leaf_path(), use_llm=True, deadline_ms=30000)
+
+    assert result["degradations"] == []
+    assert result["llm_response"] in DEFAULT_REPLIES
@@ -0,0 +1,49 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from image_context import ImageContext
+
+
+def blank():
+    return ImageContext.from_array(np.zeros((64, 64, 3), dtype=np.uint8))
+
+
+def slow(value, seconds=0.3, calls=None):
+    def compute():
+        if calls is not None:
+            calls.append(value)
+        time.sleep(seconds)
+        return value
+    return compute
+
+
+def test_different_keys_compute_in_parallel():
+    ctx = blank()
+    keys = ["color_features", "texture_features", "leaf_candidates"]
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=3) as pool:
+        values = list(pool.map(lambda key: ctx.cached(key, slow(key)), keys))
+    elapsed = time.perf_counter() - started
+
+    assert values == keys
+    assert elapsed < 0.6
+
+
+def test_same_key_is_computed_once():
+    ctx = blank()
+    calls = []
+
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        values = list(pool.map(lambda _: ctx.cached("hsv", slow("hsv", calls=calls)), range(4)))
+
+    assert values == ["hsv"] * 4
+    assert calls == ["hsv"]
+
+
+def test_computes_may_read_other_keys():
+    ctx = blank()
+    assert ctx.cached("mean", lambda: float(ctx.gray.mean())) == 0.0
+    assert ctx.hsv.shape == (64, 64, 3)
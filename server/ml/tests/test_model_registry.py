@@ -0,0 +1,141 @@
+import os
+import json
+import threading
+
+import cv2
+import numpy as np
+import pytest
+
+import corpus
+import model
+from model_registry import ModelRegistry, read_manifest, list_manifests
+
+ML_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CLASS_NAMES = ["miner", "nodisease", "phoma", "rust"]
+
+
+def write_manifest(directory, version, artifact="coffee_disease_final.float16.tflite", **fields):
+    manifest = {
+        "version": version,
+        "class_names": CLASS_NAMES,
+        "input_size": [128, 128],
+        "artifacts": {"tflite": os.path.join(ML_DIR, artifact)},
+        **fields,
+    }
+    path = os.path.join(directory, f"{version}.manifest.json")
+    with open(path, "w") as f:
+        json.dump(manifest, f)
+    return path
+
+
+@pytest.fixture
+def registry(tmp_path):
+    write_manifest(tmp_path, "v1")
+    write_manifest(tmp_path, "v2", "coffee_disease_final.int8.tflite",
+                   class_names=[name.upper() for name in CLASS_NAMES])
+    registry = ModelRegistry(str(tmp_path), "tflite")
+    registry.activate("v1")
+    return registry
+
+
+@pytest.fixture(scope="module")
+def leaf(tmp_path_factory):
+    path = str(tmp_path_factory.mktemp("registry") / "leaf.jpg")
+    cv2.imwrite(path, corpus.make_leaf(640, 480, np.random.default_rng(12), disease="rust"))
+    return path
+
+
+def test_manifests_are_checked(tmp_path):
+    write_manifest(tmp_path, "ok", thresholds={"confidence": 0.6})
+    write_manifest(tmp_path, "resized", preprocessing={"resize": "bilinear"})
+    bad = tmp_path / "broken.manifest.json"
+    bad.write_text("{")
+
+    manifests = list_manifests(str(tmp_path))
+
+    assert list(manifests) == ["ok"]
+    assert manifests["ok"]["thresholds"] == {"confidence": 0.6, "max_entropy": 1.0, "min_confidence": 0.35}
+    assert manifests["ok"]["input_size"] == (128, 128)
+    with pytest.raises(ValueError, match="unsupported preprocessing"):
+        read_manifest(str(tmp_path / "resized.manifest.json"))
+
+
+def test_swap_and_rollback(registry):
+    status = registry.activate("v2")
+    assert status["active"]["version"] == "v2"
+    assert status["previous"] == "v1"
+    assert [entry["version"] for entry in status["history"]] == ["v1", "v2"]
+
+    # The previous version is still loaded, so rolling back loads nothing
+    registry.load = lambda *args: pytest.fail("rollback reloaded the model")
+    status = registry.rollback()
+    assert status["active"]["version"] == "v1"
+    assert status["previous"] == "v2"
+
+
+def test_versions_added_later_are_found(registry, tmp_path):
+    write_manifest(tmp_path, "v3")
+    assert registry.activate("v3")["active"]["version"] == "v3"
+
+
+@pytest.mark.parametrize("version,error", [
+    ("v9", ValueError),
+    ("missing", FileNotFoundError),
+    ("wrong_classes", RuntimeError),
+])
+def test_failed_swap_keeps_the_active_version(registry, tmp_path, version, error):
+    write_manifest(tmp_path, "missing", "gone.tflite")
+    write_manifest(tmp_path, "wrong_classes", class_names=["rust", "healthy"])
+    active = registry.active
+
+    with pytest.raises(error):
+        registry.activate(version)
+
+    assert registry.active is active
+    assert registry.status()["previous"] is None
+
+
+def test_rollback_needs_a_previous_version(registry):
+    with pytest.raises(ValueError):
+        registry.rollback()
+
+
+def test_in_flight_requests_finish_on_their_version(registry, leaf, monkeypatch):
+    monkeypatch.setattr(model, "registry", registry)
+    started, swapped = threading.Event(), threading.Event()
+    results = {}
+
+    def request():
+        with registry.use() as version:
+            started.set()
+            swapped.wait(30)
+            results["in_flight"] = model.predict_image(leaf, version=version)
+
+    thread = threading.Thread(target=request)
+    thread.start()
+    started.wait(30)
+    registry.activate("v2")
+    swapped.set()
+    thread.join()
+
+    after = model.predict_image(leaf)
+
+    assert results["in_flight"]["model_version"] == "v1"
+    assert results["in_flight"]["predicted_class"] in CLASS_NAMES
+    assert after["model_version"] == "v2"
+    assert after["predicted_class"] in [name.upper() for name in CLASS_NAMES]
+
+
+def test_retired_version_closes_after_its_last_request(registry, tmp_path):
+    write_manifest(tmp_path, "v3")
+    registry.enable_batching(4, 1.0)
+
+    with registry.use() as v1:
+        registry.activate("v2")
+        # v1 drops out as the version before v2 is replaced
+        registry.activate("v3")
+        assert v1.retired and v1.batcher is not None
+        assert v1.predict(np.zeros((1, 128, 128, 3), dtype=np.float32)).shape == (1, 4)
+
+    assert v1.batcher is None
+    assert registry.active.batcher is not None
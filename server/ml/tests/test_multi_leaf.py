@@ -0,0 +1,35 @@
+import cv2
+import numpy as np
+import pytest
+
+import corpus
+import model
+
+# Far enough apart that no two leaves touch
+CENTERS = [(0.2, 0.3), (0.75, 0.3), (0.45, 0.75)]
+
+
+def contains(box, x, y):
+    left, top, width, height = box
+    return left <= x <= left + width and top <= y <= top + height
+
+
+@pytest.mark.parametrize("width,height", [(640, 480), (1200, 900), (4000, 3000)])
+@pytest.mark.parametrize("validation_max_side", [0, 512])
+def test_separated_leaves_get_a_box_each(tmp_path, width, height, validation_max_side):
+    path = str(tmp_path / "three_leaves.jpg")
+    cv2.imwrite(path, corpus.make_leaf(width, height, np.random.default_rng(3), centers=CENTERS))
+
+    result = model.predict_image(path, validation_max_side=validation_max_side, multi_leaf=True)
+
+    assert result["status"] == "success"
+    assert len(result["leaves"]) == 3
+    for cx, cy in CENTERS:
+        assert sum(contains(leaf["box"], cx * width, cy * height) for leaf in result["leaves"]) == 1
+    assert result["aggregate"]["leaves"] == 3
+
+
+def test_select_leaf_boxes_takes_two_criteria_despite_rounding():
+    # 0.35 + 0.3 is 0.6499999999999999
+    candidates = [{"box": (0, 0, 10, 10), "area": 100.0, "score": 0.35 + 0.3}]
+    assert model.select_leaf_boxes(candidates, min_score=0.65) == candidates
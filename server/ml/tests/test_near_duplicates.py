@@ -0,0 +1,117 @@
+import cv2
+import numpy as np
+import pytest
+
+import corpus
+import predict
+from phash import NearDuplicateIndex, hamming, phash, popcount
+
+BASE = 0x0F0F_3C3C_A5A5_5A5A
+
+
+def flip(value, *bits):
+    for bit in bits:
+        value ^= 1 << bit
+    return value
+
+
+def test_popcount_matches_hamming():
+    rng = np.random.default_rng(0)
+    for a, b in rng.integers(0, 2 ** 63, (50, 2), dtype=np.int64).tolist():
+        assert hamming(a, b) == popcount(a ^ b) == sum(((a ^ b) >> i) & 1 for i in range(64))
+
+
+def test_lookup_within_the_distance():
+    index = NearDuplicateIndex(max_distance=6)
+    index.put(BASE, "rust")
+
+    assert index.nearest(BASE) == ("rust", 0)
+    # Spread over every chunk, so no chunk alone matches exactly
+    assert index.nearest(flip(BASE, 0, 10, 20, 30, 40, 50)) == ("rust", 6)
+    assert index.nearest(flip(BASE, 0, 10, 20, 30, 40, 50, 60)) == (None, None)
+    assert index.stats()["hits"] == 2
+    assert index.stats()["misses"] == 1
+
+
+def test_nearest_of_several_wins():
+    index = NearDuplicateIndex(max_distance=6)
+    index.put(flip(BASE, 1, 2, 3), "far")
+    index.put(flip(BASE, 1), "near")
+
+    assert index.nearest(BASE) == ("near", 1)
+
+
+def test_scopes_are_separate():
+    index = NearDuplicateIndex()
+    index.put(BASE, "alice's", scope="alice")
+
+    assert index.nearest(BASE, scope="bob") == (None, None)
+    assert index.nearest(BASE, scope="alice") == ("alice's", 0)
+
+
+def test_least_recently_used_is_evicted():
+    index = NearDuplicateIndex(max_distance=2, max_entries=2)
+    a, b, c = BASE, flip(BASE, *range(0, 64, 4)), flip(BASE, *range(1, 64, 4))
+    index.put(a, "a")
+    index.put(b, "b")
+    index.nearest(a)
+    index.put(c, "c")
+
+    assert index.nearest(a) == ("a", 0)
+    assert index.nearest(b) == (None, None)
+    assert index.nearest(c) == ("c", 0)
+    assert index.stats()["evictions"] == 1
+    assert index.stats()["entries"] == 2
+
+
+def test_expired_entries_are_dropped(monkeypatch):
+    index = NearDuplicateIndex(ttl_s=10)
+    index.put(BASE, "old")
+
+    monkeypatch.setattr("phash.time.time", lambda real=__import__("time").time: real() + 11)
+    assert index.nearest(BASE) == (None, None)
+    assert index.stats()["expired"] == 1
+    assert index.stats()["entries"] == 0
+
+
+def test_recompressed_upload_hashes_close():
+    leaf = corpus.make_leaf(640, 480, np.random.default_rng(2))
+    _, jpeg = cv2.imencode(".jpg", leaf, [cv2.IMWRITE_JPEG_QUALITY, 40])
+    recompressed = cv2.imdecode(jpeg, cv2.IMREAD_COLOR)
+
+    assert hamming(phash(leaf[..., ::-1]), phash(recompressed[..., ::-1])) <= 6
+
+
+@pytest.fixture
+def near_duplicates(monkeypatch):
+    index = NearDuplicateIndex()
+    monkeypatch.setattr(predict, "near_duplicates", index)
+    return index
+
+
+def test_score_request_reuses_a_near_duplicate(tmp_path, near_duplicates):
+    leaf = corpus.make_leaf(640, 480, np.random.default_rng(2))
+    first, second = str(tmp_path / "first.jpg"), str(tmp_path / "second.jpg")
+    cv2.imwrite(first, leaf, [cv2.IMWRITE_JPEG_QUALITY, 95])
+    cv2.imwrite(second, leaf, [cv2.IMWRITE_JPEG_QUALITY, 50])
+
+    with predict.registry.use() as version:
+        original = predict.score_request(first, version, scope="alice")
+        again = predict.score_request(second, version, scope="alice")
+        elsewhere = predict.score_request(second, version, scope="bob")
+
+    assert "near_duplicate" not in original
+    assert again["near_duplicate"]["distance"] <= predict.NEAR_DUP_DISTANCE
+    assert again["predicted_class"] == original["predicted_class"]
+    assert "near_duplicate" not in elsewhere
+
+
+def test_score_request_reports_unreadable_uploads(tmp_path, near_duplicates):
+    broken = tmp_path / "broken.jpg"
+    broken.write_bytes(b"not a jpeg")
+
+    with predict.registry.use() as version:
+        result = predict.score_request(str(broken), version, scope="alice")
+
+    assert result["status"] == "invalid_image"
+    assert near_duplicates.stats()["stores"] == 0
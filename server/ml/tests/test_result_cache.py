@@ -0,0 +1,176 @@
+import time
+
+import cv2
+import numpy as np
+import pytest
+
+import corpus
+import predict
+from result_cache import ResultCache, hash_file, fingerprint
+
+RUST = {"status": "success", "predicted_class": "rust", "confidence": 0.91}
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [time.time()]
+    monkeypatch.setattr("result_cache.time.time", lambda: now[0])
+    return now
+
+
+def test_hit_and_miss():
+    cache = ResultCache(max_entries=4)
+
+    assert cache.get("a") is None
+    cache.put("a", RUST)
+
+    assert cache.get("a") == RUST
+    assert cache.stats()["memory_hits"] == 1
+    assert cache.stats()["misses"] == 1
+    assert cache.stats()["hit_rate"] == 0.5
+
+
+def test_results_are_copies():
+    cache = ResultCache()
+    result = dict(RUST)
+    cache.put("a", result)
+    result["confidence"] = 0.0
+
+    served = cache.get("a")
+    served["cached"] = True
+
+    assert cache.get("a") == RUST
+
+
+def test_least_recently_used_is_evicted():
+    cache = ResultCache(max_entries=2)
+    cache.put("a", RUST)
+    cache.put("b", RUST)
+    cache.get("a")
+    cache.put("c", RUST)
+
+    assert cache.get("b") is None
+    assert cache.get("a") == RUST
+    assert cache.get("c") == RUST
+    assert cache.stats()["evictions"] == 1
+
+
+def test_entries_expire(clock):
+    cache = ResultCache(ttl_s=60)
+    cache.put("a", RUST)
+
+    clock[0] += 61
+    assert cache.get("a") is None
+    assert cache.stats()["expired"] == 1
+
+
+def test_disk_tier_survives_a_restart(tmp_path):
+    path = str(tmp_path / "results.sqlite")
+    ResultCache(disk_path=path).put("a", RUST)
+
+    restarted = ResultCache(disk_path=path)
+    assert restarted.get("a") == RUST
+    assert restarted.stats()["disk_hits"] == 1
+    # Promoted to memory
+    assert restarted.get("a") == RUST
+    assert restarted.stats()["memory_hits"] == 1
+
+
+def test_disk_only_cache(tmp_path):
+    cache = ResultCache(max_entries=0, disk_path=str(tmp_path / "results.sqlite"))
+    cache.put("a", RUST)
+
+    assert cache.get("a") == RUST
+    assert cache.stats()["memory_entries"] == 0
+
+
+def test_disk_tier_evicts_least_recently_used(tmp_path, clock):
+    path = str(tmp_path / "results.sqlite")
+    cache = ResultCache(max_entries=0, disk_path=path, disk_max_entries=2)
+    for key in "ab":
+        cache.put(key, RUST)
+        clock[0] += 1
+    cache.get("a")
+    clock[0] += 1
+    cache.put("c", RUST)
+
+    restarted = ResultCache(disk_path=path)
+    assert restarted.get("b") is None
+    assert restarted.get("a") == RUST
+    assert restarted.get("c") == RUST
+    assert restarted.stats()["disk_entries"] == 2
+
+
+def test_disk_entries_expire(tmp_path, clock):
+    path = str(tmp_path / "results.sqlite")
+    ResultCache(ttl_s=60, disk_path=path).put("a", RUST)
+
+    clock[0] += 61
+    restarted = ResultCache(ttl_s=60, disk_path=path)
+    assert restarted.get("a") is None
+    assert restarted.stats()["expired"] == 1
+    assert restarted.stats()["disk_entries"] == 0
+
+
+def test_unusable_disk_path_falls_back_to_memory(tmp_path):
+    blocker = tmp_path / "file"
+    blocker.write_text("")
+
+    cache = ResultCache(disk_path=str(blocker / "results.sqlite"))
+    cache.put("a", RUST)
+
+    assert cache.get("a") == RUST
+    assert "disk_entries" not in cache.stats()
+
+
+def test_keys_follow_the_content():
+    assert fingerprint("model", ["rust", "phoma"]) == fingerprint("model", ["rust", "phoma"])
+    assert fingerprint("model", ["rust", "phoma"]) != fingerprint("model", ["phoma", "rust"])
+
+
+def test_directory_hash_covers_names_and_contents(tmp_path):
+    (tmp_path / "variables").mkdir()
+    (tmp_path / "variables" / "data").write_bytes(b"weights")
+    before = hash_file(str(tmp_path))
+
+    (tmp_path / "variables" / "data").write_bytes(b"retrained")
+    assert hash_file(str(tmp_path)) != before
+
+
+@pytest.fixture
+def cached_predictions(monkeypatch, tmp_path):
+    cache = ResultCache(disk_path=str(tmp_path / "results.sqlite"))
+    monkeypatch.setattr(predict, "result_cache", cache)
+    monkeypatch.setattr(predict, "advice_cache", None)
+    return cache
+
+
+def test_reupload_is_served_from_the_cache(tmp_path, cached_predictions):
+    leaf = corpus.make_leaf(640, 480, np.random.default_rng(4), disease="rust")
+    first, again = str(tmp_path / "first.jpg"), str(tmp_path / "again.jpg")
+    cv2.imwrite(first, leaf)
+    cv2.imwrite(again, leaf)
+    calls = len(predict.client.client.calls)
+
+    result = predict.predict_with_cache(first)
+    reupload = predict.predict_with_cache(again)
+
+    assert "cached" not in result
+    assert reupload.pop("cached") is True
+    assert reupload == result
+    assert len(predict.client.client.calls) == calls + 1
+
+
+def test_another_model_version_misses(tmp_path, cached_predictions, monkeypatch):
+    path = str(tmp_path / "leaf.jpg")
+    cv2.imwrite(path, corpus.make_leaf(640, 480, np.random.default_rng(4)))
+    predict.predict_with_cache(path)
+
+    monkeypatch.setattr(predict, "RESULT_VERSION", "retrained")
+    assert "cached" not in predict.predict_with_cache(path)
+    assert cached_predictions.stats()["stores"] == 2
+
+
+def test_errors_are_not_cached(tmp_path, cached_predictions):
+    assert predict.predict_with_cache(str(tmp_path / "missing.jpg"))["status"] == "error"
+    assert cached_predictions.stats()["stores"] == 0
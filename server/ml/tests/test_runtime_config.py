@@ -0,0 +1,97 @@
+import os
+import sys
+import json
+import subprocess
+
+import pytest
+
+import runtime_config
+from runtime_config import parse_cpu_list, worker_cpus
+
+ML_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+APPLY = """
+import os, json
+import cv2
+import runtime_config
+applied = runtime_config.apply()
+import tensorflow as tf
+runtime_config.configure_tensorflow(tf)
+print(json.dumps({
+    "applied": applied,
+    "affinity": sorted(os.sched_getaffinity(0)),
+    "omp": os.environ.get("OMP_NUM_THREADS"),
+    "onednn": os.environ.get("TF_ENABLE_ONEDNN_OPTS"),
+    "cv_threads": cv2.getNumThreads(),
+    "tf_intra": tf.config.threading.get_intra_op_parallelism_threads(),
+    "tf_inter": tf.config.threading.get_inter_op_parallelism_threads(),
+}))
+"""
+
+
+@pytest.fixture
+def config_file(tmp_path, monkeypatch):
+    def write(settings):
+        path = tmp_path / "runtime.json"
+        path.write_text(json.dumps(settings))
+        monkeypatch.setenv("ML_RUNTIME_CONFIG", str(path))
+        monkeypatch.setattr(runtime_config, "_file_settings", None)
+        return str(path)
+    return write
+
+
+def test_environment_wins_over_the_file(config_file, monkeypatch):
+    config_file({"ML_CV_THREADS": 2, "ML_TF_INTRA_THREADS": 4})
+    monkeypatch.setenv("ML_CV_THREADS", "1")
+
+    assert runtime_config.setting("ML_CV_THREADS") == "1"
+    assert runtime_config.setting("ML_TF_INTRA_THREADS") == "4"
+    assert runtime_config.setting("ML_ONEDNN", "0") == "0"
+
+
+def test_unreadable_file_falls_back_to_defaults(tmp_path, monkeypatch):
+    monkeypatch.setenv("ML_RUNTIME_CONFIG", str(tmp_path / "missing.json"))
+    monkeypatch.setattr(runtime_config, "_file_settings", None)
+
+    assert runtime_config.setting("ML_CV_THREADS", "default") == "default"
+
+
+def test_cpu_lists():
+    assert parse_cpu_list("0-3,6") == {0, 1, 2, 3, 6}
+    assert parse_cpu_list(" 2, ,4-5 ") == {2, 4, 5}
+    with pytest.raises(ValueError):
+        parse_cpu_list("two")
+
+
+def test_workers_get_equal_slices():
+    cpus = set(range(8))
+    slices = [worker_cpus(i, 3, cpus) for i in range(3)]
+
+    assert set().union(*slices) == cpus
+    assert sum(len(s) for s in slices) == 8
+    assert [sorted(s) for s in slices] == [[0, 1], [2, 3, 4], [5, 6, 7]]
+
+
+def test_more_workers_than_cores_share_round_robin():
+    assert [worker_cpus(i, 5, {4, 5}) for i in range(5)] == [{4}, {5}, {4}, {5}, {4}]
+
+
+def test_apply_sizes_every_pool(tmp_path):
+    path = tmp_path / "runtime.json"
+    path.write_text(json.dumps({"ML_TF_INTER_THREADS": 2, "ML_TF_INTRA_THREADS": 5}))
+    env = dict(os.environ, ML_RUNTIME_CONFIG=str(path), ML_TF_INTRA_THREADS="3", ML_CV_THREADS="2",
+               ML_CPU_AFFINITY="0", ML_ONEDNN="1")
+    env.pop("OMP_NUM_THREADS", None)
+
+    output = subprocess.run([sys.executable, "-c", APPLY], cwd=ML_DIR, env=env,
+                            capture_output=True, text=True, check=True).stdout
+    report = json.loads(output.strip().splitlines()[-1])
+
+    assert report["applied"] == {"cpus": [0], "onednn": True, "tf_intra_threads": 3,
+                                 "tf_inter_threads": 2, "cv_threads": 2}
+    assert report["affinity"] == [0]
+    assert report["omp"] == "3"
+    assert report["onednn"] == "1"
+    assert report["cv_threads"] == 2
+    assert report["tf_intra"] == 3
+    assert report["tf_inter"] == 2
@@ -0,0 +1,209 @@
+import os
+import sys
+import time
+import threading
+import subprocess
+
+import numpy as np
+import pytest
+
+import shm_ring
+from image_context import ImageContext
+from shm_ring import SlotRing, StaleHandle, READING
+
+ML_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Opens every READY slot it finds for duration_s, checking that the pixels
+# stay those of the generation it opened until it releases the slot
+READER = """
+import sys, time
+import numpy as np
+from shm_ring import SlotRing, StaleHandle, READY, _STATE, _GENERATION
+ring = SlotRing.attach(sys.argv[1])
+opened = overwritten = 0
+stop = time.monotonic() + float(sys.argv[2])
+while time.monotonic() < stop:
+    for index in range(ring.slots):
+        if ring._table[index, _STATE] != READY:
+            continue
+        try:
+            slot = ring.open((index, int(ring._table[index, _GENERATION])))
+        except StaleHandle:
+            continue
+        with slot:
+            opened += 1
+            for _ in range(3):
+                overwritten += not np.all(slot.model == slot.generation)
+                time.sleep(0.0002)
+print(opened, overwritten)
+ring.close()
+"""
+
+
+@pytest.fixture
+def ring():
+    ring = SlotRing.create(slots=2, model_size=(8, 8), proxy_side=16)
+    yield ring
+    ring.close()
+
+
+def put(ring):
+    return ring.put_image(ImageContext.from_array(np.zeros((16, 16, 3), dtype=np.uint8)))
+
+
+def test_reclaim_waits_for_an_open_in_progress(ring, monkeypatch):
+    worker = SlotRing.attach(ring.name)
+    handle = put(ring)
+    real_now_us = shm_ring._now_us
+    reclaimer = []
+
+    def now_us():
+        # Inside open(), after it checked the slot: the dispatcher tries to
+        # reclaim it as stale
+        if not reclaimer:
+            reclaimer.append(threading.Thread(target=ring.reclaim, args=(0,)))
+            reclaimer[0].start()
+            reclaimer[0].join(0.2)
+        return real_now_us()
+
+    monkeypatch.setattr(shm_ring, "_now_us", now_us)
+    slot = worker.open(handle)
+    monkeypatch.setattr(shm_ring, "_now_us", real_now_us)
+    slot.release()
+    reclaimer[0].join()
+
+    assert ring.stats()["free"] == 2
+    assert ring.stats()["reclaimed_stale"] == 0
+    assert worker.counters["released"] == 1
+    worker.close()
+
+
+def test_open_after_reclaim_is_stale(ring):
+    worker = SlotRing.attach(ring.name)
+    handle = put(ring)
+
+    assert ring.reclaim(stale_after_s=0) == 1
+    with pytest.raises(StaleHandle):
+        worker.open(handle)
+    assert ring.stats()["free"] == 2
+    worker.close()
+
+
+def test_concurrent_open_and_reclaim_across_processes(ring):
+    reader = subprocess.Popen(
+        [sys.executable, "-c", READER, ring.name, "1.5"],
+        cwd=ML_DIR, stdout=subprocess.PIPE, text=True
+    )
+
+    reclaimed = 0
+    rng = np.random.default_rng(0)
+    while reader.poll() is None:
+        for _ in range(ring.slots):
+            index = ring.acquire(timeout=0.05, stale_after_s=0)
+            # Stamp the pixels with the generation publish() gives them
+            ring._model[index] = ring._table[index, shm_ring._GENERATION] + 1
+            ring.publish(index)
+        # Varying how long slots stay READY, so a loaded reader still gets
+        # some and reclaims still land on opens in progress
+        time.sleep(rng.uniform(0, 0.002))
+        reclaimed += ring.reclaim(stale_after_s=0)
+
+    opened, overwritten = (int(v) for v in reader.stdout.read().split())
+    assert opened > 0 and reclaimed > 0
+    assert overwritten == 0
+    # Every slot the reader took was released, not left READING
+    assert ring.stats()["reading"] == 0
+
+
+def leaf_file(tmp_path, width=640, height=480):
+    import cv2
+    import corpus
+    path = str(tmp_path / f"leaf_{width}x{height}.png")
+    cv2.imwrite(path, corpus.make_leaf(width, height, np.random.default_rng(8)))
+    return path
+
+
+def test_slot_lifecycle(tmp_path):
+    path = leaf_file(tmp_path)
+    with SlotRing.create(slots=2, model_size=(128, 128), proxy_side=512) as ring:
+        worker = SlotRing.attach(ring.name)
+        assert ring.stats()["free"] == 2
+
+        handle = ring.put_image(path)
+        assert ring.stats()["ready"] == 1
+
+        expected = ImageContext.from_path(path)
+        with worker.open(handle) as slot:
+            assert ring.stats()["reading"] == 1
+            ctx = slot.image_context(path)
+            np.testing.assert_array_equal(ctx.model_tensor((128, 128)), expected.model_tensor((128, 128)))
+            assert slot.proxy is not None
+            np.testing.assert_array_equal(ctx.rgb, expected.validation_view(512).rgb)
+            assert ctx.full_size == (640, 480)
+        assert ring.stats()["free"] == 2
+
+        # The handle is spent once released
+        with pytest.raises(StaleHandle):
+            worker.open(handle)
+        worker.close()
+
+
+def test_elongated_image_without_a_proxy_is_decoded_from_the_file(tmp_path):
+    path = leaf_file(tmp_path, 2400, 260)
+    with SlotRing.create(slots=1, model_size=(128, 128), proxy_side=128) as ring:
+        with ring.open(ring.put_image(path)) as slot:
+            assert slot.proxy is None
+            ctx = slot.image_context(path)
+            assert not ctx.decoded
+            assert ctx.validation_view(512).rgb.shape[0] >= 256
+
+
+def test_full_ring_blocks_until_a_slot_is_released(ring):
+    handles = [put(ring), put(ring)]
+    worker = SlotRing.attach(ring.name)
+
+    with pytest.raises(shm_ring.RingFull):
+        ring.put_image(ImageContext.from_array(np.zeros((16, 16, 3), dtype=np.uint8)), timeout=0.05)
+    assert ring.stats()["full_waits"] == 1
+
+    slot = worker.open(handles[0])
+    threading.Timer(0.1, slot.release).start()
+    started = time.perf_counter()
+    put(ring)
+    assert 0.05 < time.perf_counter() - started < 2
+    worker.close()
+
+
+def test_slots_of_dead_readers_are_reclaimed(ring):
+    handle = put(ring)
+    subprocess.run(
+        [sys.executable, "-c", f"from shm_ring import SlotRing; SlotRing.attach({ring.name!r}).open({handle!r})"],
+        cwd=ML_DIR, check=True
+    )
+    assert ring.stats()["reading"] == 1
+
+    assert ring.reclaim() == 1
+    assert ring.stats()["reclaimed_dead"] == 1
+    assert ring.stats()["free"] == 2
+
+
+def test_failed_write_returns_the_slot(ring, monkeypatch):
+    monkeypatch.setattr(ring, "_model", None)
+    with pytest.raises(TypeError):
+        put(ring)
+
+    assert ring.stats()["free"] == 2
+    assert ring.stats()["written"] == 0
+
+
+def test_only_the_creator_allocates_and_unlinks(ring):
+    worker = SlotRing.attach(ring.name)
+    with pytest.raises(RuntimeError):
+        worker.acquire()
+    worker.close()
+
+    # Still there for others after a worker detaches
+    SlotRing.attach(ring.name).close()
+    ring.close()
+    with pytest.raises(FileNotFoundError):
+        SlotRing.attach(ring.name)
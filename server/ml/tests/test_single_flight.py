@@ -0,0 +1,179 @@
+import time
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from llm_client import SingleFlightClient, AsyncSingleFlightClient, LazyClient, request_key
+from llm_stub import StubClient, AsyncStubClient
+
+
+def ask(client, question, **kwargs):
+    completion = client.chat.completions.create(
+        model="gpt-4o-mini", messages=[{"role": "user", "content": question}], **kwargs
+    )
+    return completion.choices[0].message.content
+
+
+async def ask_async(client, question):
+    completion = await client.chat.completions.create(
+        model="gpt-4o-mini", messages=[{"role": "user", "content": question}]
+    )
+    return completion.choices[0].message.content
+
+
+class Flaky(StubClient):
+    """
+    Raises each of errors in turn (after delay_s, like a slow failure),
+    then answers
+    """
+
+    def __init__(self, errors, **kwargs):
+        super().__init__(**kwargs)
+        self.errors = list(errors)
+
+    def _record(self, model, messages, kwargs):
+        content = super()._record(model, messages, kwargs)
+        if self.errors:
+            time.sleep(self.delay_s)
+            raise self.errors.pop(0)
+        return content
+
+
+class Counting(StubClient):
+    """
+    Keeps track of the most calls running at once
+    """
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.running = self.peak = 0
+        create = self.chat.completions.create
+
+        def counted(**kwargs):
+            with self._lock:
+                self.running += 1
+                self.peak = max(self.peak, self.running)
+            try:
+                return create(**kwargs)
+            finally:
+                with self._lock:
+                    self.running -= 1
+
+        self.chat.completions.create = counted
+
+
+def test_identical_requests_in_flight_share_one_call():
+    stub = StubClient(replies=["one", "two"], delay_s=0.3)
+    client = SingleFlightClient(stub)
+
+    with ThreadPoolExecutor(max_workers=10) as pool:
+        answers = list(pool.map(lambda _: ask(client, "Rust on my leaves?"), range(10)))
+
+    assert answers == ["one"] * 10
+    assert len(stub.calls) == 1
+    assert client.stats()["coalesced"] == 9
+    assert client.stats()["in_flight"] == 0
+
+
+def test_requests_differing_only_in_whitespace_coalesce():
+    key = request_key({"model": "GPT-4o-mini", "messages": [{"role": "user", "content": "Rust  on\nmy leaves?"}]})
+    assert key == request_key({"model": "gpt-4o-mini", "messages": [{"role": "user", "content": "Rust on my leaves?"}]})
+    assert key != request_key({"model": "gpt-4o-mini", "messages": [{"role": "user", "content": "Phoma?"}]})
+
+
+def test_finished_requests_are_not_reused():
+    stub = StubClient(replies=["one", "two"])
+    client = SingleFlightClient(stub)
+
+    assert [ask(client, "Rust?"), ask(client, "Rust?")] == ["one", "two"]
+    assert client.stats()["coalesced"] == 0
+
+
+def test_concurrency_limit():
+    stub = Counting(delay_s=0.1)
+    client = SingleFlightClient(stub, max_concurrency=2)
+
+    with ThreadPoolExecutor(max_workers=6) as pool:
+        list(pool.map(lambda i: ask(client, f"Question {i}"), range(6)))
+
+    assert len(stub.calls) == 6
+    assert stub.peak == 2
+
+
+def test_connection_errors_are_retried():
+    stub = Flaky([ConnectionError("reset"), TimeoutError("slow")], replies=["ok"])
+    client = SingleFlightClient(stub, max_retries=3, backoff_s=0)
+
+    assert ask(client, "Rust?") == "ok"
+    assert client.stats()["retries"] == 2
+    assert client.stats()["failures"] == 0
+
+
+def test_other_errors_fail_every_waiting_caller_at_once():
+    stub = Flaky([ValueError("bad request")], delay_s=0.3)
+    client = SingleFlightClient(stub, max_retries=3, backoff_s=0)
+
+    def attempt(_):
+        with pytest.raises(ValueError) as error:
+            ask(client, "Rust?")
+        return str(error.value)
+
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        errors = list(pool.map(attempt, range(4)))
+
+    assert errors == ["bad request"] * 4
+    assert len(stub.calls) == 1
+    assert client.stats()["failures"] == 1
+
+
+def test_streams_are_not_coalesced():
+    stub = StubClient(delay_s=0.2)
+    client = SingleFlightClient(stub)
+
+    with ThreadPoolExecutor(max_workers=3) as pool:
+        list(pool.map(lambda _: ask(client, "Rust?", stream=True), range(3)))
+
+    assert len(stub.calls) == 3
+    assert client.stats()["streams"] == 3
+
+
+def test_async_requests_share_one_call():
+    stub = AsyncStubClient(replies=["one"], delay_s=0.2)
+    client = AsyncSingleFlightClient(stub)
+
+    async def run():
+        return await asyncio.gather(*(ask_async(client, "Rust?") for _ in range(10)))
+
+    assert asyncio.run(run()) == ["one"] * 10
+    assert len(stub.calls) == 1
+    assert client.stats()["coalesced"] == 9
+
+
+def test_async_caller_giving_up_leaves_the_shared_call_running():
+    stub = AsyncStubClient(replies=["one"], delay_s=0.3)
+    client = AsyncSingleFlightClient(stub)
+
+    async def run():
+        patient = asyncio.ensure_future(ask_async(client, "Rust?"))
+        with pytest.raises(asyncio.TimeoutError):
+            await asyncio.wait_for(ask_async(client, "Rust?"), 0.05)
+        return await patient
+
+    assert asyncio.run(run()) == "one"
+    assert len(stub.calls) == 1
+
+
+def test_lazy_client_is_built_on_first_use():
+    built = []
+
+    def factory():
+        built.append(1)
+        return StubClient(replies=["ok"])
+
+    client = SingleFlightClient(LazyClient(factory))
+    assert built == []
+
+    assert ask(client, "Rust?") == "ok"
+    assert ask(client, "Phoma?") == "ok"
+    assert built == [1]
@@ -0,0 +1,101 @@
+import time
+import threading
+
+import cv2
+import numpy as np
+
+import corpus
+import predict
+import telemetry
+
+
+def test_durations_land_in_their_bucket():
+    telemetry.record("test.bucketed", 3)
+    telemetry.record("test.bucketed", 7)
+    telemetry.record("test.bucketed", 60000)
+
+    stage = telemetry.snapshot()["stages"]["test.bucketed"]
+    buckets = dict(zip(telemetry.BUCKETS_MS + ("+Inf",), stage["buckets"]))
+    assert stage["count"] == 3
+    assert stage["sum_ms"] == 60010
+    assert buckets[5] == 1 and buckets[10] == 1 and buckets["+Inf"] == 1
+
+
+def test_stage_times_its_block():
+    with telemetry.collect() as timings:
+        with telemetry.stage("test.sleep"):
+            time.sleep(0.02)
+        with telemetry.stage("test.sleep"):
+            time.sleep(0.02)
+
+    assert 40 <= timings["test.sleep"] < 200
+    assert telemetry.snapshot()["stages"]["test.sleep"]["count"] >= 2
+
+
+def test_each_request_collects_its_own_timings():
+    results = {}
+
+    def request(name, ms):
+        with telemetry.collect() as timings:
+            telemetry.record(name, ms)
+            time.sleep(0.05)
+            results[name] = dict(timings)
+
+    threads = [threading.Thread(target=request, args=(f"test.request{i}", i)) for i in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert results == {f"test.request{i}": {f"test.request{i}": i} for i in range(3)}
+
+
+def test_counters_and_merge():
+    telemetry.increment("test.hit")
+    telemetry.increment("test.hit", 2)
+    telemetry.record("test.merged", 1)
+    snap = telemetry.snapshot()
+    assert snap["counters"]["test.hit"] == 3
+
+    merged = telemetry.merge([snap, snap])
+    assert merged["counters"]["test.hit"] == 6
+    assert merged["stages"]["test.merged"]["count"] == 2 * snap["stages"]["test.merged"]["count"]
+
+
+def test_prometheus_buckets_are_cumulative():
+    snap = {
+        "buckets_ms": [10, 100],
+        "stages": {'odd "name"': {"count": 3, "sum_ms": 130.0, "buckets": [1, 1, 1]}},
+        "counters": {"model.swap": 2},
+    }
+
+    text = telemetry.render_prometheus(snap)
+
+    assert 'growfrika_ml_stage_duration_ms_bucket{stage="odd \\"name\\"",le="10"} 1' in text
+    assert 'growfrika_ml_stage_duration_ms_bucket{stage="odd \\"name\\"",le="100"} 2' in text
+    assert 'growfrika_ml_stage_duration_ms_bucket{stage="odd \\"name\\"",le="+Inf"} 3' in text
+    assert 'growfrika_ml_stage_duration_ms_count{stage="odd \\"name\\""} 3' in text
+    assert 'growfrika_ml_events_total{event="model.swap"} 2' in text
+
+
+def test_disabled_telemetry_records_nothing(monkeypatch):
+    monkeypatch.setattr(telemetry, "ENABLED", False)
+
+    with telemetry.collect() as timings, telemetry.stage("test.disabled"):
+        telemetry.increment("test.disabled")
+
+    assert timings is None
+    assert "test.disabled" not in telemetry.snapshot()["stages"]
+    assert "test.disabled" not in telemetry.snapshot()["counters"]
+
+
+def test_prediction_reports_its_stages(tmp_path):
+    path = str(tmp_path / "leaf.jpg")
+    cv2.imwrite(path, corpus.make_leaf(640, 480, np.random.default_rng(6), disease="rust"))
+
+    result = predict.run_prediction(path, include_timings=True)
+    without = predict.run_prediction(path, include_timings=False)
+
+    for name in ("validate_image_content", "check.green_content", "preprocess", "model", "llm"):
+        assert result["timings"][name] >= 0
+    assert "timings" not in without
@@ -0,0 +1,139 @@
+import os
+import sys
+import json
+import time
+import queue
+import threading
+import subprocess
+
+import cv2
+import numpy as np
+import pytest
+
+import corpus
+
+ML_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+LLM_DELAY_S = 0.8
+
+
+class Worker:
+    """
+    predict.py --worker in a subprocess; lines it sends are queued with
+    their arrival time
+    """
+
+    def __init__(self):
+        self.proc = subprocess.Popen(
+            [sys.executable, os.path.join(ML_DIR, "predict.py"), "--worker"],
+            cwd=ML_DIR, text=True, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+            # No advice cache, so every request waits for the (slow) LLM
+            env=dict(os.environ, ML_LLM_STUB_DELAY_MS=str(LLM_DELAY_S * 1000), ML_ADVICE_VARIANTS="0")
+        )
+        self.lines = queue.Queue()
+        threading.Thread(target=self._read, daemon=True).start()
+
+    def _read(self):
+        for line in self.proc.stdout:
+            self.lines.put((time.perf_counter(), json.loads(line)))
+
+    def send(self, **message):
+        self.proc.stdin.write(json.dumps(message) + "\n")
+        self.proc.stdin.flush()
+        return time.perf_counter()
+
+    def receive(self, timeout=60):
+        return self.lines.get(timeout=timeout)
+
+    def until(self, predicate, timeout=60):
+        """
+        Lines up to and including the first one predicate accepts
+        """
+        lines = []
+        while not lines or not predicate(lines[-1][1]):
+            lines.append(self.receive(timeout))
+        return lines
+
+    def close(self):
+        self.send(type="shutdown")
+        self.proc.stdin.close()
+        self.proc.wait(timeout=30)
+
+
+@pytest.fixture(scope="module")
+def worker():
+    worker = Worker()
+    assert worker.receive(120)[1]["type"] == "ready"
+    yield worker
+    worker.close()
+
+
+@pytest.fixture(scope="module")
+def leaves(tmp_path_factory):
+    directory = tmp_path_factory.mktemp("leaves")
+    rng = np.random.default_rng(9)
+    paths = []
+    for i, disease in enumerate(["rust", "phoma", "miner", None]):
+        path = str(directory / f"leaf_{i}.jpg")
+        cv2.imwrite(path, corpus.make_leaf(640, 480, rng, disease=disease))
+        paths.append(path)
+    return paths
+
+
+def test_diagnosis_arrives_before_the_advice(worker, leaves):
+    sent = worker.send(id="p1", type="predict", image_path=leaves[0], stream=True)
+
+    (first_at, first), (final_at, final) = worker.until(lambda m: m.get("type") == "predict")
+
+    assert first["id"] == final["id"] == "p1"
+    assert first["type"] == "prediction"
+    assert "llm_response" not in first["result"]
+    for field in ("status", "predicted_class", "confidence", "all_probabilities"):
+        assert first["result"][field] == final["result"][field]
+    assert final["result"]["llm_response"]
+    assert first_at - sent < final_at - sent - LLM_DELAY_S * 0.8
+
+
+def test_without_stream_only_the_final_result_is_sent(worker, leaves):
+    worker.send(id="p2", type="predict", image_path=leaves[1])
+
+    lines = worker.until(lambda m: m.get("type") == "predict")
+
+    assert [m["type"] for _, m in lines] == ["predict"]
+    assert lines[0][1]["result"]["llm_response"]
+
+
+def test_llm_calls_overlap(worker, leaves):
+    started = time.perf_counter()
+    for i, path in enumerate(leaves):
+        worker.send(id=f"o{i}", type="predict", image_path=path)
+
+    done = {}
+    while len(done) < len(leaves):
+        at, message = worker.receive()
+        done[message["id"]] = at
+
+    assert set(done) == {f"o{i}" for i in range(len(leaves))}
+    assert max(done.values()) - started < LLM_DELAY_S * 2.5
+
+
+def test_health_is_answered_while_predictions_wait_on_the_llm(worker, leaves):
+    worker.send(id="p3", type="predict", image_path=leaves[2])
+    time.sleep(0.2)
+    sent = worker.send(id="h1", type="health")
+
+    (at, health), = worker.until(lambda m: m.get("id") == "h1")
+
+    assert health["type"] == "health"
+    assert at - sent < LLM_DELAY_S / 2
+    worker.until(lambda m: m.get("id") == "p3")
+
+
+def test_bad_requests_get_an_error(worker):
+    worker.send(id="e1", type="predict")
+    (_, missing), = worker.until(lambda m: m.get("id") == "e1")
+    assert missing["result"]["status"] == "error"
+
+    worker.proc.stdin.write("{not json\n")
+    worker.proc.stdin.flush()
+    (_, invalid), = worker.until(lambda m: m.get("type") == "error")
+    assert "Invalid JSON" in invalid["error"]
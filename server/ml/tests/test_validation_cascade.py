@@ -0,0 +1,77 @@
+import numpy as np
+import pytest
+
+import corpus
+import model
+import validation_pool
+from image_context import ImageContext
+
+SIZE = (480, 640)
+
+
+def red_noise():
+    rgb = np.random.default_rng(1).integers(0, 60, SIZE + (3,), dtype=np.uint8)
+    rgb[..., 0] += 160
+    return rgb
+
+
+def flat(color):
+    return np.full(SIZE + (3,), color, dtype=np.uint8)
+
+
+NON_PLANT = {
+    "red_noise": red_noise,
+    "gray": lambda: flat((128, 128, 128)),
+    "blue": lambda: flat((40, 70, 200)),
+}
+
+
+@pytest.fixture(params=[0, 2], ids=["serial", "pool"])
+def pool(request):
+    validation_pool.configure_pool(request.param)
+    yield request.param
+    validation_pool.configure_pool(0)
+
+
+def full_outcome(rgb):
+    img = ImageContext.from_array(rgb)
+    checks = {name: check(img) for name, check, _, _ in model.VALIDATION_STAGES}
+    return model.validation_outcome(checks, model.weighted_validation_score(checks))
+
+
+@pytest.mark.parametrize("kind", sorted(NON_PLANT))
+def test_non_plant_uploads_skip_the_expensive_checks(pool, kind):
+    rgb = NON_PLANT[kind]()
+
+    result = model.validate_image_content(ImageContext.from_array(rgb))
+
+    assert not result["is_valid"]
+    skipped = [stage["name"] for stage in result["stages"] if not stage["ran"]]
+    assert {"texture", "leaf_shape"} <= set(skipped)
+    assert result["validation_score_is_lower_bound"]
+    assert result["validation_score"] <= full_outcome(rgb)["validation_score"]
+    if result["reason_is_exact"]:
+        assert result["reason"] == full_outcome(rgb)["reason"]
+
+
+def test_early_exits_keep_the_decision(pool):
+    rng = np.random.default_rng(7)
+    width, height = corpus.RESOLUTIONS["small"]
+    images = [corpus.make_non_leaf(width, height, rng)[..., ::-1].copy() for _ in range(4)]
+    images += [corpus.make_leaf(width, height, rng)[..., ::-1].copy() for _ in range(2)]
+
+    for rgb in images:
+        result = model.validate_image_content(ImageContext.from_array(rgb))
+        assert result["is_valid"] == full_outcome(rgb)["is_valid"]
+        if result["is_valid"]:
+            assert all(stage["ran"] for stage in result["stages"])
+
+
+def test_reason_is_flagged_when_the_remaining_checks_could_change_it():
+    # No green: rejected whatever else scores, but the total decides between
+    # "no plant material" and "insufficient plant material"
+    outcome = model._early_validation_outcome({"size_quality": 1.0, "green_content": 0.0})
+    assert not outcome["is_valid"]
+    assert not outcome["reason_is_exact"]
+
+    assert model._early_validation_outcome({"size_quality": 1.0, "green_content": 0.5}) is None
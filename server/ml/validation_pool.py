@@ -0,0 +1,73 @@
+import os
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def available_cores():
+    """
+    Cores this process may run on (respects CPU affinity where supported)
+    """
+    if hasattr(os, "sched_getaffinity"):
+        return max(1, len(os.sched_getaffinity(0)))
+    return os.cpu_count() or 1
+
+
+def resolve_pool_size(setting, tf_intra_threads=0):
+    """
+    Turns the ML_VALIDATION_THREADS setting into a thread count.
+
+    "0" or "1" run the checks serially. A number is used as is, capped at the
+    available cores. "auto" leaves room for TensorFlow's intra-op threads so
+    validation and inference of concurrent requests don't oversubscribe the
+    machine; when TensorFlow is left to use every core, half go to validation.
+    """
+    cores = available_cores()
+    setting = str(setting).strip().lower()
+
+    if setting == "auto":
+        if tf_intra_threads > 0:
+            return max(1, cores - tf_intra_threads)
+        return max(1, cores // 2)
+
+    try:
+        return max(0, min(int(setting), cores))
+    except ValueError:
+        print(f"Invalid ML_VALIDATION_THREADS value: {setting}, running checks serially", file=sys.stderr)
+        return 0
+
+
+def configure_pool(size):
+    """
+    Creates (or replaces) the shared pool. A size of 0 or 1 disables it
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False)
+        _pool = ThreadPoolExecutor(max_workers=size, thread_name_prefix="validation") if size > 1 else None
+        if _pool is not None:
+            print(f"Validation thread pool: {size} threads", file=sys.stderr)
+    return _pool
+
+
+def get_pool():
+    return _pool
+
+
+def run_all(tasks):
+    """
+    Runs a list of zero-argument callables and returns their results in order.
+    Uses the shared pool when one is configured, otherwise runs them inline
+    """
+    pool = _pool
+    if pool is None or len(tasks) < 2:
+        return [task() for task in tasks]
+
+    # Run the first task on the calling thread instead of leaving it idle
+    futures = [pool.submit(task) for task in tasks[1:]]
+    first = tasks[0]()
+    return [first] + [future.result() for future in futures]
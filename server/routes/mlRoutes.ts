@@ -2,11 +2,11 @@ import express, {type Request, type Response } from "express";
 import multer from "multer";
 import path from "path";
 import fs from "fs";
-import { spawn } from "child_process";
 import { authenticateToken } from "../middleware/jwtauth.js";
 import { Conversation } from "../models/Conversations.js"
 import { Message } from "../models/Messages.js";
 import supabase from "../config/supabase.js";
+import { PythonWorkerPool } from "../utils/pythonWorkerPool.js";
 
 Conversation.hasMany(Message, {
     foreignKey: 'convo_id',
@@ -21,6 +21,24 @@ Message.belongsTo(Conversation, {
 
 const router = express.Router();
 
+// Long-lived prediction workers keep the model loaded between uploads
+export const predictWorkers = new PythonWorkerPool({
+  scriptPath: path.join(process.cwd(), "ml", "predict.py"),
+  args: ["--worker"],
+  size: Number(process.env.ML_PREDICT_WORKERS) || 1
+});
+
+// Time budget of one prediction in the worker (0 = none). Stages that would
+// overrun it degrade, e.g. a local advice template instead of a slow LLM reply
+const PREDICT_DEADLINE_MS = Number(process.env.ML_PREDICT_DEADLINE_MS ?? 20000);
+
+// Chat workers reuse one OpenAI client (and its connections) across messages
+export const chatWorkers = new PythonWorkerPool({
+  scriptPath: path.join(process.cwd(), "ml", "chat.py"),
+  args: ["--worker"],
+  size: Number(process.env.ML_CHAT_WORKERS) || 1
+});
+
 // Multer setup
 const upload = multer({ 
   dest: "uploads/",
@@ -88,172 +106,220 @@ router.post("/predict", authenticateToken, upload.single("image"), async (req: R
       return;
     }
 
-    const pythonProcess = spawn("python3", [scriptPath, imgPath], { shell: true });
-
-    let resultData = "";
-    let errorData = "";
+    // With server-sent events the diagnosis goes out as soon as the model has
+    // it, and the saved conversation follows once the LLM text is in
+    const streaming = req.body?.stream === "true" || (req.headers.accept || "").includes("text/event-stream");
+    const sendEvent = (event: string, data: unknown) => {
+      res.write(`event: ${event}\ndata: ${JSON.stringify(data)}\n\n`);
+    };
+
+    if (streaming) {
+      res.setHeader("Content-Type", "text/event-stream");
+      res.setHeader("Cache-Control", "no-cache");
+      res.setHeader("Connection", "keep-alive");
+      res.setHeader("X-Accel-Buffering", "no");
+      res.flushHeaders();
+    }
 
-    pythonProcess.stdout.on("data", (data: Buffer) => {
-      resultData += data.toString();
-    });
+    try {
+      // Reuse a warm worker instead of spawning a fresh interpreter per upload
+      const { result } = await predictWorkers.request(
+        {
+          type: "predict",
+          image_path: imgPath,
+          // Near-duplicate reuse (ML_NEAR_DUP_ENTRIES) only matches this user's own uploads
+          scope: String(user_id),
+          deadline_ms: PREDICT_DEADLINE_MS || undefined,
+          stream: streaming
+        },
+        undefined,
+        streaming
+          ? (event) => sendEvent("prediction", {
+              status: event.result.status,
+              predicted_class: event.result.predicted_class,
+              confidence: event.result.confidence,
+              all_probabilities: event.result.all_probabilities
+            })
+          : undefined
+      );
+      
+      console.log("🐍 Python result:", result); // Debug log
+      
+      // Extract the LLM response from the result
+      const llmResponse = result.llm_response || result.advice || "Analysis complete";
+      
+      console.log("💬 LLM Response:", llmResponse); // Debug log
+      
+      // Determine conversation title based on status
+      let conversationTitle = "";
+      if (result.status === "invalid_image") {
+        conversationTitle = "Invalid Image Upload";
+      } else if (result.status === "low_quality_prediction") {
+        conversationTitle = `${result.predicted_class} (Low Confidence)`;
+      } else if (result.status === "success") {
+        conversationTitle = `${result.predicted_class} Diagnosis`;
+      } else {
+        conversationTitle = "Image Analysis";
+      }
 
-    pythonProcess.stderr.on("data", (data: Buffer) => {
-      errorData += data.toString();
-    });
+      // Create a new conversation in the database
+      const conversation = await Conversation.create({
+        user_id,
+        title: conversationTitle,
+        category: 'plant-disease',
+        last_message_at: new Date()
+      });
 
-    pythonProcess.on("close", async (code: number) => {
-      try {
-        if (code !== 0) {
-          throw new Error(`Python process failed: ${errorData}`);
-        }
-        
-        const result = JSON.parse(resultData);
-        
-        console.log("🐍 Python result:", result); // Debug log
-        
-        // Extract the LLM response from the result
-        const llmResponse = result.llm_response || result.advice || "Analysis complete";
-        
-        console.log("💬 LLM Response:", llmResponse); // Debug log
-        
-        // Determine conversation title based on status
-        let conversationTitle = "";
-        if (result.status === "invalid_image") {
-          conversationTitle = "Invalid Image Upload";
-        } else if (result.status === "low_quality_prediction") {
-          conversationTitle = `${result.predicted_class} (Low Confidence)`;
-        } else if (result.status === "success") {
-          conversationTitle = `${result.predicted_class} Diagnosis`;
-        } else {
-          conversationTitle = "Image Analysis";
+      const convo_id = conversation.getDataValue('convo_id');
+      
+      // Save user's initial message (the image)
+      const userMessage = await Message.create({
+        convo_id,
+        role: 'user',
+        content: `Uploaded image for plant disease diagnosis`,
+        image_urls: [imageUrl],
+        metadata: {
+          original_filename: req.file!.originalname,
+          file_size: req.file!.size
         }
+      });
 
-        // Create a new conversation in the database
-        const conversation = await Conversation.create({
-          user_id,
-          title: conversationTitle,
-          category: 'plant-disease',
-          last_message_at: new Date()
-        });
-
-        const convo_id = conversation.getDataValue('convo_id');
-        
-        // Save user's initial message (the image)
-        const userMessage = await Message.create({
-          convo_id,
-          role: 'user',
-          content: `Uploaded image for plant disease diagnosis`,
-          image_urls: [imageUrl],
-          metadata: {
-            original_filename: req.file!.originalname,
-            file_size: req.file!.size
-          }
-        });
-
-        // Prepare assistant message metadata based on status
-        let assistantMetadata: any = {
-          predicted_class: result.predicted_class,
-          confidence: result.confidence,
-          model_used: 'plant-disease-detection',
-          diagnosis_timestamp: new Date(),
-          status: result.status || 'success'
-        };
-
-        // Add validation details for invalid images
-        if (result.validation_details) {
-          assistantMetadata.validation_details = result.validation_details;
-        }
-        
-        if (result.validation_score !== undefined) {
-          assistantMetadata.validation_score = result.validation_score;
+      // Prepare assistant message metadata based on status
+      let assistantMetadata: any = {
+        predicted_class: result.predicted_class,
+        confidence: result.confidence,
+        model_used: 'plant-disease-detection',
+        model_version: result.model_version,
+        diagnosis_timestamp: new Date(),
+        status: result.status || 'success'
+      };
+
+      // Add validation details for invalid images
+      if (result.validation_details) {
+        assistantMetadata.validation_details = result.validation_details;
+      }
+      
+      // A cascade that rejected before every check ran only knows a lower bound
+      if (result.validation_score_is_lower_bound) {
+        assistantMetadata.validation_score_lower_bound = result.validation_score;
+        // ...and, when the skipped checks could have changed it, the most likely reason
+        if (result.reason_is_exact === false) {
+          assistantMetadata.reason_is_exact = false;
         }
+      } else if (result.validation_score !== undefined) {
+        assistantMetadata.validation_score = result.validation_score;
+      }
 
-        // Add warning for low quality predictions
-        if (result.warning) {
-          assistantMetadata.warning = result.warning;
-        }
+      // Add warning for low quality predictions
+      if (result.warning) {
+        assistantMetadata.warning = result.warning;
+      }
 
-        // Add reason for invalid images
-        if (result.reason) {
-          assistantMetadata.reason = result.reason;
-        }
-        
-        // Add all probabilities if available
-        if (result.all_probabilities) {
-          assistantMetadata.all_probabilities = result.all_probabilities;
-        }
+      // Add reason for invalid images
+      if (result.reason) {
+        assistantMetadata.reason = result.reason;
+      }
+      
+      // Add all probabilities if available
+      if (result.all_probabilities) {
+        assistantMetadata.all_probabilities = result.all_probabilities;
+      }
+
+      // Per-leaf results and their combined verdict (ML_MULTI_LEAF=1)
+      if (result.leaves) {
+        assistantMetadata.leaves = result.leaves;
+        assistantMetadata.aggregate = result.aggregate;
+      }
 
-        // ✅ Save AI's diagnosis response - USE llmResponse here!
-        const assistantMessage = await Message.create({
-          convo_id,
-          role: 'assistant',
-          content: llmResponse, // ✅ This is the key fix
+      // ✅ Save AI's diagnosis response - USE llmResponse here!
+      const assistantMessage = await Message.create({
+        convo_id,
+        role: 'assistant',
+        content: llmResponse, // ✅ This is the key fix
+        metadata: assistantMetadata
+      });
+
+      // Initialize conversation history for ML context
+      let systemContextMessage = "";
+      
+      if (result.status === "invalid_image") {
+        systemContextMessage = `The user uploaded an image that was not identified as a coffee plant leaf. The system said: "${llmResponse}". Help them understand they need to upload a proper coffee leaf image for diagnosis.`;
+      } else if (result.status === "low_quality_prediction") {
+        systemContextMessage = `You are an expert coffee plant agronomist. The user received a low-confidence diagnosis: ${result.predicted_class} with ${(result.confidence * 100).toFixed(2)}% confidence. The image quality may be poor or it may not be a coffee leaf. Previous advice: ${llmResponse}. Help the user get a better diagnosis or answer their questions about coffee plant care.`;
+      } else {
+        systemContextMessage = `You are an expert coffee plant agronomist. The user just received a diagnosis: ${result.predicted_class} with ${(result.confidence * 100).toFixed(2)}% confidence. Previous advice: ${llmResponse}. Continue helping the user with follow-up questions about this diagnosis or coffee plant care in general.`;
+      }
+
+      const initialContext = {
+        role: "system",
+        content: systemContextMessage
+      };
+      
+      conversationHistories.set(convo_id, [initialContext]);
+      
+      console.log("✅ Prediction completed and saved to database");
+      
+      // Return consistent structure
+      const payload = {
+        success: true,
+        conversation: {
+          convo_id: convo_id,
+          title: conversation.title
+        },
+        userMessage: {
+          message_id: userMessage.message_id,
+          content: userMessage.content,
+          image_urls: userMessage.image_urls,
+          created_at: userMessage.created_at,
+          metadata: userMessage.metadata
+        },
+        assistantMessage: {
+          message_id: assistantMessage.message_id,
+          content: llmResponse, // ✅ Send the actual LLM response
+          created_at: assistantMessage.created_at,
           metadata: assistantMetadata
-        });
-
-        // Initialize conversation history for ML context
-        let systemContextMessage = "";
-        
-        if (result.status === "invalid_image") {
-          systemContextMessage = `The user uploaded an image that was not identified as a coffee plant leaf. The system said: "${llmResponse}". Help them understand they need to upload a proper coffee leaf image for diagnosis.`;
-        } else if (result.status === "low_quality_prediction") {
-          systemContextMessage = `You are an expert coffee plant agronomist. The user received a low-confidence diagnosis: ${result.predicted_class} with ${(result.confidence * 100).toFixed(2)}% confidence. The image quality may be poor or it may not be a coffee leaf. Previous advice: ${llmResponse}. Help the user get a better diagnosis or answer their questions about coffee plant care.`;
-        } else {
-          systemContextMessage = `You are an expert coffee plant agronomist. The user just received a diagnosis: ${result.predicted_class} with ${(result.confidence * 100).toFixed(2)}% confidence. Previous advice: ${llmResponse}. Continue helping the user with follow-up questions about this diagnosis or coffee plant care in general.`;
+        },
+        // Include prediction data for backward compatibility
+        prediction: {
+          predicted_class: result.predicted_class,
+          confidence: result.confidence,
+          status: result.status,
+          model_version: result.model_version,
+          conversationId: convo_id,
+          llm_response: llmResponse // ✅ Include here too for fallback
         }
+      };
 
-        const initialContext = {
-          role: "system",
-          content: systemContextMessage
-        };
-        
-        conversationHistories.set(convo_id, [initialContext]);
-        
-        console.log("✅ Prediction completed and saved to database");
-        
-        // Return consistent structure
-        res.json({ 
-          success: true,
-          conversation: {
-            convo_id: convo_id,
-            title: conversation.title
-          },
-          userMessage: {
-            message_id: userMessage.message_id,
-            content: userMessage.content,
-            image_urls: userMessage.image_urls,
-            created_at: userMessage.created_at,
-            metadata: userMessage.metadata
-          },
-          assistantMessage: {
-            message_id: assistantMessage.message_id,
-            content: llmResponse, // ✅ Send the actual LLM response
-            created_at: assistantMessage.created_at,
-            metadata: assistantMetadata
-          },
-          // Include prediction data for backward compatibility
-          prediction: {
-            predicted_class: result.predicted_class,
-            confidence: result.confidence,
-            status: result.status,
-            conversationId: convo_id,
-            llm_response: llmResponse // ✅ Include here too for fallback
-          }
-        });
-      } catch (err) {
-        console.error("❌ Processing Error:", err);
-        res.status(500).json({ 
-          error: "Failed to process prediction",
-          details: err instanceof Error ? err.message : "Unknown error"
-        });
+      if (streaming) {
+        sendEvent("done", payload);
+        res.end();
+      } else {
+        res.json(payload);
+      }
+    } catch (err) {
+      console.error("❌ Processing Error:", err);
+      const failure = {
+        error: "Failed to process prediction",
+        details: err instanceof Error ? err.message : "Unknown error"
+      };
+
+      if (streaming) {
+        sendEvent("error", failure);
+        res.end();
+      } else {
+        res.status(500).json(failure);
       }
+    }
 
-      // Clean up uploaded file
-      fs.unlink(imgPath, () => {});
-    });
+    // Clean up uploaded file
+    fs.unlink(imgPath, () => {});
 
   } catch (err) {
     console.error("❌ Route error:", err);
+    if (res.headersSent) {
+      res.end();
+      return;
+    }
     res.status(500).json({ error: "Prediction failed" });
   }
 });
@@ -311,136 +377,188 @@ router.post("/chat", authenticateToken, express.json(), async (req: Request, res
       content: message
     });
 
-    // ✅ Create a temporary file to store the conversation
-    const tempFileName = `chat_${Date.now()}_${Math.random().toString(36).substr(2, 9)}.json`;
-    const tempFilePath = path.join(process.cwd(), "uploads", tempFileName);
+    // Stream the reply as server-sent events when the client asks for it
+    const streaming = req.body.stream === true || (req.headers.accept || "").includes("text/event-stream");
+    const sendEvent = (event: string, data: unknown) => {
+      res.write(`event: ${event}\ndata: ${JSON.stringify(data)}\n\n`);
+    };
+
+    if (streaming) {
+      res.setHeader("Content-Type", "text/event-stream");
+      res.setHeader("Cache-Control", "no-cache");
+      res.setHeader("Connection", "keep-alive");
+      res.setHeader("X-Accel-Buffering", "no");
+      res.flushHeaders();
+    }
 
     try {
-      // Write conversation history to temp file
-      fs.writeFileSync(tempFilePath, JSON.stringify(conversationHistory), 'utf-8');
-      console.log("Created temp file:", tempFilePath);
-
-      const scriptPath = path.join(process.cwd(), "ml", "chat.py");
-      
-      if (!fs.existsSync(scriptPath)) {
-        console.error("Chat script not found at:", scriptPath);
-        res.status(500).json({ error: "Chat script not found" });
-        return;
-      }
-
-      const pythonProcess = spawn(
-        "python3", 
-        [scriptPath, tempFilePath],
-        { shell: true }
+      // The conversation goes to a warm chat worker inline, no temp file
+      const { result } = await chatWorkers.request(
+        { type: "chat", messages: conversationHistory, conversation_id: convo_id, stream: streaming },
+        undefined,
+        streaming ? (event) => sendEvent("delta", { content: event.content }) : undefined
       );
 
-      let resultData = "";
-      let errorData = "";
-
-      pythonProcess.stdout.on("data", (data: Buffer) => {
-        resultData += data.toString();
-      });
+      // Check for errors from Python
+      if (result.error) {
+        throw new Error(result.error);
+      }
 
-      pythonProcess.stderr.on("data", (data: Buffer) => {
-        errorData += data.toString();
+      // ===== DATABASE INTEGRATION: Save AI's response =====
+      const assistantMessage = await Message.create({
+        convo_id: convo_id,
+        role: 'assistant',
+        content: result.response,
+        metadata: {
+          model_used: 'ml-chat-model',
+          response_timestamp: new Date()
+        }
       });
 
-      pythonProcess.on("close", async (code: number) => {
-        // Clean up temp file
-        try {
-          fs.unlinkSync(tempFilePath);
-          console.log("Deleted temp file");
-        } catch (err) {
-          console.error("Failed to delete temp file:", err);
-        }
+      // Update conversation's last_message_at
+      conversation.last_message_at = new Date();
+      await conversation.save();
 
-        try {
-          if (code !== 0) {
-            throw new Error(`Chat process failed: ${errorData}`);
-          }
-
-          if (!resultData.trim()) {
-            throw new Error("No output from Python script");
-          }
-
-          console.log("Python response:", resultData);
-          const result = JSON.parse(resultData);
-
-          // Check for errors from Python
-          if (result.error) {
-            throw new Error(result.error);
-          }
-
-          // ===== DATABASE INTEGRATION: Save AI's response =====
-          const assistantMessage = await Message.create({
-            convo_id: convo_id,
-            role: 'assistant',
-            content: result.response,
-            metadata: {
-              model_used: 'ml-chat-model',
-              response_timestamp: new Date()
-            }
-          });
-
-          // Update conversation's last_message_at
-          conversation.last_message_at = new Date();
-          await conversation.save();
-
-          // Add assistant response to history
-          conversationHistory.push({
-            role: "assistant",
-            content: result.response
-          });
-
-          // Update stored history (keep last 20 messages)
-          if (conversationHistory.length > 20) {
-            conversationHistory = [
-              conversationHistory[0],
-              ...conversationHistory.slice(-19)
-            ];
-          }
-          
-          conversationHistories.set(convo_id, conversationHistory);
-          console.log("✅ Chat completed and saved to database");
-
-          res.json({
-            response: result.response,
-            conversationId: convo_id,
-            userMessage: {
-              message_id: userMessage.message_id,
-              content: userMessage.content,
-              created_at: userMessage.created_at
-            },
-            assistantMessage: {
-              message_id: assistantMessage.message_id,
-              content: assistantMessage.content,
-              created_at: assistantMessage.created_at
-            },
-            success: true
-          });
-
-        } catch (err) {
-          console.error("❌ Chat processing error:", err);
-          res.status(500).json({
-            error: "Failed to process chat",
-            details: err instanceof Error ? err.message : "Unknown error",
-            pythonOutput: resultData,
-            pythonError: errorData
-          });
-        }
+      // Add assistant response to history
+      conversationHistory.push({
+        role: "assistant",
+        content: result.response
       });
 
-    } catch (fileErr) {
-      console.error("❌ Failed to write temp file:", fileErr);
-      res.status(500).json({ error: "Failed to create temporary file" });
+      // Update stored history (keep last 20 messages)
+      if (conversationHistory.length > 20) {
+        conversationHistory = [
+          conversationHistory[0],
+          ...conversationHistory.slice(-19)
+        ];
+      }
+      
+      conversationHistories.set(convo_id, conversationHistory);
+      console.log("✅ Chat completed and saved to database");
+
+      const payload = {
+        response: result.response,
+        conversationId: convo_id,
+        userMessage: {
+          message_id: userMessage.message_id,
+          content: userMessage.content,
+          created_at: userMessage.created_at
+        },
+        assistantMessage: {
+          message_id: assistantMessage.message_id,
+          content: assistantMessage.content,
+          created_at: assistantMessage.created_at
+        },
+        success: true
+      };
+
+      if (streaming) {
+        sendEvent("done", payload);
+        res.end();
+      } else {
+        res.json(payload);
+      }
+
+    } catch (err) {
+      console.error("❌ Chat processing error:", err);
+      const failure = {
+        error: "Failed to process chat",
+        details: err instanceof Error ? err.message : "Unknown error"
+      };
+
+      if (streaming) {
+        sendEvent("error", failure);
+        res.end();
+      } else {
+        res.status(500).json(failure);
+      }
     }
 
   } catch (err) {
     console.error("❌ Chat route error:", err);
+    if (res.headersSent) {
+      res.end();
+      return;
+    }
     res.status(500).json({ error: "Chat request failed" });
   }
 });
 
+// ====== GET /api/ml/metrics (Stage timings of the prediction workers) ======
+// Disabled unless ML_METRICS_TOKEN is set; scrapers send it as a bearer token
+router.get("/metrics", async (req: Request, res: Response): Promise<void> => {
+  const token = process.env.ML_METRICS_TOKEN;
+  if (!token || req.headers.authorization !== `Bearer ${token}`) {
+    res.status(404).json({ error: "Not found" });
+    return;
+  }
+
+  try {
+    const responses = await predictWorkers.requestAll({ type: "metrics", format: "json" }, 10000);
+    const snapshots = responses.map((response) => response.metrics);
+
+    if (req.query.format === "prometheus") {
+      // One worker renders the merged histograms of all of them
+      const { metrics } = await predictWorkers.request({ type: "metrics", format: "prometheus", snapshots }, 10000);
+      res.type("text/plain; version=0.0.4").send(metrics);
+      return;
+    }
+
+    res.json({ workers: snapshots, success: true });
+  } catch (err) {
+    console.error("Error fetching ML metrics:", err);
+    res.status(500).json({
+      error: "Failed to fetch ML metrics",
+      details: err instanceof Error ? err.message : 'Unknown error'
+    });
+  }
+});
+
+// ====== GET/POST /api/ml/model (Model version served by the prediction workers) ======
+// Disabled unless ML_ADMIN_TOKEN is set. POST { "version": "v2" } loads,
+// warms up and swaps in a version on every worker without a restart;
+// POST { "rollback": true } goes back to the version served before
+async function modelAdmin(req: Request, res: Response, payload: Record<string, unknown>): Promise<void> {
+  const token = process.env.ML_ADMIN_TOKEN;
+  if (!token || req.headers.authorization !== `Bearer ${token}`) {
+    res.status(404).json({ error: "Not found" });
+    return;
+  }
+
+  try {
+    const responses = await predictWorkers.requestAll(payload, 300000);
+    const models = responses.map((response) => response.model);
+
+    // Workers started later (e.g. after a crash) load the same version
+    const active = models[0]?.active?.version;
+    if (active && payload.type !== "health") {
+      predictWorkers.setWorkerEnv({ ML_MODEL_VERSION: active });
+    }
+
+    res.json({ workers: models, success: true });
+  } catch (err) {
+    console.error("Error changing ML model version:", err);
+    res.status(500).json({
+      error: "Failed to change ML model version",
+      details: err instanceof Error ? err.message : 'Unknown error'
+    });
+  }
+}
+
+router.get("/model", async (req: Request, res: Response): Promise<void> => {
+  await modelAdmin(req, res, { type: "health" });
+});
+
+router.post("/model", express.json(), async (req: Request, res: Response): Promise<void> => {
+  if (req.body?.rollback) {
+    await modelAdmin(req, res, { type: "rollback_model" });
+  } else if (typeof req.body?.version === "string" && req.body.version) {
+    await modelAdmin(req, res, { type: "reload_model", version: req.body.version });
+  } else {
+    res.status(400).json({ error: "Provide a version or rollback: true" });
+  }
+});
+
 // Get all conversations for authenticated user
 router.get("/conversations", authenticateToken, async (req: Request, res: Response): Promise<void> => {
   try {
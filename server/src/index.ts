@@ -7,7 +7,7 @@ import userRoutes from '../routes/userRoutes.js';
 import sequelize from '../database/db.js';
 import authRoutes from '../routes/authRoutes.js';
 import passport from '../utils/passport.js';
-import mlRoutes from '../routes/mlRoutes.js';
+import mlRoutes, { predictWorkers, chatWorkers } from '../routes/mlRoutes.js';
 import { verifyMailer } from '../utils/mailer.js';
 
 const app = express();
@@ -45,6 +45,10 @@ sequelize.authenticate()
     // Start server on 0.0.0.0 to accept external connections
     app.listen(port, '0.0.0.0', () => {
       console.log(`Server is running on port ${port}`);
+
+      // Warm up the prediction workers so the first upload doesn't pay for model loading
+      predictWorkers.start();
+      chatWorkers.start();
     });
   })
   .catch((err) => {
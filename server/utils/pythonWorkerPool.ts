@@ -0,0 +1,307 @@
+import path from "path";
+import readline from "readline";
+import { spawn, type ChildProcessWithoutNullStreams } from "child_process";
+
+type PendingRequest = {
+  resolve: (message: any) => void;
+  reject: (err: Error) => void;
+  onEvent?: (message: any) => void;
+  timer: NodeJS.Timeout;
+};
+
+type PoolWorker = {
+  process: ChildProcessWithoutNullStreams;
+  ready: boolean;
+  pending: Map<string, PendingRequest>;
+  // Health probe awaiting its answer; kept out of pending so it never
+  // counts as load
+  probe?: { id: string; timer: NodeJS.Timeout };
+  lastHealthAt: number;
+};
+
+export type PythonWorkerPoolOptions = {
+  scriptPath: string;
+  args?: string[];
+  size?: number;
+  requestTimeoutMs?: number;
+  healthIntervalMs?: number;
+  healthTimeoutMs?: number;
+  // A worker that exits is replaced after respawnDelayMs, doubling with
+  // every exit in a row (up to respawnMaxDelayMs) until one becomes ready
+  respawnDelayMs?: number;
+  respawnMaxDelayMs?: number;
+  // Exits in a row after which a slot is no longer restarted
+  maxConsecutiveExits?: number;
+};
+
+/**
+ * Keeps a pool of long-lived Python workers warm and talks to them
+ * over JSON lines on stdin/stdout.
+ */
+export class PythonWorkerPool {
+  private workers: PoolWorker[] = [];
+  private nextId = 0;
+  private started = false;
+  private healthTimer?: NodeJS.Timeout;
+  private workerEnv: Record<string, string> = {};
+  // Exits in a row per slot, reset when its worker becomes ready
+  private exits: number[] = [];
+  // Set once every slot stopped restarting; fails all requests
+  private failure?: Error;
+  private readonly options: Required<PythonWorkerPoolOptions>;
+
+  constructor(options: PythonWorkerPoolOptions) {
+    this.options = {
+      args: [],
+      size: 1,
+      requestTimeoutMs: 120000,
+      healthIntervalMs: 30000,
+      healthTimeoutMs: 10000,
+      respawnDelayMs: 1000,
+      respawnMaxDelayMs: 30000,
+      maxConsecutiveExits: 5,
+      ...options
+    };
+  }
+
+  start(): void {
+    if (this.started) return;
+    this.started = true;
+    this.exits = new Array(this.options.size).fill(0);
+    this.failure = undefined;
+
+    for (let i = 0; i < this.options.size; i++) {
+      this.workers.push(this.spawnWorker(i));
+    }
+
+    this.healthTimer = setInterval(() => this.checkHealth(), this.options.healthIntervalMs);
+    this.healthTimer.unref();
+  }
+
+  stop(): void {
+    this.started = false;
+    if (this.healthTimer) clearInterval(this.healthTimer);
+
+    for (const worker of this.workers) {
+      // Slots waiting to respawn still hold their exited worker
+      if (worker.process.exitCode === null && worker.process.signalCode === null) {
+        worker.process.stdin.write(JSON.stringify({ type: "shutdown" }) + "\n");
+      }
+    }
+    this.workers = [];
+  }
+
+  /**
+   * Sends one request to the least busy ready worker and resolves with its response.
+   * Intermediate messages for the request go to onEvent: "delta" (streamed
+   * chat output) and "prediction" (a diagnosis ahead of its LLM text).
+   */
+  async request(
+    payload: Record<string, unknown>,
+    timeoutMs = this.options.requestTimeoutMs,
+    onEvent?: (message: any) => void
+  ): Promise<any> {
+    if (!this.started) this.start();
+
+    const worker = await this.pickWorker();
+    return this.send(worker, payload, timeoutMs, onEvent);
+  }
+
+  /**
+   * Sends the same request to every ready worker and resolves with all responses
+   */
+  async requestAll(payload: Record<string, unknown>, timeoutMs = this.options.requestTimeoutMs): Promise<any[]> {
+    if (!this.started) this.start();
+
+    await this.pickWorker();
+    const ready = this.workers.filter((w) => w.ready);
+    return Promise.all(ready.map((worker) => this.send(worker, payload, timeoutMs)));
+  }
+
+  /**
+   * Extra environment for workers spawned from now on, e.g. replacements
+   * for crashed ones
+   */
+  setWorkerEnv(env: Record<string, string>): void {
+    this.workerEnv = { ...this.workerEnv, ...env };
+  }
+
+  private send(
+    worker: PoolWorker,
+    payload: Record<string, unknown>,
+    timeoutMs: number,
+    onEvent?: (message: any) => void
+  ): Promise<any> {
+    const id = `${process.pid}-${++this.nextId}`;
+
+    return new Promise((resolve, reject) => {
+      const timer = setTimeout(() => {
+        worker.pending.delete(id);
+        reject(new Error(`Python worker timed out after ${timeoutMs}ms`));
+      }, timeoutMs);
+
+      worker.pending.set(id, { resolve, reject, onEvent, timer });
+      worker.process.stdin.write(JSON.stringify({ ...payload, id }) + "\n");
+    });
+  }
+
+  private spawnWorker(index: number): PoolWorker {
+    // The worker's slot in the pool lets it pick its own cores (ML_CPU_AFFINITY=auto)
+    const child = spawn("python3", [this.options.scriptPath, ...this.options.args], {
+      cwd: path.dirname(this.options.scriptPath),
+      env: {
+        ...process.env,
+        ...this.workerEnv,
+        ML_WORKER_INDEX: String(index),
+        ML_WORKER_COUNT: String(this.options.size)
+      }
+    });
+
+    const worker: PoolWorker = {
+      process: child,
+      ready: false,
+      pending: new Map(),
+      lastHealthAt: Date.now()
+    };
+
+    readline.createInterface({ input: child.stdout }).on("line", (line: string) => {
+      let message: any;
+      try {
+        message = JSON.parse(line);
+      } catch {
+        console.error("Python worker sent invalid JSON:", line);
+        return;
+      }
+
+      if (message.type === "ready") {
+        worker.ready = true;
+        const index = this.workers.indexOf(worker);
+        if (index !== -1) this.exits[index] = 0;
+        console.log(`✅ Python worker ready (pid ${child.pid})`);
+        return;
+      }
+
+      if (message.type === "health") {
+        worker.lastHealthAt = Date.now();
+        if (worker.probe && message.id === worker.probe.id) {
+          clearTimeout(worker.probe.timer);
+          worker.probe = undefined;
+          return;
+        }
+      }
+
+      const pending = message.id ? worker.pending.get(message.id) : undefined;
+      if (!pending) return;
+
+      if (message.type === "delta" || message.type === "prediction") {
+        pending.onEvent?.(message);
+        return;
+      }
+
+      worker.pending.delete(message.id);
+      clearTimeout(pending.timer);
+
+      if (message.type === "error") {
+        pending.reject(new Error(message.error));
+      } else {
+        pending.resolve(message);
+      }
+    });
+
+    child.stderr.on("data", (data: Buffer) => {
+      process.stderr.write(`[python ${child.pid}] ${data.toString()}`);
+    });
+
+    child.on("exit", (code) => {
+      console.error(`❌ Python worker ${child.pid} exited with code ${code}`);
+      worker.ready = false;
+
+      if (worker.probe) {
+        clearTimeout(worker.probe.timer);
+        worker.probe = undefined;
+      }
+
+      for (const pending of worker.pending.values()) {
+        clearTimeout(pending.timer);
+        pending.reject(new Error(`Python worker exited with code ${code}`));
+      }
+      worker.pending.clear();
+
+      const index = this.workers.indexOf(worker);
+      if (index !== -1 && this.started) {
+        this.scheduleRespawn(index, worker, code);
+      }
+    });
+
+    return worker;
+  }
+
+  /**
+   * Replaces the exited worker of a slot so the pool stays warm, with
+   * exponential backoff so a worker that crashes on startup (bad import,
+   * missing model) doesn't respawn in a hot loop. After
+   * maxConsecutiveExits the slot is left empty; once every slot is,
+   * waiting and new requests fail instead of waiting for a worker
+   */
+  private scheduleRespawn(index: number, worker: PoolWorker, code: number | null): void {
+    const exits = ++this.exits[index];
+    if (exits >= this.options.maxConsecutiveExits) {
+      console.error(`❌ Python worker slot ${index} exited ${exits} times in a row, not restarting it`);
+      if (this.exits.every((n) => n >= this.options.maxConsecutiveExits)) {
+        this.failure = new Error(
+          `Python workers (${this.options.scriptPath}) keep exiting on startup ` +
+            `(${exits} times in a row, last exit code ${code}); not restarting them`
+        );
+      }
+      return;
+    }
+
+    const delay = Math.min(this.options.respawnMaxDelayMs, this.options.respawnDelayMs * 2 ** (exits - 1));
+    console.error(`🔄 Restarting Python worker slot ${index} in ${delay}ms`);
+    const timer = setTimeout(() => {
+      if (this.started && this.workers[index] === worker) {
+        this.workers[index] = this.spawnWorker(index);
+      }
+    }, delay);
+    timer.unref();
+  }
+
+  private async pickWorker(): Promise<PoolWorker> {
+    // Wait for at least one worker to finish loading the model
+    for (let waited = 0; waited < this.options.requestTimeoutMs; waited += 100) {
+      if (this.failure) throw this.failure;
+      const ready = this.workers.filter((w) => w.ready);
+      if (ready.length > 0) {
+        return ready.reduce((a, b) => (a.pending.size <= b.pending.size ? a : b));
+      }
+      await new Promise((r) => setTimeout(r, 100));
+    }
+    throw new Error("No Python worker became ready in time");
+  }
+
+  /**
+   * Probes every ready worker. Workers answer health checks between
+   * requests as well as during them, so a probe left unanswered for
+   * healthTimeoutMs means the worker is hung: it is killed, which fails
+   * its pending requests and spawns a replacement
+   */
+  private checkHealth(): void {
+    for (const worker of this.workers) {
+      if (!worker.ready || worker.probe) continue;
+
+      const id = `${process.pid}-health-${++this.nextId}`;
+      const timer = setTimeout(() => {
+        worker.probe = undefined;
+        console.error(
+          `❌ Python worker ${worker.process.pid} didn't answer a health check in ` +
+            `${this.options.healthTimeoutMs}ms, restarting`
+        );
+        worker.process.kill("SIGKILL");
+      }, this.options.healthTimeoutMs);
+      timer.unref();
+
+      worker.probe = { id, timer };
+      worker.process.stdin.write(JSON.stringify({ type: "health", id }) + "\n");
+    }
+  }
+}